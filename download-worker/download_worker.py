@@ -32,6 +32,15 @@ logger = logging.getLogger(__name__)
 # Redis connection
 redis_conn = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
 ESSENTIA_DATA_DIR = os.getenv('ESSENTIA_DATA_DIR', '/app/essentia-data')
+# Set when essentia-api mounts the same audio volume (as ESSENTIA_AUDIO_ROOT),
+# so it can read files in place instead of downloading them back from the app.
+ESSENTIA_SHARED_AUDIO = os.getenv('ESSENTIA_SHARED_AUDIO', '').lower() in ('1', 'true', 'yes')
+# Set when essentia-api mounts ESSENTIA_DATA_DIR too: it saves the full JSON
+# there and returns only the summary descriptors update_track_analysis reads.
+ESSENTIA_SAVES_ANALYSIS = os.getenv('ESSENTIA_SAVES_ANALYSIS', '').lower() in ('1', 'true', 'yes')
+# The extractor decodes (and downmixes) mp3/m4a/flac itself, so by default the
+# original file is analyzed; set to true to convert to a mono WAV first.
+ESSENTIA_WAV_CONVERSION = os.getenv('ESSENTIA_WAV_CONVERSION', '').lower() in ('1', 'true', 'yes')
 JOBS_UPDATED_INDEX_KEY = os.getenv('JOBS_UPDATED_INDEX_KEY', 'jobs:updated')
 JOB_TTL_ACTIVE_SECONDS = int(os.getenv('JOB_TTL_ACTIVE_SECONDS', '604800'))
 JOB_TTL_TERMINAL_SECONDS = int(os.getenv('JOB_TTL_TERMINAL_SECONDS', '259200'))
@@ -106,11 +115,14 @@ def cleanup_download_directory(download_dir: str, track_id: str):
         logger.error(f"Download directory cleanup failed: {e}")
         raise
 
+def essentia_analysis_filename(track_id: str, friend_id: int) -> str:
+    safe_track_id = "".join(c if c.isalnum() or c in "._-" else "_" for c in track_id)
+    return f"{safe_track_id}_{friend_id}.json"
+
 def save_essentia_analysis_file(track_id: str, friend_id: int, analysis_data: Dict[str, Any]) -> str:
     """Persist raw Essentia analysis JSON per track/friend."""
     os.makedirs(ESSENTIA_DATA_DIR, exist_ok=True)
-    safe_track_id = "".join(c if c.isalnum() or c in "._-" else "_" for c in track_id)
-    file_path = os.path.join(ESSENTIA_DATA_DIR, f"{safe_track_id}_{friend_id}.json")
+    file_path = os.path.join(ESSENTIA_DATA_DIR, essentia_analysis_filename(track_id, friend_id))
     payload = {
         "track_id": track_id,
         "friend_id": friend_id,
@@ -122,31 +134,51 @@ def save_essentia_analysis_file(track_id: str, friend_id: int, analysis_data: Di
         f.write("\n")
     return file_path
 
+def essentia_audio_source(audio_path: str) -> Dict[str, str]:
+    """Build the /analyze payload: a shared-volume path when possible, else the app's audio URL."""
+    if ESSENTIA_SHARED_AUDIO:
+        relative = os.path.relpath(audio_path, '/app/audio')
+        if not relative.startswith('..'):
+            return {'path': relative}
+    audio_filename = os.path.basename(audio_path)
+    return {'filename': f"http://app:3000/api/audio?filename={audio_filename}"}
+
+def convert_to_wav(file_path: str) -> str:
+    """Convert to a mono WAV next to file_path for analysis."""
+    wav_path = file_path.replace(os.path.splitext(file_path)[1], '.wav')
+    ffmpeg_cmd = ['ffmpeg', '-y', '-i', file_path, '-ac', '1', wav_path]
+    logger.info(f"Converting audio to wav: {' '.join(ffmpeg_cmd)}")
+    result = run_subprocess(ffmpeg_cmd, timeout=120)
+
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg conversion failed: {result.stderr}")
+
+    if not os.path.exists(wav_path) or os.path.getsize(wav_path) == 0:
+        raise Exception("WAV conversion produced empty file")
+    return wav_path
+
 def analyze_audio_file(file_path: str, track_id: str, friend_id: int) -> Dict[str, Any]:
     """Analyze audio file using the app's analysis API"""
+    analysis_path = file_path
     try:
-        # Convert to wav for analysis
-        wav_path = file_path.replace(os.path.splitext(file_path)[1], '.wav')
-        ffmpeg_cmd = ['ffmpeg', '-y', '-i', file_path, '-ac', '1', wav_path]
-        logger.info(f"Converting audio to wav: {' '.join(ffmpeg_cmd)}")
-        result = run_subprocess(ffmpeg_cmd, timeout=120)
-
-        if result.returncode != 0:
-            raise Exception(f"FFmpeg conversion failed: {result.stderr}")
-
-        if not os.path.exists(wav_path) or os.path.getsize(wav_path) == 0:
-            raise Exception("WAV conversion produced empty file")
+        if ESSENTIA_WAV_CONVERSION:
+            analysis_path = convert_to_wav(file_path)
 
         # Call Essentia API for analysis
-        wav_filename = os.path.basename(wav_path)
-        audio_url = f"http://app:3000/api/audio?filename={wav_filename}"
+        audio_source = essentia_audio_source(analysis_path)
+        if ESSENTIA_SAVES_ANALYSIS:
+            audio_source.update(
+                summary=True,
+                save_as=essentia_analysis_filename(track_id, friend_id),
+                save_meta={'track_id': track_id, 'friend_id': friend_id},
+            )
 
         essentia_url = os.getenv('ESSENTIA_API_URL', 'http://essentia:8001/analyze')
-        logger.info(f"Calling Essentia API: {essentia_url} with audio: {audio_url}")
+        logger.info(f"Calling Essentia API: {essentia_url} with audio: {audio_source}")
 
         response = requests.post(
             essentia_url,
-            json={'filename': audio_url},
+            json=audio_source,
             timeout=300
         )
 
@@ -155,15 +187,16 @@ def analyze_audio_file(file_path: str, track_id: str, friend_id: int) -> Dict[st
 
         analysis_result = response.json()
         logger.info("Audio analysis completed successfully")
-        try:
-            saved_file = save_essentia_analysis_file(track_id, friend_id, analysis_result)
-            logger.info("Saved Essentia analysis JSON to %s", saved_file)
-        except Exception as save_err:
-            logger.warning("Failed to save Essentia analysis JSON: %s", save_err)
+        if not ESSENTIA_SAVES_ANALYSIS:
+            try:
+                saved_file = save_essentia_analysis_file(track_id, friend_id, analysis_result)
+                logger.info("Saved Essentia analysis JSON to %s", saved_file)
+            except Exception as save_err:
+                logger.warning("Failed to save Essentia analysis JSON: %s", save_err)
 
         # Clean up wav file
-        if os.path.exists(wav_path):
-            os.unlink(wav_path)
+        if analysis_path != file_path and os.path.exists(analysis_path):
+            os.unlink(analysis_path)
 
         # Extract year from source audio metadata when available (e.g. iTunes `date` tag).
         audio_year = get_audio_metadata_year(file_path)
@@ -176,7 +209,7 @@ def analyze_audio_file(file_path: str, track_id: str, friend_id: int) -> Dict[st
         logger.error(f"Audio analysis failed: {e}")
         # Clean up wav file on error
         wav_path = file_path.replace(os.path.splitext(file_path)[1], '.wav')
-        if os.path.exists(wav_path):
+        if ESSENTIA_WAV_CONVERSION and wav_path != file_path and os.path.exists(wav_path):
             os.unlink(wav_path)
         raise
 
@@ -0,0 +1,142 @@
+import hashlib, json, os, shutil, threading
+from collections import OrderedDict
+from functools import lru_cache
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_digest(path):
+    """sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=256)
+def _fingerprint(path):
+    try:
+        return file_digest(path)
+    except OSError:
+        return "missing"
+
+
+def extractor_version(extractor):
+    """ESSENTIA_EXTRACTOR_VERSION, or else a fingerprint of the extractor binary."""
+    return os.getenv("ESSENTIA_EXTRACTOR_VERSION") or _fingerprint(shutil.which(extractor) or extractor)
+
+
+def cache_key(audio_digest, profile, version):
+    """Key for one analysis: the audio, the profile YAML and the extractor build."""
+    salt = f"{audio_digest}:{_fingerprint(profile)}:{version}"
+    return hashlib.sha256(salt.encode()).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Disk-backed LRU of extractor JSON, bounded by total file size.
+
+    Entries live at <directory>/<key[:2]>/<key>.json. Recency is the file
+    mtime, so the LRU order survives restarts. A max_bytes of 0 disables the
+    cache.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            try:
+                self._load()
+            except OSError as e:
+                print(f"[cache] disabled, cannot use {directory}: {e}", flush=True)
+                self.directory = None
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _load(self):
+        found = []
+        os.makedirs(self.directory, exist_ok=True)
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    os.unlink(os.path.join(root, name))
+                elif name.endswith(".json"):
+                    stat = os.stat(os.path.join(root, name))
+                    found.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            path = self._path(key)
+            with open(path, "rb") as f:
+                result = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self._bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+            }
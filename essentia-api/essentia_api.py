@@ -1,36 +1,686 @@
-import os, subprocess, json, tempfile, requests
+import asyncio, hashlib, math, os, json, shutil, subprocess, tempfile, time, wave, requests
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import warm_pool
+from analysis_cache import AnalysisCache, cache_key, extractor_version, file_digest
+from metrics import (
+    ANALYSES,
+    BACKGROUND,
+    CACHE_BYTES,
+    CACHE_LOOKUPS,
+    DOWNLOAD_BYTES,
+    DOWNLOAD_SECONDS,
+    ERRORS,
+    EXTRACTOR_SECONDS,
+    IN_FLIGHT,
+    QUEUED,
+    SLOTS,
+    render_metrics,
+)
+
+EXTRACTOR = "essentia_streaming_extractor_music"
+PROFILE_PATH = os.getenv("ESSENTIA_PROFILE", "/etc/essentia/profile.yaml")
+# Each extractor run is single-threaded, so one per core saturates the box.
+CONCURRENCY = max(1, int(os.getenv("ESSENTIA_CONCURRENCY", str(os.cpu_count() or 1))))
+EXTRACTOR_TIMEOUT = float(os.getenv("ESSENTIA_EXTRACTOR_TIMEOUT", "900"))
+MAX_DOWNLOAD_BYTES = int(os.getenv("ESSENTIA_MAX_DOWNLOAD_BYTES", str(1024 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT = float(os.getenv("ESSENTIA_DOWNLOAD_TIMEOUT", "60"))
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+# Shared audio volume that "path" requests may read from; unset disables them.
+AUDIO_ROOT = os.getenv("ESSENTIA_AUDIO_ROOT")
+# "python" runs MusicExtractor in warm worker processes, "subprocess" spawns
+# the extractor binary per track; "auto" uses python when the bindings import.
+BACKEND = os.getenv("ESSENTIA_BACKEND", "auto")
+CACHE_DIR = os.getenv("ESSENTIA_CACHE_DIR", "/app/cache")
+CACHE_MAX_BYTES = int(os.getenv("ESSENTIA_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Where "save_as" writes the full extractor JSON; unset disables saving.
+DATA_DIR = os.getenv("ESSENTIA_DATA_DIR")
+FAST_WINDOW_SECONDS = float(os.getenv("ESSENTIA_FAST_WINDOW_SECONDS", "60"))
+FAST_DEFAULT_START = float(os.getenv("ESSENTIA_FAST_DEFAULT_START", "30"))
+# Windows snap to this grid so fast profiles (and the warm workers'
+# extractors built from them) come from a small fixed set.
+FAST_WINDOW_STEP = 30.0
+# Optional YAML with {start} and {end} placeholders replacing the built-in one.
+FAST_PROFILE_TEMPLATE_PATH = os.getenv("ESSENTIA_FAST_PROFILE")
+BACKGROUND_POLL_SECONDS = 1.0
+# Background full analyses waiting or running at once; each may hold a
+# downloaded temp file, so past this a fast result is returned without one.
+MAX_BACKGROUND = int(os.getenv("ESSENTIA_MAX_BACKGROUND", str(CONCURRENCY * 4)))
+PROBE_TIMEOUT = 10.0
+# Enough for bpm, danceability and key: one window, means only, no frames
+# or high-level models.
+FAST_PROFILE_TEMPLATE = """\
+outputFormat: json
+outputFrames: 0
+startTime: {start}
+endTime: {end}
+lowlevel:
+    stats: ["mean"]
+rhythm:
+    stats: ["mean"]
+tonal:
+    stats: ["mean"]
+highlevel:
+    compute: 0
+"""
+# Top-level sections of the extractor JSON; "fields" must start with one.
+DESCRIPTOR_SECTIONS = ("metadata", "lowlevel", "rhythm", "tonal", "highlevel")
+# The descriptors the download worker stores on the track.
+SUMMARY_FIELDS = (
+    "rhythm.bpm",
+    "rhythm.danceability",
+    "tonal.key_edma",
+    "metadata.audio_properties.length",
+)
+
+
+class SourceError(Exception):
+    pass
+
+
+class DownloadError(SourceError):
+    pass
+
+
+class ExtractorError(Exception):
+    pass
+
+
+class PathError(SourceError):
+    pass
+
+
+class SaveError(Exception):
+    """save_as couldn't be written; the analysis itself succeeded."""
+
+
+class RequestError(ValueError):
+    """A malformed request option; /analyze answers it with a 400."""
+
+
+cache = AnalysisCache(CACHE_DIR, CACHE_MAX_BYTES)
+if BACKEND == "python" and not warm_pool.available():
+    raise RuntimeError("ESSENTIA_BACKEND=python but the essentia Python module is not importable")
+pool = (
+    warm_pool.WarmPool(CONCURRENCY, PROFILE_PATH)
+    if BACKEND == "python" or (BACKEND == "auto" and warm_pool.available())
+    else None
+)
+_slots = asyncio.Semaphore(CONCURRENCY)
+_queue = {"queued": 0, "running": 0, "background": 0}
+_background_tasks = set()
+_fast_profile_dir = tempfile.mkdtemp(prefix="essentia-fast-")
+SLOTS.set(CONCURRENCY)
+IN_FLIGHT.set_function(lambda: _queue["running"])
+QUEUED.set_function(lambda: _queue["queued"])
+BACKGROUND.set_function(lambda: _queue["background"])
+CACHE_BYTES.set_function(lambda: cache.stats()["bytes"])
+
+
+@asynccontextmanager
+async def extractor_slot(background=False):
+    """Waits for one of the CONCURRENCY extractor slots, counting queued and running runs."""
+    if background:
+        # Yield to requests: only start once nothing else is waiting.
+        while _queue["queued"] or _slots.locked():
+            await asyncio.sleep(BACKGROUND_POLL_SECONDS)
+    _queue["queued"] += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _queue["queued"] -= 1
+    _queue["running"] += 1
+    try:
+        yield
+    finally:
+        _queue["running"] -= 1
+        _slots.release()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Starts the warm pool, if any, and removes the generated fast profiles on shutdown."""
+    if pool is not None:
+        pool.start()
+    try:
+        yield
+    finally:
+        shutil.rmtree(_fast_profile_dir, ignore_errors=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def _cache_key(digest, profile):
+    return cache_key(digest, profile, warm_pool.version() if pool is not None else extractor_version(EXTRACTOR))
+
+
+async def run_extractor(path, profile=PROFILE_PATH, background=False):
+    """Runs the extractor on path (in a warm worker, or as an asyncio subprocess) and returns its JSON."""
+    async with extractor_slot(background):
+        started_at = time.perf_counter()
+        timer = EXTRACTOR_SECONDS.labels(
+            profile="full" if profile == PROFILE_PATH else "fast",
+            backend="python" if pool is not None else "subprocess",
+        )
+        if pool is not None:
+            try:
+                result = await pool.run(path, profile, EXTRACTOR_TIMEOUT)
+            except (RuntimeError, BrokenProcessPool) as e:
+                raise ExtractorError(str(e) or type(e).__name__) from None
+            timer.observe(time.perf_counter() - started_at)
+            return result
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                EXTRACTOR,
+                path,
+                "-",
+                profile,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise ExtractorError(f"{EXTRACTOR} not found") from None
+        except OSError as e:
+            raise ExtractorError(f"Couldn’t run {EXTRACTOR}: {e}") from None
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), EXTRACTOR_TIMEOUT)
+            timer.observe(time.perf_counter() - started_at)
+        except BaseException:
+            # Timed out or the request was cancelled: don't leave it running.
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+    if proc.returncode != 0:
+        raise ExtractorError(stderr.decode(errors="replace"))
+    try:
+        return json.loads(stdout)
+    except ValueError:
+        # Raised here so a truncated or garbled run is never cached.
+        raise ExtractorError(f"{EXTRACTOR} printed invalid JSON ({len(stdout)} bytes)") from None
+
+
+def download_to_tempfile(url):
+    """
+    Streams url to a temp file in fixed-size chunks, hashing as it goes.
+
+    Memory stays at one chunk however large the file is. Downloads larger
+    than MAX_DOWNLOAD_BYTES, by Content-Length or by bytes actually received,
+    are refused, as are responses shorter than their Content-Length.
+
+    Returns:
+        tuple[str, str]: The temp file path and the sha256 of its bytes.
+    """
+    suffix = os.path.splitext(url)[1] or ".mp3"
+    started_at = time.perf_counter()
+    with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as resp:
+        if not resp.ok:
+            raise DownloadError(f"Couldn’t download file: {resp.status_code}")
+        length = resp.headers.get("Content-Length", "")
+        expected = int(length) if length.isdigit() else None
+        if expected is not None and expected > MAX_DOWNLOAD_BYTES:
+            raise DownloadError(f"File too large: {expected} bytes (limit {MAX_DOWNLOAD_BYTES})")
+
+        tf = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        try:
+            with tf:
+                digest = hashlib.sha256()
+                received = 0
+                for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                    received += len(chunk)
+                    if received > MAX_DOWNLOAD_BYTES:
+                        raise DownloadError(f"File too large: over {MAX_DOWNLOAD_BYTES} bytes")
+                    tf.write(chunk)
+                    digest.update(chunk)
+            # iter_content undoes any Content-Encoding, so only raw bodies
+            # can be checked against Content-Length.
+            if expected is not None and not resp.headers.get("Content-Encoding") and received != expected:
+                raise DownloadError(f"Incomplete download: got {received} of {expected} bytes")
+        except BaseException:
+            os.unlink(tf.name)
+            raise
+    DOWNLOAD_BYTES.inc(received)
+    DOWNLOAD_SECONDS.observe(time.perf_counter() - started_at)
+    return tf.name, digest.hexdigest()
+
+
+def resolve_audio_path(path):
+    """Resolves path (relative to, or inside, AUDIO_ROOT) to an existing file under AUDIO_ROOT."""
+    if not AUDIO_ROOT:
+        raise PathError("Local paths are disabled (ESSENTIA_AUDIO_ROOT is not set)")
+    root = os.path.realpath(AUDIO_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise PathError(f"Path is outside {AUDIO_ROOT}")
+    if not os.path.isfile(resolved):
+        raise PathError(f"No such file: {path}")
+    return resolved
+
+
+def project(result, fields):
+    """Keeps only the dotted descriptor paths in fields, nested as in result; missing paths are skipped."""
+    projected = {}
+    for field in fields:
+        parts = field.split(".")
+        node = result
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                break
+            node = node[part]
+        else:
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = node
+    return projected
+
+
+def requested_fields(data):
+    """The projection asked for by "fields" (list or comma-separated) and/or "summary": true."""
+    fields = data.get("fields") or []
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if data.get("summary"):
+        fields = [*SUMMARY_FIELDS, *fields]
+    return fields or None
+
+
+def save_analysis(name, result, meta=None):
+    """Writes {**meta, "saved_at", "analysis"} to DATA_DIR/name, the layout the app reads."""
+    if not DATA_DIR:
+        raise PathError("Saving is disabled (ESSENTIA_DATA_DIR is not set)")
+    if not isinstance(name, str) or os.path.basename(name) != name or not name.endswith(".json"):
+        raise PathError(f"save_as must be a bare .json filename: {name!r}")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, name)
+    payload = {**(meta if isinstance(meta, dict) else {}), "saved_at": int(time.time() * 1000), "analysis": result}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+    return path
+
+
+async def analyze_source(data):
+    """
+    Analyzes one source and returns the extractor JSON, or {"error": ...}.
+
+    "fields"/"summary" trim the response to the named descriptor paths, and
+    "save_as" (plus optional "save_meta") keeps the full JSON in DATA_DIR so
+    callers that only need a few values needn't carry it over the wire.
+
+    "profile": "fast" analyzes only a window of the track with a light
+    profile and marks the result as an estimate. Unless "schedule_full" is
+    false, the full analysis then runs in the background whenever no other
+    request is waiting, filling the cache (and save_as) for later. With
+    MAX_BACKGROUND already pending it is skipped, and the estimate says so.
+
+    Raises:
+        RequestError: When an option is malformed.
+    """
+    fast = data.get("profile") == "fast"
+    try:
+        check_request(data, fast)
+    except RequestError:
+        ANALYSES.labels(profile="fast" if fast else "full", outcome="error").inc()
+        ERRORS.labels(cause="request").inc()
+        raise
+    result = await _analyze_source(data, fast)
+    ANALYSES.labels(profile="fast" if fast else "full", outcome="error" if set(result) == {"error"} else "ok").inc()
+    return result
+
+
+def _seconds(data, key):
+    value = data.get(key)
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"{key} must be a number of seconds: {value!r}") from None
+    if not math.isfinite(seconds) or seconds < 0:
+        raise RequestError(f"{key} must be a non-negative number of seconds: {value!r}")
+    return seconds
+
+
+def check_request(data, fast):
+    """Rejects malformed fields and fast-analysis options before any audio is fetched."""
+    fields = data.get("fields")
+    if fields is not None and not isinstance(fields, (str, list)):
+        raise RequestError(f"fields must be a list or a comma-separated string: {fields!r}")
+    for field in requested_fields(data) or ():
+        if not isinstance(field, str) or field.split(".")[0] not in DESCRIPTOR_SECTIONS or "" in field.split("."):
+            raise RequestError(f"Unknown field {field!r}; fields are dotted paths under {', '.join(DESCRIPTOR_SECTIONS)}")
+    if not fast:
+        return
+    for key in ("window_seconds", "start_seconds", "duration_seconds"):
+        _seconds(data, key)
+    if data.get("save_as") and not data.get("schedule_full", True):
+        raise RequestError("save_as keeps the full analysis, so it needs schedule_full")
+
+
+def _failure(cause, message):
+    ERRORS.labels(cause=cause).inc()
+    return {"error": message}
+
+
+async def _analyze_source(data, fast):
+    fields = requested_fields(data)
+    try:
+        path, digest, owned = await _open_source(data)
+    except SourceError as e:
+        cause = "download" if isinstance(e, DownloadError) else "path" if isinstance(e, PathError) else "request"
+        return _failure(cause, str(e))
+
+    handed_off = False
+    estimate = None
+    try:
+        full = None
+        if fast and digest and cache.enabled and not data.get("force"):
+            # Already fully analyzed: no need to estimate.
+            full = await _cache_get(_cache_key(digest, PROFILE_PATH))
+        if full is not None:
+            result = full
+            if data.get("save_as"):
+                await _save(data, result)
+        elif fast:
+            start, end = await run_in_threadpool(fast_window, data, path)
+            result = await _extract(path, digest, fast_profile(start, end), force=data.get("force"))
+            estimate = {"profile": "fast", "start_seconds": start, "end_seconds": end}
+            if data.get("schedule_full", True):
+                handed_off = schedule_full_analysis(data, path, digest, owned)
+                estimate["full_analysis"] = "scheduled" if handed_off else "skipped"
+        else:
+            result = await _extract(path, digest, PROFILE_PATH, force=data.get("force"))
+            if data.get("save_as"):
+                await _save(data, result)
+    except asyncio.TimeoutError:
+        return _failure("timeout", f"Extractor timed out after {EXTRACTOR_TIMEOUT:g}s")
+    except ExtractorError as e:
+        return _failure("extractor", str(e))
+    except SaveError as e:
+        return _failure("save", str(e))
+    except OSError as e:
+        return _failure("io", f"I/O error: {e}")
+    finally:
+        if owned and not handed_off:
+            os.unlink(path)
+
+    if fields:
+        result = project(result, fields)
+    if estimate is not None:
+        result = {**result, "estimate": estimate}
+    return result
+
+
+async def _save(data, result):
+    try:
+        await run_in_threadpool(save_analysis, data["save_as"], result, data.get("save_meta"))
+    except (OSError, PathError) as e:
+        raise SaveError(f"Couldn’t save analysis: {e}") from None
+
+
+async def _open_source(data):
+    """
+    Resolves a {"path"} or {"filename"} source to a local file.
+
+    Returns:
+        tuple[str, str | None, bool]: The file, the sha256 of its bytes (None
+        when the cache is off and it wasn't needed) and whether it is a temp
+        file the caller must delete.
+    """
+    local = data.get("path")             # file on the shared audio volume
+    url = data.get("filename")           # really a URL now
+    if local:
+        # analyze in place; nothing to clean up
+        path = resolve_audio_path(local)
+        digest = await run_in_threadpool(file_digest, path) if cache.enabled else None
+        return path, digest, False
+    if url:
+        # stream it to a temp file off the event loop
+        try:
+            path, digest = await run_in_threadpool(download_to_tempfile, url)
+        except requests.RequestException as e:
+            raise DownloadError(f"Couldn’t download file: {e}") from None
+        return path, digest, True
+    raise SourceError("No URL provided")
+
+
+async def _extract(path, digest, profile, force=False, background=False):
+    """
+    Runs the extractor on path with profile.
+
+    Results are cached by audio content, profile and extractor build, so the
+    same bytes are only analyzed once; force re-runs the extractor.
+    """
+    key = _cache_key(digest, profile) if digest and cache.enabled else None
+    if key and not force:
+        cached = await _cache_get(key)
+        if cached is not None:
+            return cached
+    result = await run_extractor(path, profile, background=background)
+    if key:
+        await run_in_threadpool(cache.put, key, result)
+    return result
+
+
+async def _cache_get(key):
+    cached = await run_in_threadpool(cache.get, key)
+    CACHE_LOOKUPS.labels(result="miss" if cached is None else "hit").inc()
+    return cached
+
+
+def _wav_duration(path):
+    try:
+        with wave.open(path, "rb") as w:
+            return w.getnframes() / w.getframerate()
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None
+
+
+def _ffprobe_duration(path):
+    if shutil.which("ffprobe") is None:
+        return None
+    try:
+        proc = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            capture_output=True,
+            text=True,
+            timeout=PROBE_TIMEOUT,
+        )
+        duration = float(proc.stdout.strip())
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+    return duration if math.isfinite(duration) and duration > 0 else None
+
+
+def audio_duration(path):
+    """
+    Length of the audio at path in seconds, or None when it can't be told.
+
+    Read from a WAV header, else Essentia's metadata reader when the Python
+    bindings are installed, else ffprobe. None of them decode the audio.
+    """
+    return _wav_duration(path) or warm_pool.duration(path) or _ffprobe_duration(path)
+
+
+def fast_window(data, path):
+    """
+    The (start, end) seconds a fast analysis covers.
+
+    "window_seconds" long (default FAST_WINDOW_SECONDS), starting at
+    "start_seconds" or else centred on the track when its length is known
+    from "duration_seconds" or audio_duration, or FAST_DEFAULT_START otherwise.
+    The start snaps to the FAST_WINDOW_STEP grid and the length rounds up to it.
+    """
+    window = _seconds(data, "window_seconds") or FAST_WINDOW_SECONDS
+    window = FAST_WINDOW_STEP * max(1, math.ceil(window / FAST_WINDOW_STEP))
+    start = _seconds(data, "start_seconds")
+    if start is None:
+        duration = _seconds(data, "duration_seconds") or audio_duration(path)
+        start = max(0.0, (duration - window) / 2) if duration else FAST_DEFAULT_START
+    start = FAST_WINDOW_STEP * round(start / FAST_WINDOW_STEP)
+    return start, start + window
+
+
+def fast_profile(start, end):
+    """Writes (once) and returns the fast profile YAML for a window."""
+    path = os.path.join(_fast_profile_dir, f"fast-{start:g}-{end:g}.yaml")
+    if os.path.exists(path):
+        return path
+    if FAST_PROFILE_TEMPLATE_PATH:
+        with open(FAST_PROFILE_TEMPLATE_PATH) as f:
+            template = f.read()
+    else:
+        template = FAST_PROFILE_TEMPLATE
+    os.makedirs(_fast_profile_dir, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(template.format(start=start, end=end))
+    os.replace(tmp, path)
+    return path
+
+
+def schedule_full_analysis(data, path, digest, owned):
+    """
+    Runs the full profile on path at background priority, taking ownership of a temp path.
+
+    Returns False, scheduling nothing, when MAX_BACKGROUND analyses are
+    already pending.
+    """
+    if _queue["background"] >= MAX_BACKGROUND:
+        print(f"[background] {MAX_BACKGROUND} full analyses pending, skipping {data.get('path') or data.get('filename')}", flush=True)
+        return False
+    _queue["background"] += 1
+    task = asyncio.create_task(_full_in_background(data, path, digest, owned))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return True
+
+
+async def _full_in_background(data, path, digest, owned):
+    try:
+        result = await _extract(path, digest, PROFILE_PATH, background=True)
+        if data.get("save_as"):
+            await _save(data, result)
+    except Exception as e:
+        ERRORS.labels(cause="background").inc()
+        print(f"[background] full analysis of {data.get('path') or data.get('filename')} failed: {e}", flush=True)
+    finally:
+        _queue["background"] -= 1
+        if owned:
+            os.unlink(path)
 
-app = FastAPI()
 
 @app.post("/analyze")
 async def analyze(request: Request):
+    try:
+        return await analyze_source(await request.json())
+    except RequestError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+def _batch_source(item):
+    # Bare strings are URLs or shared-volume paths.
+    if isinstance(item, str):
+        return {"filename": item} if item.startswith(("http://", "https://")) else {"path": item}
+    return item if isinstance(item, dict) else {}
+
+
+async def _analyze_batch(items, defaults):
+    results = asyncio.Queue()
+    pending = iter(enumerate(items))
+
+    async def worker():
+        # Pull items one at a time so at most a couple of downloads per
+        # extractor slot are in flight, however long the batch.
+        for index, item in pending:
+            line = {"index": index}
+            if isinstance(item, dict) and "id" in item:
+                line["id"] = item["id"]
+            try:
+                result = await analyze_source({**defaults, **_batch_source(item)})
+            except RequestError as e:
+                result = {"error": str(e)}
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            if set(result) == {"error"}:
+                line["error"] = result["error"]
+            else:
+                line["result"] = result
+            await results.put(line)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(len(items), CONCURRENCY * 2))]
+    try:
+        for _ in range(len(items)):
+            yield json.dumps(await results.get()) + "\n"
+    finally:
+        # Client went away or we're done: stop anything still running.
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: Request):
+    """
+    Analyzes many sources, streaming one NDJSON line per item as it finishes.
+
+    Body: {"items": [...]} where each item is {"path": ...}, {"filename": url}
+    (optionally with an "id" echoed back) or a bare path/URL string.
+    Top-level "fields", "summary", "force", "profile" and "schedule_full"
+    apply to every item. Lines are {"index", "id"?, "result"} or
+    {"index", "id"?, "error"}; a failed item never fails the batch.
+    """
     data = await request.json()
-    url = data.get("filename")           # really a URL now
-    if not url:
-        return {"error": "No URL provided"}
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return {"error": "Expected {\"items\": [...]}"}
+    defaults = {key: data[key] for key in ("fields", "summary", "force", "profile", "schedule_full") if key in data}
+    return StreamingResponse(_analyze_batch(items, defaults), media_type="application/x-ndjson")
 
-    # download it to a temp file
-    resp = requests.get(url)
-    if not resp.ok:
-        return {"error": f"Couldn’t download file: {resp.status_code}"}
 
-    suffix = os.path.splitext(url)[1] or ".mp3"
-    tf = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tf.write(resp.content)
-    tf.flush(); tf.close()
-
-    # run Essentia on that temp file
-    cmd = [
-        "essentia_streaming_extractor_music",
-        tf.name,
-        "-",
-        "/etc/essentia/profile.yaml"
-    ]
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    os.unlink(tf.name)
+@app.get("/queue")
+async def queue():
+    return {"concurrency": CONCURRENCY, **_queue}
+
+
+@app.get("/cache")
+async def cache_stats():
+    return cache.stats()
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Ready when something can run the extractor and the profile exists; reports saturation too."""
+    problems = []
+    if pool is None and shutil.which(EXTRACTOR) is None:
+        problems.append(f"{EXTRACTOR} not found")
+    if not os.path.isfile(PROFILE_PATH):
+        problems.append(f"profile missing: {PROFILE_PATH}")
+    body = {
+        "ready": not problems,
+        "problems": problems,
+        "backend": "python" if pool is not None else "subprocess",
+        "saturated": _queue["queued"] > 0,
+        "concurrency": CONCURRENCY,
+        **_queue,
+    }
+    return JSONResponse(body, status_code=200 if not problems else 503)
 
-    if proc.returncode != 0:
-        return {"error": proc.stderr}
 
-    return json.loads(proc.stdout)
\ No newline at end of file
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
@@ -0,0 +1,57 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+ANALYSES = Counter(
+    "essentia_analyses",
+    "Analyses handled, by profile (full or fast) and outcome (ok or error).",
+    ["profile", "outcome"],
+)
+ERRORS = Counter(
+    "essentia_errors",
+    "Failed analyses by cause (request, path, download, extractor, timeout, save, io, background).",
+    ["cause"],
+)
+IN_FLIGHT = Gauge(
+    "essentia_extractor_running",
+    "Extractor runs currently holding a slot.",
+)
+QUEUED = Gauge(
+    "essentia_extractor_queued",
+    "Extractor runs waiting for a slot.",
+)
+BACKGROUND = Gauge(
+    "essentia_background_pending",
+    "Full analyses scheduled after a fast estimate and not yet finished.",
+)
+SLOTS = Gauge(
+    "essentia_extractor_slots",
+    "Configured extractor concurrency.",
+)
+EXTRACTOR_SECONDS = Histogram(
+    "essentia_extractor_seconds",
+    "Wall time of one extractor run, by profile and backend.",
+    ["profile", "backend"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, 900),
+)
+DOWNLOAD_BYTES = Counter(
+    "essentia_download_bytes",
+    "Audio bytes downloaded for analysis; rate() gives download bytes/s.",
+)
+DOWNLOAD_SECONDS = Histogram(
+    "essentia_download_seconds",
+    "Wall time of one audio download.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+CACHE_LOOKUPS = Counter(
+    "essentia_cache_lookups",
+    "Analysis cache lookups by result (hit or miss).",
+    ["result"],
+)
+CACHE_BYTES = Gauge(
+    "essentia_cache_bytes",
+    "Bytes of extractor JSON held by the analysis cache.",
+)
+
+
+def render_metrics():
+    """Returns the Prometheus exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,469 @@
+import asyncio
+import hashlib
+import json
+import os
+import stat
+import sys
+import tempfile
+import wave
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import essentia_api
+from analysis_cache import AnalysisCache, cache_key
+from essentia_api import DownloadError, PathError, analyze_source, download_to_tempfile, fast_window, resolve_audio_path
+
+
+@pytest.fixture
+def audio_root(tmp_path, monkeypatch):
+    root = tmp_path / "audio"
+    (root / "crate").mkdir(parents=True)
+    (root / "crate" / "a.wav").write_bytes(b"track a")
+    (root / "crate" / "copy-of-a.wav").write_bytes(b"track a")
+    (root / "crate" / "b.wav").write_bytes(b"track b")
+    (root / "crate" / "slow.wav").write_bytes(b"a long track")
+    (root / "crate" / "garbled.wav").write_bytes(b"output cut short")
+    (tmp_path / "secret.wav").write_bytes(b"outside the root")
+    monkeypatch.setattr(essentia_api, "AUDIO_ROOT", str(root))
+    return root
+
+
+@pytest.fixture
+def extractor(tmp_path, monkeypatch):
+    """A stand-in extractor binary that logs each run and prints a tiny result."""
+    runs = tmp_path / "runs.log"
+    script = tmp_path / "fake_extractor"
+    script.write_text(
+        "#!/bin/sh\n"
+        f'echo "$1" >> "{runs}"\n'
+        'case "$1" in *slow*) sleep 0.3 ;; *garbled*) printf \'{"rhythm": {"bpm"\'; exit 0 ;; esac\n'
+        'printf \'{"rhythm": {"bpm": 120.0, "danceability": 1.2, "beats_position": [0.5, 1.0]}, '
+        '"tonal": {"key_edma": {"key": "A", "scale": "minor"}}, '
+        '"metadata": {"file": "%s", "profile": "%s", "audio_properties": {"length": 240.5}}}\' "$1" "$3"\n'
+    )
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(essentia_api, "EXTRACTOR", str(script))
+    monkeypatch.setattr(essentia_api, "pool", None)
+    monkeypatch.setattr(essentia_api, "cache", AnalysisCache(str(tmp_path / "cache"), 1024 * 1024))
+    return lambda: runs.read_text().splitlines() if runs.exists() else []
+
+
+@pytest.mark.parametrize("path", ["../secret.wav", "crate/../../secret.wav", "/etc/passwd"])
+def test_paths_outside_the_audio_root_are_rejected(audio_root, path):
+    with pytest.raises(PathError):
+        resolve_audio_path(path)
+
+
+def test_symlinks_may_not_escape_the_audio_root(audio_root, tmp_path):
+    (audio_root / "crate" / "escape.wav").symlink_to(tmp_path / "secret.wav")
+    (audio_root / "escape-dir").symlink_to(tmp_path)
+    (audio_root / "alias.wav").symlink_to(audio_root / "crate" / "a.wav")
+
+    with pytest.raises(PathError):
+        resolve_audio_path("crate/escape.wav")
+    with pytest.raises(PathError):
+        resolve_audio_path("escape-dir/secret.wav")
+    assert resolve_audio_path("alias.wav") == str(audio_root / "crate" / "a.wav")
+    assert resolve_audio_path(str(audio_root / "crate" / "b.wav")) == str(audio_root / "crate" / "b.wav")
+
+
+def test_rejected_paths_never_reach_the_extractor(audio_root, extractor):
+    result = asyncio.run(analyze_source({"path": "../secret.wav"}))
+
+    assert "outside" in result["error"]
+    assert extractor() == []
+
+
+def test_analyses_are_cached_by_audio_content(audio_root, extractor):
+    first = asyncio.run(analyze_source({"path": "crate/a.wav"}))
+    again = asyncio.run(analyze_source({"path": "crate/a.wav"}))
+    same_bytes = asyncio.run(analyze_source({"path": "crate/copy-of-a.wav"}))
+    other = asyncio.run(analyze_source({"path": "crate/b.wav"}))
+    forced = asyncio.run(analyze_source({"path": "crate/a.wav", "force": True}))
+
+    assert first == again == same_bytes == forced
+    assert other["metadata"]["file"].endswith("b.wav")
+    assert [Path(run).name for run in extractor()] == ["a.wav", "b.wav", "a.wav"]
+    stats = essentia_api.cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 2)
+
+
+def test_invalid_extractor_output_is_an_extractor_error_and_not_cached(audio_root, extractor):
+    errors = REGISTRY.get_sample_value("essentia_errors_total", {"cause": "extractor"}) or 0
+
+    first = asyncio.run(analyze_source({"path": "crate/garbled.wav"}))
+    again = asyncio.run(analyze_source({"path": "crate/garbled.wav"}))
+
+    assert first["error"].endswith("printed invalid JSON (17 bytes)")
+    assert again == first
+    assert len(extractor()) == 2
+    assert essentia_api.cache.stats()["entries"] == 0
+    assert REGISTRY.get_sample_value("essentia_errors_total", {"cause": "extractor"}) == errors + 2
+
+
+def test_io_failures_outside_save_as_are_not_reported_as_save_errors(audio_root, extractor, monkeypatch):
+    def disk_full(key, result):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(essentia_api.cache, "put", disk_full)
+    errors = REGISTRY.get_sample_value("essentia_errors_total", {"cause": "io"}) or 0
+
+    result = asyncio.run(analyze_source({"path": "crate/a.wav"}))
+
+    assert result == {"error": "I/O error: [Errno 28] No space left on device"}
+    assert REGISTRY.get_sample_value("essentia_errors_total", {"cause": "io"}) == errors + 1
+
+
+def test_cache_key_covers_audio_profile_and_extractor_build(tmp_path):
+    full, fast = tmp_path / "full.yaml", tmp_path / "fast.yaml"
+    full.write_text("highlevel:\n    compute: 1\n")
+    fast.write_text("highlevel:\n    compute: 0\n")
+
+    key = cache_key("audio", str(full), "2.1")
+    assert key == cache_key("audio", str(full), "2.1")
+    assert len({key, cache_key("other", str(full), "2.1"), cache_key("audio", str(fast), "2.1"), cache_key("audio", str(full), "2.2")}) == 4
+
+
+def test_cache_evicts_least_recently_used_entries(tmp_path):
+    # Each entry is 14 bytes of JSON, so three fit.
+    cache = AnalysisCache(str(tmp_path / "cache"), max_bytes=45)
+    for key in ("aa1", "bb2", "cc3"):
+        cache.put(key, {"key": key})
+    assert cache.get("aa1") == {"key": "aa1"}
+    cache.put("dd4", {"key": "dd4"})
+
+    assert cache.get("bb2") is None
+    assert cache.get("aa1") is not None and cache.get("dd4") is not None
+    assert cache.stats()["evictions"] == 1
+    assert not os.path.exists(os.path.join(tmp_path, "cache", "bb", "bb2.json"))
+
+    # Recency is the file mtime, so a restarted cache evicts in the same order.
+    reloaded = AnalysisCache(str(tmp_path / "cache"), max_bytes=45)
+    assert sorted(reloaded._entries) == ["aa1", "cc3", "dd4"]
+
+
+def _write_wav(path, seconds, rate=100):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(1)
+        w.setframerate(rate)
+        w.writeframes(b"\x80" * int(seconds * rate))
+
+
+def test_fast_window_centres_on_the_track_and_snaps_to_the_grid(tmp_path, monkeypatch):
+    wav = tmp_path / "long.wav"
+    _write_wav(wav, 240)
+    mp3 = tmp_path / "long.mp3"
+    mp3.write_bytes(b"not a wav header")
+    monkeypatch.setattr(essentia_api, "_ffprobe_duration", lambda path: None)
+
+    assert fast_window({}, str(wav)) == (90.0, 150.0)
+    assert fast_window({"window_seconds": 45, "start_seconds": 40}, str(wav)) == (30.0, 90.0)
+    assert fast_window({"duration_seconds": 200}, str(mp3)) == (60.0, 120.0)
+    assert fast_window({}, str(mp3)) == (essentia_api.FAST_DEFAULT_START, essentia_api.FAST_DEFAULT_START + 60)
+
+    # Compressed files are centred from the probed length, not the default start.
+    monkeypatch.setattr(essentia_api, "_ffprobe_duration", lambda path: 300.0)
+    assert fast_window({}, str(mp3)) == (120.0, 180.0)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"window_seconds": "a minute"},
+        {"start_seconds": -30},
+        {"duration_seconds": "inf"},
+        {"save_as": "a.json", "schedule_full": False},
+    ],
+)
+def test_malformed_fast_options_are_rejected_before_analysis(audio_root, extractor, options):
+    response = TestClient(essentia_api.app).post("/analyze", json={"path": "crate/a.wav", "profile": "fast", **options})
+
+    assert response.status_code == 400
+    assert "error" in response.json()
+    assert extractor() == []
+
+
+def test_fast_estimates_upgrade_to_the_full_analysis_in_the_background(audio_root, extractor):
+    async def analyze_twice():
+        fast = await analyze_source({"path": "crate/a.wav", "profile": "fast"})
+        await asyncio.gather(*essentia_api._background_tasks)
+        return fast, await analyze_source({"path": "crate/a.wav", "profile": "fast"})
+
+    fast, upgraded = asyncio.run(analyze_twice())
+
+    assert fast["estimate"]["full_analysis"] == "scheduled"
+    assert fast["metadata"]["profile"] != essentia_api.PROFILE_PATH
+    assert "estimate" not in upgraded
+    assert upgraded["metadata"]["profile"] == essentia_api.PROFILE_PATH
+    assert len(extractor()) == 2
+    assert essentia_api._queue["background"] == 0
+
+
+def test_background_analyses_are_capped(audio_root, extractor, monkeypatch):
+    monkeypatch.setattr(essentia_api, "MAX_BACKGROUND", 0)
+
+    fast = asyncio.run(analyze_source({"path": "crate/a.wav", "profile": "fast"}))
+
+    assert fast["estimate"]["full_analysis"] == "skipped"
+    assert not essentia_api._background_tasks
+    assert len(extractor()) == 1
+
+
+def _batch(body):
+    with TestClient(essentia_api.app).stream("POST", "/analyze/batch", json=body) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        return [json.loads(line) for line in response.iter_lines() if line]
+
+
+def test_batch_streams_one_line_per_item_with_errors_inline(audio_root, extractor):
+    lines = _batch(
+        {
+            "items": ["crate/a.wav", {"path": "../secret.wav", "id": 7}, {"path": "crate/b.wav", "id": "b"}, 42],
+            "fields": ["metadata.file"],
+        }
+    )
+    by_index = {line["index"]: line for line in lines}
+
+    assert sorted(by_index) == [0, 1, 2, 3]
+    assert by_index[0]["result"]["metadata"]["file"].endswith("a.wav")
+    assert by_index[1] == {"index": 1, "id": 7, "error": f"Path is outside {audio_root}"}
+    assert by_index[2]["id"] == "b" and by_index[2]["result"] == {"metadata": {"file": str(audio_root / "crate" / "b.wav")}}
+    assert by_index[3] == {"index": 3, "error": "No URL provided"}
+
+
+def test_batch_lines_arrive_as_items_finish(audio_root, extractor, monkeypatch):
+    monkeypatch.setattr(essentia_api, "_slots", asyncio.Semaphore(2))
+    monkeypatch.setattr(essentia_api, "CONCURRENCY", 2)
+
+    lines = _batch({"items": ["crate/slow.wav", "crate/b.wav"]})
+
+    assert [line["index"] for line in lines] == [1, 0]
+    assert lines[0]["result"]["metadata"]["file"].endswith("b.wav")
+
+
+def test_batch_turns_bad_item_options_into_error_lines(audio_root, extractor):
+    lines = _batch({"items": [{"path": "crate/a.wav", "start_seconds": -1}, "crate/b.wav"], "profile": "fast", "schedule_full": False})
+    by_index = {line["index"]: line for line in lines}
+
+    assert "start_seconds" in by_index[0]["error"]
+    assert by_index[1]["result"]["estimate"]["profile"] == "fast"
+
+
+def test_batch_requires_an_items_list():
+    response = TestClient(essentia_api.app).post("/analyze/batch", json={"items": "crate/a.wav"})
+    assert response.json() == {"error": 'Expected {"items": [...]}'}
+
+
+def test_fields_and_summary_project_the_result(audio_root, extractor):
+    listed = asyncio.run(analyze_source({"path": "crate/a.wav", "fields": ["rhythm.bpm", "tonal.key_edma.key"]}))
+    comma = asyncio.run(analyze_source({"path": "crate/a.wav", "fields": "rhythm.bpm, tonal.key_edma.key"}))
+    summary = asyncio.run(analyze_source({"path": "crate/a.wav", "summary": True, "fields": ["lowlevel.loudness"]}))
+
+    assert listed == comma == {"rhythm": {"bpm": 120.0}, "tonal": {"key_edma": {"key": "A"}}}
+    # Paths the profile didn't produce are skipped rather than failing.
+    assert summary == {
+        "rhythm": {"bpm": 120.0, "danceability": 1.2},
+        "tonal": {"key_edma": {"key": "A", "scale": "minor"}},
+        "metadata": {"audio_properties": {"length": 240.5}},
+    }
+
+
+@pytest.mark.parametrize("fields", [["rythm.bpm"], "rhythm..bpm", [["rhythm.bpm"]], {"rhythm": "bpm"}])
+def test_unknown_fields_are_rejected(audio_root, extractor, fields):
+    response = TestClient(essentia_api.app).post("/analyze", json={"path": "crate/a.wav", "fields": fields})
+
+    assert response.status_code == 400
+    assert "field" in response.json()["error"]
+    assert extractor() == []
+
+
+def test_save_as_writes_the_full_analysis_and_returns_the_projection(audio_root, extractor, tmp_path, monkeypatch):
+    monkeypatch.setattr(essentia_api, "DATA_DIR", str(tmp_path / "data"))
+
+    result = asyncio.run(
+        analyze_source(
+            {"path": "crate/a.wav", "summary": True, "save_as": "track-1.json", "save_meta": {"track_id": "1", "friend_id": 2}}
+        )
+    )
+    saved = json.loads((tmp_path / "data" / "track-1.json").read_text())
+
+    assert result["rhythm"] == {"bpm": 120.0, "danceability": 1.2}
+    assert set(saved) == {"track_id", "friend_id", "saved_at", "analysis"}
+    assert (saved["track_id"], saved["friend_id"]) == ("1", 2)
+    assert saved["analysis"]["rhythm"]["beats_position"] == [0.5, 1.0]
+    assert not list((tmp_path / "data").glob("*.tmp"))
+
+
+@pytest.mark.parametrize("name", ["../track.json", "nested/track.json", "track.txt"])
+def test_save_as_must_be_a_bare_json_filename(audio_root, extractor, tmp_path, monkeypatch, name):
+    monkeypatch.setattr(essentia_api, "DATA_DIR", str(tmp_path / "data"))
+
+    result = asyncio.run(analyze_source({"path": "crate/a.wav", "save_as": name}))
+
+    assert result["error"].startswith("Couldn’t save analysis")
+    assert not (tmp_path / "track.json").exists()
+
+
+def test_save_as_needs_a_data_dir(audio_root, extractor, monkeypatch):
+    monkeypatch.setattr(essentia_api, "DATA_DIR", None)
+
+    result = asyncio.run(analyze_source({"path": "crate/a.wav", "save_as": "track.json"}))
+
+    assert "ESSENTIA_DATA_DIR" in result["error"]
+
+
+class _Response:
+    def __init__(self, chunks, headers=None, status_code=200):
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.streamed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.streamed += 1
+            yield chunk
+
+
+@pytest.fixture
+def download(tmp_path, monkeypatch):
+    """Serves a canned response to download_to_tempfile and writes temp files under tmp_path/tmp."""
+    (tmp_path / "tmp").mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    monkeypatch.setattr(essentia_api, "MAX_DOWNLOAD_BYTES", 10)
+
+    def serve(response):
+        monkeypatch.setattr(essentia_api.requests, "get", lambda url, stream, timeout: response)
+        return response
+
+    serve.leftovers = lambda: list((tmp_path / "tmp").iterdir())
+    return serve
+
+
+def test_download_streams_chunks_to_disk_and_hashes_them(download):
+    download(_Response([b"abc", b"def"], {"Content-Length": "6"}))
+
+    path, digest = download_to_tempfile("https://example.test/track.flac")
+
+    assert path.endswith(".flac")
+    assert Path(path).read_bytes() == b"abcdef"
+    assert digest == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_download_refuses_a_content_length_over_the_limit_before_reading(download):
+    response = download(_Response([b"x" * 11], {"Content-Length": "11"}))
+
+    with pytest.raises(DownloadError, match="too large"):
+        download_to_tempfile("https://example.test/track.mp3")
+    assert response.streamed == 0
+    assert download.leftovers() == []
+
+
+def test_download_stops_once_the_received_bytes_pass_the_limit(download):
+    response = download(_Response([b"x" * 6, b"x" * 6, b"x" * 6]))
+
+    with pytest.raises(DownloadError, match="too large"):
+        download_to_tempfile("https://example.test/track.mp3")
+    assert response.streamed == 2
+    assert download.leftovers() == []
+
+
+def test_download_rejects_bodies_shorter_than_their_content_length(download):
+    download(_Response([b"abc"], {"Content-Length": "6"}))
+
+    with pytest.raises(DownloadError, match="Incomplete download: got 3 of 6 bytes"):
+        download_to_tempfile("https://example.test/track.mp3")
+    assert download.leftovers() == []
+
+
+def test_download_skips_the_length_check_for_encoded_bodies(download):
+    # iter_content decodes gzip, so the byte count can't match Content-Length.
+    download(_Response([b"abcdef"], {"Content-Length": "4", "Content-Encoding": "gzip"}))
+
+    path, _ = download_to_tempfile("https://example.test/track.mp3")
+    assert Path(path).read_bytes() == b"abcdef"
+
+
+def test_download_reports_http_errors(download):
+    download(_Response([], status_code=404))
+
+    with pytest.raises(DownloadError, match="404"):
+        download_to_tempfile("https://example.test/track.mp3")
+    assert download.leftovers() == []
+
+
+def test_health_answers_without_checking_dependencies():
+    response = TestClient(essentia_api.app).get("/health")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_ready_reports_a_missing_extractor_and_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(essentia_api, "pool", None)
+    monkeypatch.setattr(essentia_api, "EXTRACTOR", str(tmp_path / "no-such-extractor"))
+    monkeypatch.setattr(essentia_api, "PROFILE_PATH", str(tmp_path / "no-such-profile.yaml"))
+
+    response = TestClient(essentia_api.app).get("/ready")
+    body = response.json()
+
+    assert response.status_code == 503
+    assert body["ready"] is False
+    assert len(body["problems"]) == 2
+    assert body["backend"] == "subprocess"
+
+
+def test_ready_once_the_extractor_and_profile_exist(extractor, tmp_path, monkeypatch):
+    profile = tmp_path / "profile.yaml"
+    profile.write_text("outputFormat: json\n")
+    monkeypatch.setattr(essentia_api, "PROFILE_PATH", str(profile))
+
+    response = TestClient(essentia_api.app).get("/ready")
+    body = response.json()
+
+    assert response.status_code == 200
+    assert body["ready"] is True
+    assert body["problems"] == []
+    assert body["saturated"] is False
+    assert body["concurrency"] == essentia_api.CONCURRENCY
+
+
+def test_metrics_are_exposed_in_prometheus_format(extractor, audio_root):
+    client = TestClient(essentia_api.app)
+    client.post("/analyze", json={"path": "crate/a.wav"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "essentia_analyses_total" in response.text
+    assert "essentia_extractor_slots" in response.text
+    assert "essentia_extractor_seconds_bucket" in response.text
+
+
+def test_shutdown_removes_the_fast_profiles(tmp_path, monkeypatch):
+    profiles = tmp_path / "fast-profiles"
+    profiles.mkdir()
+    (profiles / "fast-30.yaml").write_text("")
+    monkeypatch.setattr(essentia_api, "pool", None)
+    monkeypatch.setattr(essentia_api, "_fast_profile_dir", str(profiles))
+
+    with TestClient(essentia_api.app) as client:
+        assert client.get("/health").status_code == 200
+        assert profiles.exists()
+
+    assert not profiles.exists()
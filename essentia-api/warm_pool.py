@@ -0,0 +1,120 @@
+import asyncio, multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import essentia
+    import essentia.standard as es
+except ImportError:
+    essentia = es = None
+
+# Per worker process: the most recently used MusicExtractors by profile, built
+# once and reused. Bounded so one-off profiles can't grow a worker forever.
+MAX_EXTRACTORS = 4
+_extractors = OrderedDict()
+
+
+def available():
+    return es is not None
+
+
+def version():
+    return f"python-{essentia.__version__}" if essentia is not None else None
+
+
+def duration(path):
+    """Length in seconds from the file's metadata, without decoding it; None when unknown."""
+    if es is None:
+        return None
+    try:
+        *_, length, _bitrate, _sample_rate, _channels = es.MetadataReader(filename=path, failOnError=True)()
+    except RuntimeError:
+        return None
+    return float(length) if length > 0 else None
+
+
+def _extractor(profile):
+    extractor = _extractors.get(profile)
+    if extractor is None:
+        extractor = _extractors[profile] = es.MusicExtractor(profile=profile)
+        while len(_extractors) > MAX_EXTRACTORS:
+            _extractors.popitem(last=False)
+    else:
+        _extractors.move_to_end(profile)
+    return extractor
+
+
+def _warm(profile):
+    _extractor(profile)
+
+
+def _ready():
+    return True
+
+
+def _pool_to_dict(pool):
+    # "rhythm.bpm" -> {"rhythm": {"bpm": ...}}, matching the extractor's JSON.
+    result = {}
+    for name in pool.descriptorNames():
+        value = pool[name]
+        if hasattr(value, "tolist"):
+            value = value.tolist()
+        *parents, leaf = name.split(".")
+        node = result
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = value
+    return result
+
+
+def extract(path, profile):
+    features, _frames = _extractor(profile)(path)
+    return _pool_to_dict(features)
+
+
+class WarmPool:
+    """
+    Long-lived worker processes running Essentia's MusicExtractor in-process.
+
+    Each worker loads the default profile when it starts and keeps the last
+    MAX_EXTRACTORS extractors it built, so profile parsing and model loading
+    happen once per worker instead of once per track. A crashed worker breaks the pool,
+    which is rebuilt on the next run.
+    """
+
+    def __init__(self, workers, profile):
+        self.workers = workers
+        self.profile = profile
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm,
+                initargs=(self.profile,),
+            )
+        return self._executor
+
+    def start(self):
+        """Spawns and warms every worker now rather than on the first requests."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ready)
+
+    def reset(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    async def run(self, path, profile, timeout):
+        # On timeout the caller gets asyncio.TimeoutError, but the worker
+        # can't be interrupted and finishes the track before taking another.
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._get_executor(), extract, path, profile), timeout)
+        except BrokenProcessPool:
+            self.reset()
+            raise
@@ -0,0 +1,85 @@
+"""
+Benchmark /optimize request parsing: the Pydantic model path against the
+orjson fast path, in wall time and peak traced allocations.
+
+    python -m benchmarks.parse --sizes 100 1000 5000 --dims 128 512
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+DEFAULT_SIZES = [100, 1000, 5000]
+DEFAULT_DIMS = [128]
+
+
+def _pydantic_parse(body):
+    from ga_service import OptimizeRequest, _model_to_dict
+
+    if hasattr(OptimizeRequest, "model_validate_json"):
+        req = OptimizeRequest.model_validate_json(body)
+    else:
+        req = OptimizeRequest.parse_raw(body)
+    return [_model_to_dict(t) for t in req.tracks]
+
+
+def _fast_parse(body):
+    from ga_service import OptimizeRequest
+    from ingest import decode_tracks
+
+    tracks, options = decode_tracks(body)
+    OptimizeRequest(tracks=[], **options)
+    return tracks
+
+
+PARSERS = {"pydantic": _pydantic_parse, "fast": _fast_parse}
+
+
+def measure(parse, body, repeat=5):
+    """Returns the best wall time over repeat runs and the peak traced allocation of one run."""
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        parse(body)
+        best = min(best, time.perf_counter() - started_at)
+    tracemalloc.start()
+    parse(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": best, "peak_alloc_mb": peak / (1024 * 1024)}
+
+
+def run(sizes, dims, seed=0, repeat=5):
+    from benchmarks.synthetic import generate_crate
+
+    rows = []
+    for dim in dims:
+        for n in sizes:
+            body = json.dumps({"tracks": generate_crate(n, dim=dim, seed=seed), "mode": "greedy"}).encode()
+            for name, parse in PARSERS.items():
+                rows.append({"parser": name, "tracks": n, "dim": dim, "bytes": len(body), **measure(parse, body, repeat)})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--dims", nargs="+", type=int, default=DEFAULT_DIMS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for row in run(args.sizes, args.dims, seed=args.seed, repeat=args.repeat):
+        print(
+            f"{row['parser']:>8} n={row['tracks']:<5} dim={row['dim']:<5} "
+            f"{row['seconds'] * 1000:9.2f}ms alloc={row['peak_alloc_mb']:8.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Benchmark the optimizer modes over synthetic crates.
+
+Each (mode, size, dim) case runs in a fresh spawned process so peak RSS is
+per case, and a case that exceeds --timeout is killed and recorded as such;
+larger sizes for that mode are then skipped. Results are written as JSON so
+runs from different commits can be compared with --compare.
+
+    python -m benchmarks.run --sizes 10 100 1000 --dims 128 512 --output bench.json
+    python -m benchmarks.run --compare bench.json --output bench-new.json
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+DEFAULT_MODES = ["greedy", "cohesive_blocks", "genetic", "annealing", "beam", "energy_curve", "target_duration"]
+DEFAULT_SIZES = [10, 50, 100, 250, 500, 1000, 2500, 5000]
+DEFAULT_DIMS = [128]
+MODE_OPTIONS = {
+    "target_duration": {"target_duration_seconds": 90 * 60},
+    "energy_curve": {"energy_curve": [[0.0, 0.3], [0.6, 0.9], [1.0, 0.4]]},
+}
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_case(mode, n, dim, seed, results):
+    from benchmarks.synthetic import generate_crate
+    from ga_service import run_optimizer
+    from optimizer import total_playlist_score
+
+    tracks = generate_crate(n, dim=dim, seed=seed)
+    baseline_rss = _peak_rss_mb()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started_at = time.perf_counter()
+        ordered = run_optimizer(tracks, mode, **MODE_OPTIONS.get(mode, {}))
+        seconds = time.perf_counter() - started_at
+    peak_rss = _peak_rss_mb()
+    results.put(
+        {
+            "seconds": seconds,
+            "peak_rss_mb": peak_rss,
+            "rss_growth_mb": peak_rss - baseline_rss,
+            "score": total_playlist_score(ordered),
+            "result_tracks": len(ordered),
+        }
+    )
+
+
+def run_case(mode, n, dim=128, seed=0, timeout=120.0):
+    """Runs one benchmark case in a spawned process and returns its result row."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_case, args=(mode, n, dim, seed, results))
+    process.start()
+    process.join(timeout)
+    row = {"mode": mode, "tracks": n, "dim": dim, "seed": seed}
+    if process.is_alive():
+        process.kill()
+        process.join()
+        return {**row, "status": "timeout", "timeout_seconds": timeout}
+    if process.exitcode != 0 or results.empty():
+        return {**row, "status": "error", "exit_code": process.exitcode}
+    return {**row, "status": "ok", **results.get()}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def run_benchmarks(modes, sizes, dims, seed=0, timeout=120.0, log=_log):
+    import numpy as np
+
+    rows = []
+    for dim in dims:
+        for mode in modes:
+            for n in sorted(sizes):
+                row = run_case(mode, n, dim=dim, seed=seed, timeout=timeout)
+                rows.append(row)
+                if row["status"] == "ok":
+                    log(
+                        f"{mode:>16} n={n:<5} dim={dim:<5} {row['seconds']:8.3f}s "
+                        f"rss={row['peak_rss_mb']:7.1f}MB score={row['score']:.3f}"
+                    )
+                else:
+                    log(f"{mode:>16} n={n:<5} dim={dim:<5} {row['status']}; skipping larger sizes")
+                    break
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+            "timeout_seconds": timeout,
+        },
+        "results": rows,
+    }
+
+
+def compare(baseline, current, log=_log):
+    """Prints time and score changes for cases present in both reports."""
+    previous = {
+        (row["mode"], row["tracks"], row["dim"]): row
+        for row in baseline["results"]
+        if row["status"] == "ok"
+    }
+    log(f"comparing {current['meta'].get('commit')} against {baseline['meta'].get('commit')}")
+    for row in current["results"]:
+        before = previous.get((row["mode"], row["tracks"], row["dim"]))
+        if row["status"] != "ok" or before is None:
+            continue
+        log(
+            f"{row['mode']:>16} n={row['tracks']:<5} dim={row['dim']:<5} "
+            f"time x{row['seconds'] / max(before['seconds'], 1e-9):6.2f} "
+            f"rss {row['peak_rss_mb'] - before['peak_rss_mb']:+7.1f}MB "
+            f"score {row['score'] - before['score']:+.3f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--dims", nargs="+", type=int, default=DEFAULT_DIMS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds per case")
+    parser.add_argument("--output", type=Path, help="write the JSON report here")
+    parser.add_argument("--compare", type=Path, help="baseline JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.modes, args.sizes, args.dims, seed=args.seed, timeout=args.timeout)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Seeded generator for realistic synthetic crates.
+
+Tracks are drawn from genre clusters with their own tempo, key, energy and
+style vocabularies. Embeddings are clustered around per-genre and per-artist
+centres, and artists follow a Zipf-like distribution so repeats show up the
+way they do in real record collections.
+"""
+
+import json
+import math
+
+import numpy as np
+
+GENRE_PROFILES = {
+    "house": {
+        "genres": ["Electronic"],
+        "styles": ["Deep House", "Garage House", "Tech House", "Chicago House"],
+        "tags": ["warm", "groove", "late night", "vocal"],
+        "bpm": (122.0, 3.0),
+        "energy": 0.65,
+        "minor_share": 0.6,
+    },
+    "techno": {
+        "genres": ["Electronic"],
+        "styles": ["Techno", "Minimal", "Dub Techno", "Acid"],
+        "tags": ["peak", "driving", "hypnotic", "dark"],
+        "bpm": (131.0, 4.0),
+        "energy": 0.8,
+        "minor_share": 0.85,
+    },
+    "disco": {
+        "genres": ["Funk / Soul", "Electronic"],
+        "styles": ["Disco", "Nu-Disco", "Boogie"],
+        "tags": ["uplifting", "strings", "vocal"],
+        "bpm": (116.0, 5.0),
+        "energy": 0.7,
+        "minor_share": 0.4,
+    },
+    "dnb": {
+        "genres": ["Electronic"],
+        "styles": ["Drum n Bass", "Jungle", "Liquid Funk"],
+        "tags": ["breaks", "rolling", "bass"],
+        "bpm": (172.0, 3.0),
+        "energy": 0.85,
+        "minor_share": 0.75,
+    },
+    "hiphop": {
+        "genres": ["Hip Hop"],
+        "styles": ["Boom Bap", "Instrumental", "Jazzy Hip-Hop"],
+        "tags": ["head nod", "samples", "dusty"],
+        "bpm": (92.0, 5.0),
+        "energy": 0.5,
+        "minor_share": 0.65,
+    },
+    "jazz": {
+        "genres": ["Jazz"],
+        "styles": ["Soul Jazz", "Modal", "Hard Bop", "Spiritual Jazz"],
+        "tags": ["laid back", "brassy", "live"],
+        "bpm": (108.0, 18.0),
+        "energy": 0.4,
+        "minor_share": 0.5,
+    },
+    "ambient": {
+        "genres": ["Electronic"],
+        "styles": ["Ambient", "Downtempo", "Balearic"],
+        "tags": ["chill", "pads", "sunrise"],
+        "bpm": (96.0, 12.0),
+        "energy": 0.2,
+        "minor_share": 0.5,
+    },
+}
+
+_NOTES = ["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B"]
+
+
+def _key(rng, minor_share):
+    minor = rng.random() < minor_share
+    roll = rng.random()
+    if roll < 0.05:
+        return None
+    if roll < 0.75:
+        return f"{rng.integers(1, 13)}{'A' if minor else 'B'}"
+    note = _NOTES[rng.integers(0, 12)]
+    if rng.random() < 0.5:
+        return f"{note}m" if minor else note
+    return f"{note} {'minor' if minor else 'major'}"
+
+
+def _unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def generate_crate(n, dim=128, seed=0, genres=None):
+    """
+    Generates n track dicts shaped like /optimize payload tracks.
+
+    Args:
+        n (int): Number of tracks.
+        dim (int): Embedding dimension, e.g. 128, 512 or 1024.
+        seed (int): Seed; the same (n, dim, seed) always yields the same crate.
+        genres (list[str], optional): Subset of GENRE_PROFILES to draw from.
+
+    Returns:
+        list[dict]: Track dicts with JSON-string embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    names = list(genres or GENRE_PROFILES)
+    genre_weights = rng.dirichlet(np.full(len(names), 2.0))
+    centres = _unit(rng.normal(size=(len(names), dim)))
+
+    artist_count = max(1, n // 4)
+    artist_weights = 1.0 / np.arange(1, artist_count + 1) ** 1.1
+    artist_weights /= artist_weights.sum()
+    artist_genre = rng.choice(len(names), size=artist_count, p=genre_weights)
+    artist_offsets = _unit(rng.normal(size=(artist_count, dim))) * 0.5
+    artist_albums = rng.integers(1, 4, size=artist_count)
+
+    tracks = []
+    for idx in range(n):
+        artist = int(rng.choice(artist_count, p=artist_weights))
+        genre_idx = artist_genre[artist] if rng.random() < 0.85 else rng.choice(len(names), p=genre_weights)
+        profile = GENRE_PROFILES[names[genre_idx]]
+
+        bpm = rng.normal(*profile["bpm"])
+        if rng.random() < 0.08:
+            bpm *= 0.5 if bpm > 140 else 2.0 if bpm < 100 else 1.0
+        energy = float(np.clip(rng.normal(profile["energy"], 0.12), 0.0, 1.0))
+        noise = rng.normal(scale=0.6 / math.sqrt(dim), size=dim)
+        embedding = _unit(centres[genre_idx] + artist_offsets[artist] + noise)
+
+        styles = [str(style) for style in rng.choice(profile["styles"], size=rng.integers(1, 3), replace=False)]
+        tags = [str(tag) for tag in rng.choice(profile["tags"], size=rng.integers(0, 3), replace=False)]
+        tracks.append(
+            {
+                "track_id": f"synthetic-{seed}-{idx}",
+                "title": f"Track {idx}",
+                "artist": f"Artist {artist}",
+                "album": f"Album {artist}-{rng.integers(0, artist_albums[artist])}",
+                "genres": list(profile["genres"]),
+                "styles": styles,
+                "local_tags": ", ".join(tags) or None,
+                "bpm": None if rng.random() < 0.03 else round(float(bpm), 2),
+                "key": _key(rng, profile["minor_share"]),
+                "danceability": round(energy, 3),
+                "mood_happy": round(float(rng.beta(2, 2)), 3),
+                "mood_relaxed": round(float(np.clip(1.0 - energy + rng.normal(0, 0.1), 0, 1)), 3),
+                "mood_aggressive": round(float(np.clip(energy - 0.3 + rng.normal(0, 0.1), 0, 1)), 3),
+                "star_rating": None if rng.random() < 0.4 else int(rng.integers(1, 6)),
+                "duration_seconds": int(np.clip(rng.normal(360, 90), 120, 720)),
+                "embedding": json.dumps(np.round(embedding, 6).tolist()),
+            }
+        )
+    return tracks
@@ -0,0 +1,347 @@
+import numpy as np
+
+DEFAULT_SEARCH_BUDGET = 200_000
+
+
+class ConstraintError(ValueError):
+    pass
+
+
+class SequenceConstraints:
+    """
+    Hard sequencing constraints over track indices.
+
+    pinned maps a playlist position to the track that must sit there (negative
+    positions count from the end, so -1 is the closer). must_follow pairs
+    (a, b) require b to be played directly after a, and forbidden pairs (a, b)
+    disallow b directly after a. Pins implied by must-follow chains are
+    propagated, and obviously infeasible requests raise ConstraintError before
+    any optimizer runs.
+    """
+
+    def __init__(self, n, pinned=None, must_follow=None, forbidden=None):
+        self.n = n
+        self.pinned = {}
+        self.successor = {}
+        self.predecessor = {}
+        self.allowed = np.ones((n, n), dtype=bool)
+        np.fill_diagonal(self.allowed, False)
+
+        for track, position in pinned or ():
+            self._pin(self._track(track), self._position(position))
+        for a, b in must_follow or ():
+            self._link(self._track(a), self._track(b))
+        for a, b in forbidden or ():
+            a, b = self._track(a), self._track(b)
+            if self.successor.get(a) == b:
+                raise ConstraintError(f"Track {b} must follow track {a} but that transition is forbidden")
+            self.allowed[a, b] = False
+
+        for a, b in self.successor.items():
+            self.allowed[a, :] = False
+            self.allowed[:, b] = False
+            self.allowed[a, b] = True
+
+        self._propagate_chain_pins()
+        self._check_feasibility()
+
+        self.pinned_tracks = np.zeros(n, dtype=bool)
+        self.pinned_tracks[list(self.pinned.values())] = True
+        self.has_predecessor = np.zeros(n, dtype=bool)
+        self.has_predecessor[list(self.predecessor)] = True
+        self.has_successor = np.zeros(n, dtype=bool)
+        self.has_successor[list(self.successor)] = True
+        self.fixed_tracks = self.pinned_tracks | self.has_predecessor | self.has_successor
+
+    @classmethod
+    def from_spec(cls, n, spec):
+        """Builds constraints from the /optimize payload shape, or None when empty."""
+        if not spec:
+            return None
+        pinned = [(item["track"], item["position"]) for item in spec.get("pinned") or ()]
+        must_follow = [tuple(pair) for pair in spec.get("must_follow") or ()]
+        forbidden = [tuple(pair) for pair in spec.get("forbidden") or ()]
+        if not (pinned or must_follow or forbidden):
+            return None
+        return cls(n, pinned=pinned, must_follow=must_follow, forbidden=forbidden)
+
+    def _track(self, value):
+        if not isinstance(value, (int, np.integer)) or not 0 <= value < self.n:
+            raise ConstraintError(f"Track index {value} out of range for {self.n} tracks")
+        return int(value)
+
+    def _position(self, value):
+        if not isinstance(value, (int, np.integer)) or not -self.n <= value < self.n:
+            raise ConstraintError(f"Position {value} out of range for {self.n} tracks")
+        return int(value) % self.n
+
+    def _pin(self, track, position):
+        if self.pinned.get(position, track) != track:
+            raise ConstraintError(
+                f"Position {position} is pinned to both track {self.pinned[position]} and track {track}"
+            )
+        for other_position, other_track in self.pinned.items():
+            if other_track == track and other_position != position:
+                raise ConstraintError(
+                    f"Track {track} is pinned to both position {other_position} and position {position}"
+                )
+        self.pinned[position] = track
+
+    def _link(self, a, b):
+        if a == b:
+            raise ConstraintError(f"Track {a} cannot follow itself")
+        if self.successor.get(a, b) != b:
+            raise ConstraintError(f"Track {a} must be followed by both track {self.successor[a]} and track {b}")
+        if self.predecessor.get(b, a) != a:
+            raise ConstraintError(f"Track {b} must follow both track {self.predecessor[b]} and track {a}")
+        self.successor[a] = b
+        self.predecessor[b] = a
+
+    def chains(self):
+        """Yields each must-follow chain as a list of track indices, head first."""
+        for head in self.successor:
+            if head in self.predecessor:
+                continue
+            chain = [head]
+            while chain[-1] in self.successor:
+                chain.append(self.successor[chain[-1]])
+            yield chain
+
+    def _propagate_chain_pins(self):
+        chained = set()
+        for chain in self.chains():
+            chained.update(chain)
+            anchors = [
+                (position - offset, track)
+                for offset, track in enumerate(chain)
+                for position, pinned_track in self.pinned.items()
+                if pinned_track == track
+            ]
+            for start, track in anchors:
+                if start < 0 or start + len(chain) > self.n:
+                    raise ConstraintError(f"Must-follow chain through track {track} does not fit its pinned position")
+                for offset, chain_track in enumerate(chain):
+                    self._pin(chain_track, start + offset)
+        if len(chained) < len(set(self.successor) | set(self.predecessor)):
+            raise ConstraintError("Must-follow pairs form a cycle")
+
+    def _check_feasibility(self):
+        for position, track in self.pinned.items():
+            following = self.pinned.get(position + 1)
+            if following is not None and not self.allowed[track, following]:
+                raise ConstraintError(
+                    f"Pinned track {following} at position {position + 1} cannot follow pinned track {track}"
+                )
+            if position == 0 and track in self.predecessor:
+                raise ConstraintError(f"Track {track} is pinned first but must follow track {self.predecessor[track]}")
+            if position == self.n - 1 and track in self.successor:
+                raise ConstraintError(f"Track {track} is pinned last but must be followed by track {self.successor[track]}")
+
+        if self.n < 2:
+            return
+        dead_ends = np.flatnonzero(~self.allowed.any(axis=1))
+        if len(dead_ends) > 1 or any(self.pinned.get(self.n - 1, track) != track for track in dead_ends):
+            raise ConstraintError(f"Tracks {dead_ends.tolist()} have no allowed successor, so they cannot all close the set")
+        dead_starts = np.flatnonzero(~self.allowed.any(axis=0))
+        if len(dead_starts) > 1 or any(self.pinned.get(0, track) != track for track in dead_starts):
+            raise ConstraintError(f"Tracks {dead_starts.tolist()} have no allowed predecessor, so they cannot all open the set")
+
+    def candidate_mask(self, position, previous, available):
+        """Tracks that may be placed at position after previous without violating a constraint."""
+        pinned_track = self.pinned.get(position)
+        if pinned_track is not None:
+            mask = np.zeros(self.n, dtype=bool)
+            mask[pinned_track] = available[pinned_track]
+        else:
+            mask = available & ~self.pinned_tracks
+        if previous is None:
+            mask &= ~self.has_predecessor
+        else:
+            mask &= self.allowed[previous]
+        if position == self.n - 1:
+            mask &= ~self.has_successor
+        following = self.pinned.get(position + 1)
+        if following is not None:
+            mask &= self.allowed[:, following]
+        return mask
+
+    def is_feasible(self, order):
+        order = np.asarray(order)
+        if len(order) != self.n or len(set(order.tolist())) != self.n:
+            return False
+        if any(order[position] != track for position, track in self.pinned.items()):
+            return False
+        if self.has_predecessor[order[0]] or self.has_successor[order[-1]]:
+            return False
+        return bool(self.allowed[order[:-1], order[1:]].all())
+
+    def swap_allowed(self, order, i, j):
+        """True when swapping positions i and j keeps order feasible, checked on the touched edges only."""
+        a, b = order[i], order[j]
+        if self.fixed_tracks[a] or self.fixed_tracks[b]:
+            return False
+        last = len(order) - 1
+        if i > j:
+            i, j = j, i
+            a, b = b, a
+        if i > 0 and not self.allowed[order[i - 1], b]:
+            return False
+        if j < last and not self.allowed[a, order[j + 1]]:
+            return False
+        if j == i + 1:
+            return bool(self.allowed[b, a])
+        return bool(self.allowed[b, order[i + 1]] and self.allowed[order[j - 1], a])
+
+
+def constrained_order(constraints, priority, budget=DEFAULT_SEARCH_BUDGET):
+    """
+    Builds a feasible order by masked argmax with backtracking.
+
+    At each position the feasible candidates are ranked by priority(previous,
+    position), a score vector over all tracks, and the best one is taken. Dead
+    ends backtrack to the next best candidate, so greedy behaviour is kept
+    whenever the constraints allow it.
+
+    Raises:
+        ConstraintError: When no feasible order is found within budget steps.
+    """
+
+    def ranked_candidates(previous, position, mask):
+        candidates = np.flatnonzero(mask)
+        scores = np.asarray(priority(previous, position), dtype=np.float64)[candidates]
+        return candidates[np.argsort(-scores, kind="stable")]
+
+    return _search(constraints, ranked_candidates, budget)
+
+
+def _search(constraints, ranked_candidates, budget):
+    n = constraints.n
+    available = np.ones(n, dtype=bool)
+    order = []
+    stack = []
+    steps = 0
+    while len(order) < n:
+        position = len(order)
+        if len(stack) == position:
+            previous = order[-1] if order else None
+            mask = constraints.candidate_mask(position, previous, available)
+            # Reversed, so the best candidate pops off the end.
+            stack.append(ranked_candidates(previous, position, mask)[::-1].tolist())
+
+        steps += 1
+        if steps > budget:
+            raise ConstraintError("No feasible order found within the search budget")
+        if stack[-1]:
+            track = stack[-1].pop()
+            order.append(track)
+            available[track] = False
+            continue
+
+        stack.pop()
+        if not order:
+            raise ConstraintError("Constraints admit no feasible order")
+        available[order.pop()] = True
+    return order
+
+
+def _glued_order(constraints, order):
+    """
+    order with pinned tracks moved to their slots and must-follow chains glued.
+
+    The remaining chains and tracks keep their relative order and fill the
+    gaps between pinned slots left to right; a chain that does not fit the
+    rest of its gap waits for the next one. Work is vectorized per gap and
+    per waiting chain rather than per track. Returns None when some chain
+    never fits.
+    """
+    n = constraints.n
+    order = np.asarray(order, dtype=np.intp)
+    chains = [chain for chain in constraints.chains() if not constraints.pinned_tracks[chain[0]]]
+    length = np.ones(n, dtype=np.intp)
+    for chain in chains:
+        length[chain[0]] = len(chain)
+    # Chain members after the head follow it; pinned tracks go straight to their slots.
+    queue = order[~(constraints.pinned_tracks | constraints.has_predecessor)[order]]
+
+    free = np.ones(n + 2, dtype=bool)
+    free[[0, n + 1]] = False
+    free[[position + 1 for position in constraints.pinned]] = False
+    edges = np.flatnonzero(np.diff(free.astype(np.int8)))
+    gaps = zip(edges[::2], edges[1::2] - edges[::2])
+
+    heads, slots, waiting = [], [], []
+    for position, room in gaps:
+        for head in list(waiting):
+            if length[head] <= room:
+                waiting.remove(head)
+                heads.append([head])
+                slots.append([position])
+                position += length[head]
+                room -= length[head]
+        while room and len(queue):
+            lengths = length[queue]
+            ends = np.cumsum(lengths)
+            k = int(np.searchsorted(ends, room, side="right"))
+            heads.append(queue[:k])
+            slots.append(position + ends[:k] - lengths[:k])
+            taken = int(ends[k - 1]) if k else 0
+            position += taken
+            room -= taken
+            queue = queue[k:]
+            if room and len(queue):
+                waiting.append(queue[0])
+                queue = queue[1:]
+    if waiting or len(queue):
+        return None
+
+    result = np.empty(n, dtype=np.intp)
+    result[list(constraints.pinned)] = list(constraints.pinned.values())
+    if heads:
+        heads = np.concatenate(heads)
+        slots = np.concatenate(slots)
+        result[slots] = heads
+    for chain in chains:
+        start = int(slots[np.flatnonzero(heads == chain[0])[0]])
+        result[start + 1:start + len(chain)] = chain[1:]
+    return result.tolist()
+
+
+def _swap_out_violations(constraints, order):
+    """Fixes each disallowed transition by swapping a free track in from elsewhere; False when one can't be fixed."""
+    n = constraints.n
+    tracks = np.asarray(order)
+    for position in np.flatnonzero(~constraints.allowed[tracks[:-1], tracks[1:]]).tolist():
+        # An earlier swap may already have fixed this slot.
+        if constraints.allowed[order[position], order[position + 1]]:
+            continue
+        movable = [i for i in (position + 1, position) if not constraints.fixed_tracks[order[i]]]
+        swap = next(
+            ((i, j) for i in movable for j in range(n) if j != i and constraints.swap_allowed(order, i, j)),
+            None,
+        )
+        if swap is None:
+            return False
+        i, j = swap
+        order[i], order[j] = order[j], order[i]
+    return True
+
+
+def repair_order(constraints, order):
+    """
+    Returns a feasible order close to order's sequence, keeping it unchanged when already feasible.
+
+    Pinned tracks are placed directly, must-follow chains are glued and only
+    the slots left on a forbidden transition are swapped, so a repair costs
+    about O(n). When that gets stuck, a backtracking search ranked by order's
+    sequence takes over.
+    """
+    if constraints.is_feasible(order):
+        return list(order)
+    glued = _glued_order(constraints, order)
+    if glued is not None and _swap_out_violations(constraints, glued) and constraints.is_feasible(glued):
+        return glued
+    rank = np.empty(constraints.n, dtype=np.float64)
+    rank[np.asarray(order)] = -np.arange(constraints.n, dtype=np.float64)
+    # The rank never changes, so it is sorted once and filtered per position.
+    ranked = np.argsort(-rank, kind="stable")
+    return _search(constraints, lambda previous, position, mask: ranked[mask[ranked]], DEFAULT_SEARCH_BUDGET)
@@ -0,0 +1,90 @@
+from collections import Counter
+from collections.abc import Sequence
+
+import numpy as np
+import orjson
+
+
+def _decode_embedding(value):
+    if isinstance(value, (str, bytes)):
+        try:
+            value = orjson.loads(value)
+        except orjson.JSONDecodeError:
+            return None
+    return value if isinstance(value, (list, tuple)) and value else None
+
+
+def embedding_matrix(values, dtype=np.float32):
+    """
+    Parses and L2-normalizes embeddings into one (n, dim) matrix.
+
+    dim is the most common embedding length (the first seen wins a tie).
+    Embeddings of any other length are not comparable with the rest, so they
+    are dropped and reported rather than silently scored as dissimilar, as
+    are missing, non-numeric, non-finite and zero vectors. Dropped rows are
+    zero and False in the mask.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray, list[int]]: The matrix, the
+        validity mask and the indices dropped for a mismatched dimension.
+    """
+    decoded = [_decode_embedding(value) for value in values]
+    lengths = Counter(len(vector) for vector in decoded if vector is not None)
+    n = len(decoded)
+    if not lengths:
+        return np.zeros((n, 0), dtype=dtype), np.zeros(n, dtype=bool), []
+
+    dim = lengths.most_common(1)[0][0]
+    rows = [index for index, vector in enumerate(decoded) if vector is not None and len(vector) == dim]
+    mismatched = [index for index, vector in enumerate(decoded) if vector is not None and len(vector) != dim]
+    matrix = np.zeros((n, dim), dtype=dtype)
+    try:
+        matrix[rows] = np.array([decoded[index] for index in rows], dtype=dtype)
+    except (TypeError, ValueError):
+        # Some row holds a non-numeric item; fall back to converting row by row.
+        for index in rows:
+            try:
+                matrix[index] = np.array(decoded[index], dtype=dtype)
+            except (TypeError, ValueError):
+                pass
+
+    norms = np.linalg.norm(matrix, axis=1)
+    mask = np.isfinite(norms) & (norms > 0)
+    matrix[~mask] = 0.0
+    matrix[mask] /= norms[mask, None]
+    return matrix, mask, mismatched
+
+
+class TrackFeatures(Sequence):
+    """
+    Per-request track features shared by every optimizer mode.
+
+    Indexing yields the per-track feature dicts (metadata tokens, energy,
+    bpm, key, artist, album). Embeddings are held once as a normalized
+    float32 matrix with a validity mask, and bpm and energy as arrays.
+    derived holds lookup arrays (key codes, metadata postings) the optimizer
+    builds once per crate and slices for every block it scores.
+    """
+
+    def __init__(self, rows, embeddings, embedding_mask, mismatched=()):
+        self.rows = rows
+        self.embeddings = embeddings
+        self.embedding_mask = embedding_mask
+        self.mismatched = list(mismatched)
+        self.bpms = np.array([row["bpm"] for row in rows], dtype=np.float64)
+        self.energies = np.array([row["energy"] for row in rows], dtype=np.float64)
+        self.derived = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def subset(self, indices):
+        """Features of the tracks at indices, in that order."""
+        return TrackFeatures([self.rows[i] for i in indices], self.embeddings[indices], self.embedding_mask[indices])
+
+    @property
+    def nbytes(self):
+        return self.embeddings.nbytes + self.embedding_mask.nbytes + self.bpms.nbytes + self.energies.nbytes
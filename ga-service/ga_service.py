@@ -1,29 +1,61 @@
 import json
+import time
+
+import orjson
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exception_handlers import RequestValidationError
 from fastapi.exceptions import RequestValidationError as FastAPIRequestValidationError
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 try:
     from pydantic import ConfigDict
 except ImportError:
     ConfigDict = None
-from typing import List, Literal, Optional
+from typing import Dict, List, Literal, Optional, Tuple
 from starlette.concurrency import run_in_threadpool
+from constraints import SequenceConstraints
+from ingest import IngestError, decode_tracks
+from islands import MAX_ISLANDS
+from metrics import QUEUED, REQUESTS, RUNNING, SESSION_BYTES, SESSION_COUNT, observe_request, render_metrics
 from optimizer import (
+    DEFAULT_DURATION_TOLERANCE_SECONDS,
+    DEFAULT_ENERGY_CURVE_WEIGHT,
+    MAX_BEAM_WIDTH,
+    order_from_components,
+    run_beam_search_optimizer,
     run_cohesive_blocks_optimizer,
+    run_energy_curve_optimizer,
     run_genetic_algorithm,
     run_greedy_algorithm,
+    run_simulated_annealing_optimizer,
+    new_seed,
+    run_target_duration_optimizer,
+    score_order,
+    sharing_features,
 )
+from profiling import profiling, record_stage, stage
+from sessions import OptimizerSession, SessionStore
 
 app = FastAPI()
+session_store = SessionStore()
+
+# The endpoint label observe_request uses for each route, so 422s land in the
+# same series as the route's other responses.
+ENDPOINT_LABELS = {
+    "optimize_endpoint": "optimize",
+    "create_session": "session_create",
+    "solve_session": "session_solve",
+}
+
 
 # Custom handler to ensure validation errors return 422 and are logged
 @app.exception_handler(FastAPIRequestValidationError)
 async def validation_exception_handler(request: Request, exc: FastAPIRequestValidationError):
     # Log the error for debugging
     print(f"Validation error on {request.url}: {exc.errors()}")
+    endpoint = getattr(request.scope.get("endpoint"), "__name__", None)
+    REQUESTS.labels(endpoint=ENDPOINT_LABELS.get(endpoint, "other"), mode="unknown", status="422").inc()
     return JSONResponse(
         status_code=422,
         content={"detail": exc.errors(), "body": exc.body},
@@ -48,6 +80,7 @@ class Track(BaseModel):
     mood_relaxed: Optional[float] = None
     mood_aggressive: Optional[float] = None
     star_rating: Optional[float] = None
+    duration_seconds: Optional[float] = None
     embedding: Optional[str] = None
 
     if ConfigDict is None or not hasattr(BaseModel, "model_validate"):
@@ -55,9 +88,55 @@ class Track(BaseModel):
             extra = "allow"
 
 
+class PinnedTrack(BaseModel):
+    track: int
+    position: int
+
+
+class SequenceConstraintsSpec(BaseModel):
+    pinned: List[PinnedTrack] = []
+    must_follow: List[Tuple[int, int]] = []
+    forbidden: List[Tuple[int, int]] = []
+
+
 class OptimizeRequest(BaseModel):
     tracks: List[Track]
-    mode: Literal["genetic", "greedy", "cohesive_blocks"] = "genetic"
+    mode: Literal[
+        "genetic",
+        "greedy",
+        "cohesive_blocks",
+        "target_duration",
+        "energy_curve",
+        "beam",
+        "annealing",
+    ] = "genetic"
+    constraints: Optional[SequenceConstraintsSpec] = None
+    target_duration_seconds: Optional[float] = None
+    duration_tolerance_seconds: float = DEFAULT_DURATION_TOLERANCE_SECONDS
+    energy_curve: Optional[List[Tuple[float, float]]] = None
+    energy_curve_weight: float = DEFAULT_ENERGY_CURVE_WEIGHT
+    beam_width: Optional[int] = Field(None, ge=1, le=MAX_BEAM_WIDTH)
+    time_budget_ms: Optional[float] = None
+    generations: Optional[int] = None
+    population_size: Optional[int] = None
+    islands: Optional[int] = Field(None, ge=1, le=MAX_ISLANDS)
+    migration_interval: Optional[int] = None
+    iterations: Optional[int] = None
+    initial_temperature: Optional[float] = None
+    final_temperature: Optional[float] = None
+    cooling: Literal["geometric", "linear"] = "geometric"
+    # greedy/cohesive_blocks only (other modes reject it): only follow a track
+    # with a Camelot-compatible one (same key, relative, or one step round the
+    # wheel) unless none remain.
+    strict_harmonic: bool = False
+    # Seeds stochastic modes; when omitted a fresh seed is drawn and echoed.
+    seed: Optional[int] = None
+    debug_timings: bool = False
+    # "tracks" echoes the ordered track dicts; "indices" and "ids" return only
+    # the permutation (input positions or id_field values) plus its score.
+    return_format: Literal["tracks", "indices", "ids"] = Field("tracks", alias="return")
+    id_field: str = "track_id"
+    strip_embeddings: bool = False
 
 
 def _model_to_dict(model: BaseModel):
@@ -66,27 +145,277 @@ def _model_to_dict(model: BaseModel):
     return model.dict()
 
 
-def run_optimizer(tracks, mode):
+def _build_constraints(n, spec, start_idx=None):
+    with stage("constraints"):
+        spec = _model_to_dict(spec) if spec is not None else {}
+        if start_idx is not None:
+            spec["pinned"] = list(spec.get("pinned") or []) + [{"track": start_idx, "position": 0}]
+        return SequenceConstraints.from_spec(n, spec)
+
+
+HARMONIC_MODES = ("greedy", "cohesive_blocks")
+
+
+def _mode_options(req: OptimizeRequest):
+    if req.strict_harmonic and req.mode not in HARMONIC_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"strict_harmonic is only supported by {', '.join(HARMONIC_MODES)}, not {req.mode}",
+        )
+    if req.mode == "target_duration":
+        return {
+            "target_duration_seconds": req.target_duration_seconds,
+            "tolerance_seconds": req.duration_tolerance_seconds,
+        }
+    if req.mode == "energy_curve":
+        options = {"energy_curve": req.energy_curve, "curve_weight": req.energy_curve_weight}
+        if req.beam_width is not None:
+            options["beam_width"] = req.beam_width
+        return options
+    if req.mode == "genetic":
+        options = {"time_budget_ms": req.time_budget_ms, "seed": req.seed}
+        for option, name in (
+            ("generations", "generations"),
+            ("pop_size", "population_size"),
+            ("islands", "islands"),
+            ("migration_interval", "migration_interval"),
+        ):
+            if getattr(req, name) is not None:
+                options[option] = getattr(req, name)
+        return options
+    if req.mode == "annealing":
+        return {
+            "iterations": req.iterations,
+            "time_budget_ms": req.time_budget_ms,
+            "initial_temperature": req.initial_temperature,
+            "final_temperature": req.final_temperature,
+            "cooling": req.cooling,
+            "seed": req.seed,
+            "stats": {},
+        }
+    if req.mode in HARMONIC_MODES:
+        return {"strict_harmonic": req.strict_harmonic}
+    if req.mode == "beam":
+        options = {"time_budget_ms": req.time_budget_ms}
+        if req.beam_width is not None:
+            options["beam_width"] = req.beam_width
+        return options
+    return {}
+
+
+def run_optimizer(tracks, mode, constraints=None, **options):
+    if mode == "target_duration":
+        return run_target_duration_optimizer(tracks, constraints=constraints, **options)
+    if mode == "energy_curve":
+        return run_energy_curve_optimizer(tracks, constraints=constraints, **options)
+    if mode == "beam":
+        return run_beam_search_optimizer(tracks, constraints=constraints, **options)
+    if mode == "annealing":
+        return run_simulated_annealing_optimizer(tracks, constraints=constraints, **options)
     if mode == "genetic":
-        return run_genetic_algorithm(tracks)
+        return run_genetic_algorithm(tracks, constraints=constraints, **options)
     if mode == "greedy":
-        return run_greedy_algorithm(tracks)
+        return run_greedy_algorithm(tracks, constraints=constraints, **options)
     if mode == "cohesive_blocks":
-        return run_cohesive_blocks_optimizer(tracks)
+        return run_cohesive_blocks_optimizer(tracks, constraints=constraints, **options)
     raise ValueError(f"Unsupported optimizer mode: {mode}")
 
 
-@app.post("/optimize")
-async def optimize(req: OptimizeRequest):
-    # Convert Pydantic models to plain dicts
-    tracks = [_model_to_dict(t) for t in req.tracks]
-    print(f"Optimize request mode={req.mode} tracks={len(tracks)}", flush=True)
+def _format_result(req: OptimizeRequest, tracks, optimized):
+    if req.return_format == "tracks":
+        if req.strip_embeddings:
+            optimized = [
+                {key: value for key, value in track.items() if key != "embedding"}
+                for track in optimized
+            ]
+        return {"result": optimized}
+
+    # Optimizers return the input dicts themselves, so identity maps them back.
+    positions = {id(track): index for index, track in enumerate(tracks)}
+    order = [positions[id(track)] for track in optimized]
+    result = {"score": score_order(tracks, order)}
+    if req.return_format == "indices":
+        result["order"] = order
+        return result
+    ids = [tracks[index].get(req.id_field) for index in order]
+    if any(track_id is None for track_id in ids):
+        raise ValueError(f"return=ids needs every track to have a '{req.id_field}' field")
+    result["ids"] = ids
+    return result
+
+
+def _solve(req: OptimizeRequest, tracks, constraints, options):
+    # One job for both steps, so the score reuses the optimizer's features.
+    with sharing_features():
+        optimized = run_optimizer(tracks, req.mode, constraints, **options)
+        with stage("format", count=len(optimized)):
+            return _format_result(req, tracks, optimized)
+
+
+async def _offload(func, *args, profile=None, **kwargs):
+    """Runs func on the threadpool, tracking queued/running jobs and the request's profile."""
+    started = False
+
+    def job():
+        nonlocal started
+        started = True
+        QUEUED.dec()
+        RUNNING.inc()
+        try:
+            if profile is None:
+                return func(*args, **kwargs)
+            # Worker threads do not see the request's context, so re-activate its profile.
+            with profiling(profile.mode, profile):
+                return func(*args, **kwargs)
+        finally:
+            RUNNING.dec()
+
+    QUEUED.inc()
+    try:
+        return await run_in_threadpool(job)
+    finally:
+        if not started:
+            QUEUED.dec()
+
 
-    # Offload CPU‐bound work to a thread
+async def optimize(req: OptimizeRequest, tracks=None, parse_seconds=None):
+    """
+    Runs the requested optimizer. tracks, when given, are already-decoded
+    track dicts from the fast ingestion path and req.tracks is ignored.
+    """
+    track_count = len(req.tracks) if tracks is None else len(tracks)
+    with observe_request("optimize", req.mode, track_count), profiling(req.mode) as profile:
+        if tracks is None:
+            # Convert Pydantic models to plain dicts
+            with stage("parse", count=track_count):
+                tracks = [_model_to_dict(t) for t in req.tracks]
+        elif parse_seconds is not None:
+            record_stage("parse", parse_seconds, count=track_count)
+        print(f"Optimize request mode={req.mode} tracks={len(tracks)}", flush=True)
+
+        options = _mode_options(req)
+        if "seed" in options and options["seed"] is None:
+            options["seed"] = new_seed()
+
+        # Offload CPU‐bound work to a thread
+        try:
+            constraints = _build_constraints(len(tracks), req.constraints)
+            response = await _offload(_solve, req, tracks, constraints, options, profile=profile)
+        except (KeyError, TypeError, ValueError, json.JSONDecodeError) as e:
+            # For example, if your algorithm raises on malformed data
+            raise HTTPException(status_code=400, detail=str(e))
+
+        print(f"Optimize timings mode={req.mode} {profile.summary()}", flush=True)
+    response["mode"] = req.mode
+    if "seed" in options:
+        response["seed"] = options["seed"]
+    if req.mode == "annealing":
+        response["annealing"] = options["stats"]
+    if req.debug_timings:
+        response["timings"] = profile.to_dict()
+    return response
+
+
+@app.post("/optimize")
+async def optimize_endpoint(request: Request):
+    # Tracks skip Pydantic entirely: they are decoded once with orjson and
+    # type-checked in place. Only the small option fields build a model.
+    body = await request.body()
+    started_at = time.perf_counter()
     try:
-        optimized = await run_in_threadpool(run_optimizer, tracks, req.mode)
-    except (KeyError, TypeError, ValueError, json.JSONDecodeError) as e:
-        # For example, if your algorithm raises on malformed data
-        raise HTTPException(status_code=400, detail=str(e))
+        tracks, options = decode_tracks(body)
+        req = OptimizeRequest(tracks=[], **options)
+    except IngestError as e:
+        raise FastAPIRequestValidationError(e.errors)
+    except ValidationError as e:
+        raise FastAPIRequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors()]
+        )
+    result = await optimize(req, tracks=tracks, parse_seconds=time.perf_counter() - started_at)
+    # Serialize once with orjson rather than walking every track through jsonable_encoder.
+    return Response(content=orjson.dumps(result), media_type="application/json")
+
+
+@app.get("/metrics")
+async def metrics():
+    stats = session_store.stats()
+    SESSION_COUNT.set(stats["sessions"])
+    SESSION_BYTES.set(stats["bytes"])
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+class SessionCreateRequest(BaseModel):
+    tracks: List[Track]
+
+
+class SessionSolveRequest(BaseModel):
+    mode: Literal["greedy", "cohesive_blocks"] = "greedy"
+    weights: Optional[Dict[str, float]] = None
+    start_idx: Optional[int] = None
+    constraints: Optional[SequenceConstraintsSpec] = None
+    strict_harmonic: bool = False
+
+
+def _get_session(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    return session
+
+
+@app.post("/optimize/sessions")
+async def create_session(req: SessionCreateRequest):
+    with observe_request("session_create", "session", len(req.tracks)):
+        tracks = [_model_to_dict(t) for t in req.tracks]
+        print(f"Create optimizer session tracks={len(tracks)}", flush=True)
+
+        try:
+            # Reject oversized crates before allocating their n x n matrices.
+            session_store.check_size(OptimizerSession.estimated_nbytes(len(tracks)))
+            session = await _offload(OptimizerSession.from_tracks, tracks)
+            session_store.add(session)
+        except (KeyError, TypeError, ValueError, json.JSONDecodeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "session_id": session.session_id,
+        "tracks": len(tracks),
+        "bytes": session.nbytes,
+        "ttl_seconds": session_store.ttl_seconds,
+    }
+
+
+@app.post("/optimize/sessions/{session_id}/solve")
+async def solve_session(session_id: str, req: SessionSolveRequest):
+    with observe_request("session_solve", req.mode):
+        session = _get_session(session_id)
+        try:
+            constraints = _build_constraints(len(session.tracks), req.constraints, req.start_idx)
+            order, score = await _offload(
+                order_from_components,
+                session.features,
+                session.components,
+                req.mode,
+                req.weights,
+                req.start_idx,
+                constraints,
+                req.strict_harmonic,
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "result": [session.tracks[i] for i in order],
+        "order": order,
+        "score": score,
+        "mode": req.mode,
+        "session_id": session_id,
+    }
+
 
-    return {"result": optimized, "mode": req.mode}
+@app.delete("/optimize/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    return {"deleted": session_id}
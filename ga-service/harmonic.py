@@ -0,0 +1,94 @@
+import numpy as np
+
+CAMELOT_CODES = 24
+
+
+def camelot_code(parsed_key):
+    """
+    Maps a parsed key (see optimizer._parse_key) to a Camelot code 0..23.
+
+    code // 2 is the wheel number minus one and code % 2 is 0 for A (minor)
+    and 1 for B (major). Pitch-class keys are placed on the wheel, so
+    "C major" and "8B" share a bucket. Returns -1 for unknown keys.
+    """
+    if parsed_key is None:
+        return -1
+    kind, value, mode = parsed_key
+    if kind == "camelot":
+        number, major = value, mode == "B"
+    else:
+        major = mode == "major"
+        # Relative major of a minor key is three semitones up; C major is 8B
+        # and each fifth (7 semitones) moves one step round the wheel.
+        pitch = value if major else (value + 3) % 12
+        number = (7 * pitch + 7) % 12 + 1
+    return (number - 1) * 2 + int(major)
+
+
+def _neighbour_table():
+    table = np.zeros((CAMELOT_CODES, CAMELOT_CODES), dtype=bool)
+    for code in range(CAMELOT_CODES):
+        number, letter = divmod(code, 2)
+        for other_number, other_letter in (
+            (number, letter),
+            (number, 1 - letter),
+            ((number + 1) % 12, letter),
+            ((number - 1) % 12, letter),
+        ):
+            table[code, other_number * 2 + other_letter] = True
+    return table
+
+
+NEIGHBOURS = _neighbour_table()
+
+
+class HarmonicIndex:
+    """
+    Tracks bucketed by Camelot code with precomputed compatible buckets.
+
+    A transition is harmonic when both tracks share a code, are relative
+    major/minor, or sit one step apart on the wheel with the same letter.
+    Tracks without a recognised key are compatible with everything, so they
+    never strand a search.
+    """
+
+    def __init__(self, parsed_keys):
+        self.codes = np.array([camelot_code(key) for key in parsed_keys], dtype=np.intp)
+        known = np.flatnonzero(self.codes >= 0)
+        self.unknown = np.flatnonzero(self.codes < 0)
+        self.buckets = {int(code): np.flatnonzero(self.codes == code) for code in np.unique(self.codes[known])}
+        self._neighbour_buckets = {
+            code: np.concatenate(
+                [self.buckets[other] for other in np.flatnonzero(NEIGHBOURS[code]) if other in self.buckets]
+                + [self.unknown]
+            )
+            for code in self.buckets
+        }
+
+    def compatible(self, a, b):
+        """Whether track b may harmonically follow track a, elementwise over index arrays."""
+        a = np.asarray(a)
+        b = np.asarray(b)
+        codes_a = self.codes[a]
+        codes_b = self.codes[b]
+        return ((codes_a < 0) | (codes_b < 0) | NEIGHBOURS[codes_a, codes_b]) & (a != b)
+
+    def successors(self, track):
+        """Tracks that may harmonically follow track, drawn from its neighbouring buckets."""
+        code = int(self.codes[track])
+        if code < 0:
+            candidates = np.arange(len(self.codes))
+        else:
+            candidates = self._neighbour_buckets[code]
+        return candidates[candidates != track]
+
+    def successor_groups(self):
+        """Yields (tracks, successors) per bucket; every track in tracks may be followed by any of successors."""
+        for code, members in self.buckets.items():
+            yield members, self._neighbour_buckets[code]
+        if len(self.unknown):
+            yield self.unknown, np.arange(len(self.codes))
+
+    def candidate_pairs(self):
+        """Number of (track, successor) pairs left to score once non-harmonic ones are pruned."""
+        return sum(len(members) * len(successors) for members, successors in self.successor_groups())
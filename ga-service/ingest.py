@@ -0,0 +1,84 @@
+import orjson
+
+TEXT_FIELDS = ("title", "artist", "album", "local_tags", "notes", "key", "embedding")
+LIST_FIELDS = ("genres", "styles")
+NUMBER_FIELDS = (
+    "bpm",
+    "danceability",
+    "mood_happy",
+    "mood_relaxed",
+    "mood_aggressive",
+    "star_rating",
+    "duration_seconds",
+)
+
+
+class IngestError(ValueError):
+    """Request body rejected by the fast path; errors follows Pydantic's errors() shape."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(error["msg"] for error in errors))
+        self.errors = errors
+
+
+def _error(loc, msg, kind):
+    return {"loc": ["body", *loc], "msg": msg, "type": kind}
+
+
+def _check_track(index, track, errors):
+    if not isinstance(track, dict):
+        errors.append(_error(("tracks", index), "Input should be a valid dictionary", "dict_type"))
+        return
+    for field in TEXT_FIELDS:
+        value = track.get(field)
+        if value is not None and not isinstance(value, str):
+            errors.append(_error(("tracks", index, field), "Input should be a valid string", "string_type"))
+    for field in LIST_FIELDS:
+        value = track.get(field)
+        if value is not None and not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+            errors.append(_error(("tracks", index, field), "Input should be a list of strings", "list_type"))
+    for field in NUMBER_FIELDS:
+        value = track.get(field)
+        if value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)):
+            continue
+        if isinstance(value, str):
+            try:
+                track[field] = float(value)
+                continue
+            except ValueError:
+                pass
+        errors.append(_error(("tracks", index, field), "Input should be a valid number", "float_type"))
+
+
+def decode_tracks(body):
+    """
+    Decodes a JSON request body and checks its tracks without building models.
+
+    Tracks stay the decoded dicts, so unknown fields pass through untouched.
+    Only the declared Track fields are type-checked (numeric strings are
+    coerced the way Pydantic's lax mode does); everything else in the body is
+    returned unvalidated for the caller to check.
+
+    Returns:
+        tuple[list[dict], dict]: The tracks and the remaining top-level fields.
+
+    Raises:
+        IngestError: When the body is not JSON or a track field has the wrong type.
+    """
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError as exc:
+        raise IngestError([_error((), f"JSON decode error: {exc}", "json_invalid")]) from None
+    if not isinstance(payload, dict):
+        raise IngestError([_error((), "Input should be a valid dictionary", "dict_type")])
+    tracks = payload.pop("tracks", None)
+    if not isinstance(tracks, list):
+        kind = "missing" if tracks is None else "list_type"
+        raise IngestError([_error(("tracks",), "Field required" if tracks is None else "Input should be a valid list", kind)])
+
+    errors = []
+    for index, track in enumerate(tracks):
+        _check_track(index, track, errors)
+    if errors:
+        raise IngestError(errors)
+    return tracks, payload
@@ -0,0 +1,217 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from constraints import repair_order
+from profiling import stage
+
+ISLAND_WORKERS = int(os.getenv("GA_ISLAND_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_MIGRATION_INTERVAL = 5
+# Each island is a whole population, however few workers run them.
+MAX_ISLANDS = 64
+DEFAULT_MIGRANTS = 2
+MUTATION_RATE = 0.05
+_ELITES = 2
+_PARENTS = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def fitness_matrix(embeddings, bpms):
+    """
+    Pairwise GA transition scores: cosine similarity minus bpm distance / 10.
+
+    embeddings must be L2-normalized with zero rows for missing vectors, so
+    those transitions score zero similarity.
+    """
+    matrix = embeddings @ embeddings.T
+    matrix -= np.abs(bpms[:, None] - bpms[None, :]).astype(matrix.dtype) / 10
+    return matrix
+
+
+def population_fitness(population, matrix):
+    return matrix[population[:, :-1], population[:, 1:]].sum(axis=1, dtype=np.float64)
+
+
+def _initial_population(n, pop_size, rng, constraints):
+    if constraints is None:
+        return np.stack([rng.permutation(n) for _ in range(pop_size)])
+    return np.stack([repair_order(constraints, rng.permutation(n)) for _ in range(pop_size)])
+
+
+def _crossover(p1, p2, rng):
+    slice_size = len(p1) // 2
+    start = rng.integers(0, len(p1) - slice_size + 1)
+    slice_ = p1[start:start + slice_size]
+    return np.concatenate([slice_, p2[~np.isin(p2, slice_)]])
+
+
+def _mutate(order, rng, constraints):
+    if rng.random() < MUTATION_RATE:
+        i, j = rng.choice(len(order), 2, replace=False)
+        if constraints is None or constraints.swap_allowed(order, i, j):
+            order[i], order[j] = order[j], order[i]
+    return order
+
+
+def evolve(population, matrix, generations, rng, constraints=None, deadline=None):
+    """
+    Runs generations of truncation selection, slice crossover and swap mutation.
+
+    Returns:
+        tuple[numpy.ndarray, int]: The final population and the number of
+        generations actually run before deadline (a time.monotonic value).
+    """
+    pop_size = len(population)
+    for generation in range(generations):
+        if deadline is not None and time.monotonic() > deadline:
+            return population, generation
+        with stage("ga_generation", count=pop_size):
+            ranked = population[np.argsort(-population_fitness(population, matrix), kind="stable")]
+            top = ranked[:_PARENTS]
+            children = list(ranked[:_ELITES])
+            while len(children) < pop_size:
+                a, b = rng.choice(len(top), 2, replace=False)
+                child = _crossover(top[a], top[b], rng)
+                if constraints is not None and not constraints.is_feasible(child):
+                    child = np.array(repair_order(constraints, child))
+                children.append(_mutate(child, rng, constraints))
+            population = np.stack(children)
+    return population, generations
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attachments with the resource tracker, which
+        # would unlink the segment when this worker exits.
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _evolve_island(matrix_spec, population, generations, rng, constraints, deadline):
+    name, shape, dtype = matrix_spec
+    shm = _attach(name)
+    try:
+        matrix = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        population, ran = evolve(population, matrix, generations, rng, constraints, deadline)
+        del matrix
+        return population, rng, ran
+    finally:
+        shm.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=ISLAND_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _migrate(populations, matrix, migrants):
+    # Ring topology: each island's best replace the next island's worst.
+    ranked = [population[np.argsort(-population_fitness(population, matrix), kind="stable")] for population in populations]
+    emigrants = [population[:migrants].copy() for population in ranked]
+    for index, population in enumerate(ranked):
+        population[-migrants:] = emigrants[index - 1]
+    return ranked
+
+
+def run_islands(
+    matrix,
+    pop_size,
+    generations,
+    islands,
+    seed=None,
+    constraints=None,
+    migration_interval=DEFAULT_MIGRATION_INTERVAL,
+    migrants=DEFAULT_MIGRANTS,
+    time_budget_ms=None,
+    parallel=None,
+):
+    """
+    Evolves islands subpopulations in worker processes and returns the best order.
+
+    The fitness matrix is placed in shared memory once and every worker maps
+    it read-only. Islands evolve migration_interval generations at a time,
+    then the best migrants of each island replace the worst of the next.
+    Each island owns a PCG64 stream spawned from seed, so the result depends
+    only on the seed and parameters, not on worker count or scheduling,
+    unless time_budget_ms cuts the run short.
+
+    Args:
+        parallel (bool, optional): Use the process pool; defaults to
+            GA_ISLAND_WORKERS > 1.
+
+    Returns:
+        list[int]: The fittest order across all islands.
+    """
+    n = matrix.shape[0]
+    migrants = max(0, min(migrants, pop_size - _ELITES)) if islands > 1 else 0
+    migration_interval = max(1, migration_interval)
+    rngs = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(islands)]
+    with stage("ga_init", count=islands * pop_size):
+        populations = [_initial_population(n, pop_size, rng, constraints) for rng in rngs]
+    deadline = time.monotonic() + time_budget_ms / 1000.0 if time_budget_ms else None
+    parallel = ISLAND_WORKERS > 1 if parallel is None else parallel
+
+    shm = None
+    if parallel:
+        shm = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        shared = np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=shm.buf)
+        shared[:] = matrix
+        del shared
+    try:
+        remaining = generations
+        while remaining > 0:
+            epoch = min(migration_interval, remaining)
+            with stage("ga_epoch", count=islands * epoch):
+                if parallel:
+                    spec = (shm.name, matrix.shape, matrix.dtype.str)
+                    tasks = [(spec, populations[i], epoch, rngs[i], constraints, deadline) for i in range(islands)]
+                    try:
+                        results = list(_get_executor().map(_evolve_island, *zip(*tasks)))
+                    except BrokenProcessPool:
+                        _reset_executor()
+                        raise
+                else:
+                    results = []
+                    for population, rng in zip(populations, rngs):
+                        population, ran = evolve(population, matrix, epoch, rng, constraints, deadline)
+                        results.append((population, rng, ran))
+            populations = [population for population, _, _ in results]
+            rngs = [rng for _, rng, _ in results]
+            remaining -= epoch
+            if any(ran < epoch for _, _, ran in results):
+                break
+            if remaining > 0 and migrants:
+                populations = _migrate(populations, matrix, migrants)
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    everyone = np.concatenate(populations)
+    best = everyone[int(np.argmax(population_fitness(everyone, matrix)))]
+    return best.tolist()
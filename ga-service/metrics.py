@@ -0,0 +1,93 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+REQUESTS = Counter(
+    "ga_requests",
+    "Optimizer API requests by endpoint, mode and HTTP status.",
+    ["endpoint", "mode", "status"],
+)
+REQUEST_SECONDS = Histogram(
+    "ga_request_seconds",
+    "End-to-end latency of optimizer API requests.",
+    ["endpoint", "mode"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+REQUEST_TRACKS = Histogram(
+    "ga_request_tracks",
+    "Number of tracks per optimizer request.",
+    ["endpoint"],
+    buckets=(2, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+IN_FLIGHT = Gauge(
+    "ga_requests_in_flight",
+    "Optimizer API requests currently being handled.",
+    ["endpoint"],
+)
+QUEUED = Gauge(
+    "ga_optimizer_jobs_queued",
+    "Optimizer jobs waiting for a threadpool worker.",
+)
+RUNNING = Gauge(
+    "ga_optimizer_jobs_running",
+    "Optimizer jobs currently running on a threadpool worker.",
+)
+SESSION_LOOKUPS = Counter(
+    "ga_session_cache_lookups",
+    "Optimizer session cache lookups by result (hit or miss).",
+    ["result"],
+)
+SESSION_EVICTIONS = Counter(
+    "ga_session_cache_evictions",
+    "Optimizer sessions evicted from the cache by reason (ttl or size).",
+    ["reason"],
+)
+SESSION_BYTES = Gauge(
+    "ga_session_cache_bytes",
+    "Bytes of component matrices held by the optimizer session cache.",
+)
+SESSION_COUNT = Gauge(
+    "ga_session_cache_sessions",
+    "Optimizer sessions held in the cache.",
+)
+
+STAGE_SECONDS = Histogram(
+    "ga_optimizer_stage_seconds",
+    "Wall time of each optimizer stage.",
+    ["mode", "stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+STAGE_ITEMS = Counter(
+    "ga_optimizer_stage_items",
+    "Items processed by each optimizer stage (tracks, matrix cells, moves, generations).",
+    ["mode", "stage"],
+)
+
+
+def render_metrics():
+    """Returns the Prometheus exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def observe_request(endpoint, mode, tracks=None):
+    """
+    Counts a request and times it, labelling it with the status code of any
+    exception raised (HTTPException-style status_code, else 500).
+    """
+    IN_FLIGHT.labels(endpoint=endpoint).inc()
+    if tracks is not None:
+        REQUEST_TRACKS.labels(endpoint=endpoint).observe(tracks)
+    status = "500"
+    started_at = time.perf_counter()
+    try:
+        yield
+        status = "200"
+    except Exception as exc:
+        status = str(getattr(exc, "status_code", 500))
+        raise
+    finally:
+        IN_FLIGHT.labels(endpoint=endpoint).dec()
+        REQUEST_SECONDS.labels(endpoint=endpoint, mode=mode).observe(time.perf_counter() - started_at)
+        REQUESTS.labels(endpoint=endpoint, mode=mode, status=status).inc()
@@ -1,157 +1,169 @@
-import random
 import numpy as np
+import contextvars
 import json
 import math
 import re
+import secrets
 import time
 from collections import defaultdict
+from contextlib import contextmanager
 
-
-def _parse_embedding(value):
-    if value is None:
-        return None
-    if isinstance(value, str):
-        value = json.loads(value)
-    if not isinstance(value, (list, tuple)):
-        return None
-    parsed = []
-    for item in value:
-        try:
-            parsed.append(float(item))
-        except (TypeError, ValueError):
-            return None
-    return parsed
-
-
-def normalize_embedding(value):
-    embedding = _parse_embedding(value)
-    if not embedding:
-        return None
-    norm = math.sqrt(sum(x * x for x in embedding))
-    if norm == 0:
-        return None
-    return [x / norm for x in embedding]
-
-
-def cosine_similarity(a, b):
-    norm_a = normalize_embedding(a)
-    norm_b = normalize_embedding(b)
-    if not norm_a or not norm_b or len(norm_a) != len(norm_b):
-        return 0.0
-    return sum(x * y for x, y in zip(norm_a, norm_b))
+from constraints import ConstraintError, SequenceConstraints, constrained_order, repair_order
+from features import TrackFeatures, embedding_matrix
+from harmonic import HarmonicIndex
+from islands import DEFAULT_MIGRANTS, DEFAULT_MIGRATION_INTERVAL, fitness_matrix, run_islands
+from profiling import stage
 
 
 def _clamp(value, low=0.0, high=1.0):
     return max(low, min(high, value))
 
 
-def score_transition(i, j, embeddings, norms, bpms):
-    sim = (
-        0.0
-        if norms[i] == 0 or norms[j] == 0
-        else np.dot(embeddings[i], embeddings[j]) / (norms[i] * norms[j])
-    )
-    bpm_diff = abs(bpms[i] - bpms[j]) / 10
-    return sim - bpm_diff
-
-
-def score_playlist(order, embeddings, norms, bpms):
-    return sum(
-        score_transition(order[k], order[k+1], embeddings, norms, bpms)
-        for k in range(len(order)-1)
-    )
-
-
-def crossover(p1, p2):
-    size = len(p1)
-    slice_size = size // 2
-    start = random.randint(0, size - slice_size)
-    slice_ = p1[start:start + slice_size]
-    rest = [x for x in p2 if x not in slice_]
-    return slice_ + rest
-
+def new_seed():
+    """A fresh run seed small enough to survive a round trip through JavaScript numbers."""
+    return secrets.randbits(53)
 
-def mutate(order, rate=0.05):
-    if random.random() < rate:
-        i, j = random.sample(range(len(order)), 2)
-        order[i], order[j] = order[j], order[i]
-    return order
 
-
-def run_genetic_algorithm(tracks, generations=20, pop_size=40, seed=None, seed_idx=None):
+def run_genetic_algorithm(
+    tracks,
+    generations=20,
+    pop_size=40,
+    seed=None,
+    seed_idx=None,
+    constraints=None,
+    islands=1,
+    migration_interval=DEFAULT_MIGRATION_INTERVAL,
+    migrants=DEFAULT_MIGRANTS,
+    time_budget_ms=None,
+):
     """
     Runs a genetic algorithm to order tracks by embedding similarity and BPM continuity.
 
+    Each run owns its random streams (PCG64, spawned from seed), so
+    concurrent runs never share RNG state and a seed reproduces a result.
+    With islands > 1 the islands populations of pop_size evolve in worker
+    processes over a shared fitness matrix and exchange migrants every
+    migration_interval generations (see run_islands).
+
     Args:
-        tracks (list[dict]): Each dict must have keys 'embedding' (JSON string) and optional 'bpm'.
+        tracks (list[dict]): Each dict should have 'embedding' (JSON string) and 'bpm';
+            tracks without a usable embedding score zero similarity.
         generations (int): Number of evolution cycles.
         pop_size (int): Population size.
-        seed (int, optional): Seed for reproducibility.
+        seed (int, optional): Seed for reproducibility; None draws fresh entropy.
         seed_idx (int, optional): Index of track to pin as first in playlist.
+        constraints (SequenceConstraints, optional): Hard sequencing constraints;
+            crossover children are repaired and mutations only make feasible swaps.
+        islands (int): Number of island subpopulations.
+        migration_interval (int): Generations between island migrations.
+        migrants (int): Elites sent to the next island on each migration.
+        time_budget_ms (float, optional): Stop evolving once this much wall
+            time has passed.
 
     Returns:
         list[dict]: Ordered list of track dicts.
     """
     n = len(tracks)
+    if generations < 1 or pop_size < 2 or islands < 1:
+        raise ValueError("generations and islands must be at least 1 and pop_size at least 2")
     if n < 2:
         return tracks[:]
-    # Seed RNGs
-    if seed is not None:
-        random.seed(seed)
-        np.random.seed(seed)
-    # Prepare arrays
-    embeddings = np.array([json.loads(t['embedding'])
-                          for t in tracks], dtype=np.float32)
-    norms = np.linalg.norm(embeddings, axis=1)
-    bpms = np.array([t.get('bpm', 0) for t in tracks], dtype=np.float32)
-    # Initialize population
-    if seed_idx is None:
-        population = [random.sample(range(n), n) for _ in range(pop_size)]
-    else:
-        rest = list(range(n))
-        rest.remove(seed_idx)
-        population = [[seed_idx] +
-                      random.sample(rest, n-1) for _ in range(pop_size)]
-    # Evolve
-    for _ in range(generations):
-        scored = sorted(
-            population,
-            key=lambda order: score_playlist(order, embeddings, norms, bpms),
-            reverse=True
-        )
-        top = scored[:10]
-        new_gen = top[:2]  # elitism
-        while len(new_gen) < pop_size:
-            p1, p2 = random.sample(top, 2)
-            child = mutate(crossover(p1[:], p2[:]))
-            new_gen.append(child)
-        population = new_gen
-    # Select best and tie-break reverse
-    best = max(population, key=lambda o: score_playlist(
-        o, embeddings, norms, bpms))
-    rev = list(reversed(best))
-    canonical = min(best, rev)
+    if constraints is not None and seed_idx is not None:
+        raise ConstraintError("Pin the first track with constraints instead of seed_idx")
+    features = _prepare_track_features(tracks)
+    matrix = fitness_matrix(features.embeddings, features.bpms.astype(np.float32))
+    if seed_idx is not None:
+        constraints = SequenceConstraints(n, pinned=[(seed_idx, 0)])
+    best = run_islands(
+        matrix,
+        pop_size,
+        generations,
+        islands,
+        seed=seed,
+        constraints=constraints,
+        migration_interval=migration_interval,
+        migrants=migrants,
+        time_budget_ms=time_budget_ms,
+        parallel=None if islands > 1 else False,
+    )
+    # Transitions score the same both ways, so pick a canonical direction.
+    canonical = min(best, best[::-1])
+    if constraints is not None and not constraints.is_feasible(canonical):
+        canonical = best
     return [tracks[i] for i in canonical]
 
 
-def run_greedy_algorithm(tracks):
+_HARMONIC_PENALTY = 10.0
+
+
+def _constrained_greedy_order(transition_scores, constraints, start_idx=0, harmonic=None):
+    if harmonic is not None:
+        # Constraints may leave no harmonic successor, so clashes are
+        # penalized below every harmonic transition rather than forbidden.
+        tracks = np.arange(transition_scores.shape[0])
+        compatible = harmonic.compatible(tracks[:, None], tracks[None, :])
+        transition_scores = np.where(compatible, transition_scores, transition_scores - _HARMONIC_PENALTY)
+    opening = -np.arange(transition_scores.shape[0], dtype=np.float64)
+    opening[start_idx] = 1.0
+
+    def priority(previous, position):
+        return opening if previous is None else transition_scores[previous]
+
+    with stage("greedy_search", count=transition_scores.shape[0]):
+        return constrained_order(constraints, priority)
+
+
+def run_greedy_algorithm(tracks, constraints=None, strict_harmonic=False):
     if len(tracks) < 2:
         return tracks[:]
+    features = _prepare_track_features(tracks)
+    harmonic = _harmonic_index(features) if strict_harmonic else None
+    if harmonic is not None and constraints is None:
+        order = _harmonic_greedy_order(features, harmonic)
+        return [tracks[i] for i in order]
+    transition_scores = build_transition_matrix(features)
+    if constraints is not None:
+        order = _constrained_greedy_order(transition_scores, constraints, harmonic=harmonic)
+    else:
+        with stage("greedy_search", count=len(tracks)):
+            order = _greedy_index_order(transition_scores)
+    return [tracks[i] for i in order]
 
-    remaining = set(range(len(tracks)))
-    order = [0]
-    remaining.remove(0)
 
-    while remaining:
-        current = order[-1]
-        next_idx = max(
-            remaining,
-            key=lambda idx: transition_score(tracks[current], tracks[idx]),
-        )
-        order.append(next_idx)
-        remaining.remove(next_idx)
+def _harmonic_greedy_order(features, harmonic, start_idx=0):
+    """
+    Greedy order that only scores harmonic transitions.
 
-    return [tracks[i] for i in order]
+    Each key bucket's block of transitions to its compatible buckets is built
+    instead of the full n x n matrix, from metadata postings and key codes
+    derived once for the crate. A track left without an available
+    harmonic successor falls back to scoring the remaining tracks directly.
+    """
+    n = len(features)
+    rows = {}
+    for members, successors in harmonic.successor_groups():
+        block = build_transition_matrix(features, rows=members, cols=successors)
+        for position, track in enumerate(members.tolist()):
+            rows[track] = (successors, block[position])
+
+    available = np.ones(n, dtype=bool)
+    order = [start_idx]
+    available[start_idx] = False
+    with stage("greedy_search", count=n):
+        for _ in range(n - 1):
+            current = order[-1]
+            successors, scores = rows[current]
+            open_successors = available[successors]
+            if open_successors.any():
+                candidates = successors[open_successors]
+                scores = scores[open_successors]
+            else:
+                candidates = np.flatnonzero(available)
+                scores = pair_transition_scores(features, np.full(len(candidates), current), candidates)
+            next_idx = int(candidates[np.argmax(scores)])
+            order.append(next_idx)
+            available[next_idx] = False
+    return order
 
 
 def _as_float(value, default=None):
@@ -217,8 +229,10 @@ def _parse_key(value):
 
 
 def key_compatibility(key_a, key_b):
-    a = _parse_key(key_a)
-    b = _parse_key(key_b)
+    return _parsed_key_compatibility(_parse_key(key_a), _parse_key(key_b))
+
+
+def _parsed_key_compatibility(a, b):
     if not a or not b:
         return 0.5
 
@@ -306,70 +320,41 @@ def _energy(track):
     return _clamp(sum(values) / len(values))
 
 
-def _same_text(track_a, track_b, field):
-    a = str(track_a.get(field) or "").strip().lower()
-    b = str(track_b.get(field) or "").strip().lower()
-    return bool(a and b and a == b)
-
-
-def transition_score(track_a, track_b):
-    metadata = metadata_similarity(track_a, track_b)
-    embedding = cosine_similarity(track_a.get("embedding"), track_b.get("embedding"))
-    embedding = (embedding + 1.0) / 2.0 if embedding else 0.0
-    energy = 1.0 - abs(_energy(track_a) - _energy(track_b))
-    bpm = bpm_compatibility(track_a.get("bpm"), track_b.get("bpm"))
-    key = key_compatibility(track_a.get("key"), track_b.get("key"))
-
-    score = (
-        metadata * 0.36
-        + embedding * 0.24
-        + energy * 0.20
-        + bpm * 0.08
-        + key * 0.05
-    )
-    if _same_text(track_a, track_b, "artist"):
-        score -= 0.20
-    if _same_text(track_a, track_b, "album"):
-        score -= 0.12
-    return score
+TRANSITION_WEIGHTS = {
+    "metadata": 0.36,
+    "embedding": 0.24,
+    "energy": 0.20,
+    "bpm": 0.08,
+    "key": 0.05,
+    "same_artist": -0.20,
+    "same_album": -0.12,
+}
 
 
-def position_score(track, index, total):
-    if total <= 1:
-        return 1.0
+def resolve_transition_weights(overrides=None):
+    """Merge caller supplied weights over the defaults, rejecting unknown components."""
+    weights = dict(TRANSITION_WEIGHTS)
+    if not overrides:
+        return weights
+    unknown = sorted(set(overrides) - set(weights))
+    if unknown:
+        raise ValueError(f"Unknown transition weight(s): {', '.join(unknown)}")
+    for name, value in overrides.items():
+        weight = _as_float(value)
+        if weight is None or not math.isfinite(weight):
+            raise ValueError(f"Transition weight {name} must be a finite number")
+        weights[name] = weight
+    return weights
 
-    progress = index / (total - 1)
-    if progress < 0.25:
-        target = 0.35 + progress * 1.2
-    elif progress < 0.75:
-        target = 0.65 + (progress - 0.25) * 0.4
-    else:
-        target = 0.85 - (progress - 0.75) * 1.2
 
-    vibe = _energy(track)
-    return _clamp(1.0 - abs(vibe - target))
+def transition_score(track_a, track_b):
+    """Transition score of track_b after track_a, as build_transition_matrix scores it."""
+    features = _build_track_features([track_a, track_b])
+    return float(pair_transition_scores(features, [0], [1])[0])
 
 
 def total_playlist_score(tracks):
-    if not tracks:
-        return 0.0
-    transition_total = sum(
-        transition_score(tracks[i], tracks[i + 1])
-        for i in range(len(tracks) - 1)
-    )
-    position_total = sum(
-        position_score(track, index, len(tracks)) * 0.18
-        for index, track in enumerate(tracks)
-    )
-    repeat_penalty = 0.0
-    for i, track in enumerate(tracks):
-        for j in range(i + 1, min(len(tracks), i + 4)):
-            distance_factor = (4 - (j - i)) / 3
-            if _same_text(track, tracks[j], "artist"):
-                repeat_penalty += 0.35 * distance_factor
-            if _same_text(track, tracks[j], "album"):
-                repeat_penalty += 0.20 * distance_factor
-    return transition_total + position_total - repeat_penalty
+    return score_order(tracks, range(len(tracks)))
 
 
 def _cluster_tracks(tracks):
@@ -471,192 +456,453 @@ def _local_search(tracks, passes=3, max_distance=3):
     return ordered
 
 
-def _metadata_similarity_from_weights(a, b):
-    if not a or not b:
-        return 0.0
-    keys = set(a) | set(b)
-    intersection = sum(min(a[key], b[key]) for key in keys)
-    union = sum(max(a[key], b[key]) for key in keys)
-    return 0.0 if union == 0 else intersection / union
+_shared_features = contextvars.ContextVar("shared_features", default=None)
 
 
-def _dot_similarity(a, b):
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    return sum(x * y for x, y in zip(a, b))
+@contextmanager
+def sharing_features():
+    """
+    Reuses track features within the block.
+
+    Inside it, _prepare_track_features returns the features it already built
+    for the same tracks list, so the response can be scored from what the
+    optimizer prepared instead of re-parsing every embedding.
+    """
+    token = _shared_features.set({})
+    try:
+        yield
+    finally:
+        _shared_features.reset(token)
 
 
 def _prepare_track_features(tracks):
-    return [
-        {
-            "metadata": _weighted_metadata_tokens(track),
-            "embedding": normalize_embedding(track.get("embedding")),
-            "energy": _energy(track),
-            "bpm": track.get("bpm"),
-            "key": track.get("key"),
-            "artist": str(track.get("artist") or "").strip().lower(),
-            "album": str(track.get("album") or "").strip().lower(),
-        }
-        for track in tracks
-    ]
+    shared = _shared_features.get()
+    if shared is not None and id(tracks) in shared:
+        return shared[id(tracks)][1]
+    features = _build_track_features(tracks)
+    if shared is not None:
+        # Holding tracks keeps its id from being reused while the block runs.
+        shared[id(tracks)] = (tracks, features)
+    return features
+
+
+def _build_track_features(tracks):
+    with stage("feature_prep", count=len(tracks)):
+        rows = [
+            {
+                "metadata": _weighted_metadata_tokens(track),
+                "energy": _energy(track),
+                "bpm": _as_float(track.get("bpm"), 0.0) or 0.0,
+                "key": track.get("key"),
+                "artist": str(track.get("artist") or "").strip().lower(),
+                "album": str(track.get("album") or "").strip().lower(),
+            }
+            for track in tracks
+        ]
+        embeddings, mask, mismatched = embedding_matrix([track.get("embedding") for track in tracks])
+    if mismatched:
+        print(
+            f"[features] ignored {len(mismatched)} embeddings whose dimension differs "
+            f"from the crate's {embeddings.shape[1]}",
+            flush=True,
+        )
+    return TrackFeatures(rows, embeddings, mask, mismatched)
 
 
-def _same_feature_text(features, i, j, field):
-    return bool(features[i][field] and features[i][field] == features[j][field])
+def _harmonic_index(features):
+    with stage("harmonic_index", count=len(features)):
+        return HarmonicIndex([_parse_key(feature["key"]) for feature in features])
 
 
-def _position_score_from_energy(energy, index, total):
-    if total <= 1:
-        return 1.0
+def _pick(values, tracks):
+    # rows/cols of None select every track as a view, keeping the square path copy-free.
+    return values if tracks is None else values[tracks]
 
-    progress = index / (total - 1)
-    if progress < 0.25:
-        target = 0.35 + progress * 1.2
-    elif progress < 0.75:
-        target = 0.65 + (progress - 0.25) * 0.4
-    else:
-        target = 0.85 - (progress - 0.75) * 1.2
 
-    return _clamp(1.0 - abs(energy - target))
+def _zero_self_pairs(matrix, rows, cols):
+    if rows is None and cols is None:
+        np.fill_diagonal(matrix, 0)
+    else:
+        n = matrix.shape[0] if rows is None else matrix.shape[1]
+        rows = np.arange(n) if rows is None else rows
+        cols = np.arange(n) if cols is None else cols
+        matrix[rows[:, None] == cols[None, :]] = 0
+    return matrix
+
+
+def _track_positions(n, tracks):
+    if tracks is None:
+        return np.arange(n)
+    positions = np.full(n, -1, dtype=np.intp)
+    positions[tracks] = np.arange(len(tracks))
+    return positions
+
+
+def _derived(features, name, build):
+    derived = features.derived.get(name)
+    if derived is None:
+        derived = features.derived[name] = build(features)
+    return derived
+
+
+def _build_metadata_postings(features):
+    postings = defaultdict(list)
+    totals = np.zeros(len(features), dtype=np.float64)
+    for idx, feature in enumerate(features):
+        for token, weight in feature["metadata"].items():
+            postings[token].append((idx, weight))
+            totals[idx] += weight
+    # Tokens held by a single track never contribute to an intersection.
+    shared = [
+        (np.array([idx for idx, _ in entries], dtype=np.intp), np.array([weight for _, weight in entries]))
+        for entries in postings.values()
+        if len(entries) >= 2
+    ]
+    return totals, shared
 
 
-def _build_score_matrices(features):
+def _metadata_matrix(features, dtype=np.float64, rows=None, cols=None):
     n = len(features)
-    metadata_scores = [[0.0] * n for _ in range(n)]
-    transition_scores = [[0.0] * n for _ in range(n)]
+    totals, postings = _derived(features, "metadata_postings", _build_metadata_postings)
+    totals = totals.astype(dtype, copy=False)
+
+    row_positions = _track_positions(n, rows)
+    col_positions = _track_positions(n, cols)
+    intersection = np.zeros((n if rows is None else len(rows), n if cols is None else len(cols)), dtype=dtype)
+    for indices, weights in postings:
+        row_hits = row_positions[indices]
+        col_hits = col_positions[indices]
+        in_rows = row_hits >= 0
+        in_cols = col_hits >= 0
+        if not in_rows.any() or not in_cols.any():
+            continue
+        intersection[row_hits[in_rows, None], col_hits[None, in_cols]] += np.minimum.outer(weights[in_rows], weights[in_cols])
+
+    # Divide in place: the intersection is already zero wherever the union is.
+    union = _pick(totals, rows)[:, None] + _pick(totals, cols)[None, :]
+    union -= intersection
+    np.divide(intersection, union, out=intersection, where=union > 0)
+    return _zero_self_pairs(intersection, rows, cols)
+
+
+def _embedding_matrix(features, dtype=np.float64, rows=None, cols=None):
+    # Invalid rows are zero vectors, so their similarity is 0 and scores 0.
+    vectors = features.embeddings.astype(dtype, copy=False)
+    similarity = _pick(vectors, rows) @ _pick(vectors, cols).T
+    scores = np.where(similarity != 0, (similarity + 1.0) / 2.0, 0.0).astype(dtype, copy=False)
+    return _zero_self_pairs(scores, rows, cols)
+
+
+def _bpm_matrix(features, dtype=np.float64, rows=None, cols=None):
+    bpms = features.bpms.astype(dtype)
+    a = _pick(bpms, rows)[:, None]
+    b = _pick(bpms, cols)[None, :]
+    best_diff = np.minimum(
+        np.minimum(np.abs(a - b * 0.5), np.abs(a - b)),
+        np.abs(a - b * 2.0),
+    )
+    scores = np.clip(1.0 - best_diff / 24.0, 0.0, 1.0)
+    return np.where((a > 0) & (b > 0), scores, dtype(0.5))
+
+
+_KEY_CODES = (
+    [("camelot", number, letter) for number in range(1, 13) for letter in ("A", "B")]
+    + [("basic", pitch, mode) for pitch in range(12) for mode in ("major", "minor")]
+)
+_KEY_CODE_INDEX = {parsed: code for code, parsed in enumerate(_KEY_CODES)}
+_UNKNOWN_KEY_CODE = len(_KEY_CODES)
+_KEY_COMPATIBILITY_TABLE = np.array(
+    [
+        [_parsed_key_compatibility(a, b) for b in _KEY_CODES + [None]]
+        for a in _KEY_CODES + [None]
+    ],
+    dtype=np.float64,
+)
+
+
+def _key_code(value):
+    parsed = _parse_key(value)
+    return _KEY_CODE_INDEX.get(parsed, _UNKNOWN_KEY_CODE)
+
+
+def _key_codes(features):
+    return np.array([_key_code(feature["key"]) for feature in features], dtype=np.intp)
+
+
+def _key_matrix(features, dtype=np.float64, rows=None, cols=None):
+    codes = _derived(features, "key_codes", _key_codes)
+    return _KEY_COMPATIBILITY_TABLE.astype(dtype)[_pick(codes, rows)[:, None], _pick(codes, cols)[None, :]]
+
+
+def _energy_matrix(features, dtype=np.float64, rows=None, cols=None):
+    energies = features.energies.astype(dtype)
+    return 1.0 - np.abs(_pick(energies, rows)[:, None] - _pick(energies, cols)[None, :])
+
+
+def _text_codes(field):
+    def build(features):
+        lookup = {}
+        return np.array(
+            [lookup.setdefault(feature[field], len(lookup)) if feature[field] else -1 for feature in features],
+            dtype=np.intp,
+        )
+
+    return build
+
+
+def _same_text_matrix(features, field, dtype=None, rows=None, cols=None):
+    codes = _derived(features, f"{field}_codes", _text_codes(field))
+    a = _pick(codes, rows)[:, None]
+    same = (a == _pick(codes, cols)[None, :]) & (a >= 0)
+    return _zero_self_pairs(same, rows, cols)
+
+
+_COMPONENT_BUILDERS = {
+    "metadata": _metadata_matrix,
+    "embedding": _embedding_matrix,
+    "energy": _energy_matrix,
+    "bpm": _bpm_matrix,
+    "key": _key_matrix,
+    "same_artist": lambda features, dtype, **pairs: _same_text_matrix(features, "artist", **pairs),
+    "same_album": lambda features, dtype, **pairs: _same_text_matrix(features, "album", **pairs),
+}
+
+
+def build_component_matrices(features, dtype=np.float64):
+    """
+    Builds the per-component pairwise matrices behind transition_score.
+
+    Each matrix holds the unweighted component (metadata, embedding, energy,
+    bpm, key) or a same_artist / same_album indicator, so callers can
+    re-weight a crate without recomputing any pairwise work.
+
+    Args:
+        features (TrackFeatures): Output of _prepare_track_features.
+        dtype (numpy.dtype): Float type of the score components.
+
+    Returns:
+        dict[str, numpy.ndarray]: n x n matrix per TRANSITION_WEIGHTS key.
+    """
+    with stage("matrix_build", count=len(features) ** 2):
+        return {
+            name: builder(features, dtype=dtype)
+            for name, builder in _COMPONENT_BUILDERS.items()
+        }
+
 
-    for i in range(n):
-        for j in range(n):
-            if i == j:
+def build_transition_matrix(features, weights=None, dtype=np.float64, rows=None, cols=None):
+    """
+    Builds the weighted transition matrix one component at a time.
+
+    Equivalent to combining build_component_matrices, but only one component
+    is alive at once, which keeps peak memory near two n x n matrices for
+    large crates. rows and cols, when given, restrict it to the block of
+    transitions from those tracks to those tracks.
+    """
+    weights = resolve_transition_weights(weights)
+    n = len(features)
+    shape = (n if rows is None else len(rows), n if cols is None else len(cols))
+    with stage("matrix_build", count=shape[0] * shape[1]):
+        transition_scores = np.zeros(shape, dtype=dtype)
+        for name, weight in weights.items():
+            if weight:
+                transition_scores += _COMPONENT_BUILDERS[name](features, dtype=dtype, rows=rows, cols=cols) * dtype(weight)
+        _zero_self_pairs(transition_scores, rows, cols)
+    return transition_scores
+
+
+def combine_transition_components(components, weights=None):
+    """Weights the component matrices into a single transition score matrix."""
+    weights = resolve_transition_weights(weights)
+    with stage("matrix_combine", count=components["metadata"].size):
+        transition_scores = None
+        for name, weight in weights.items():
+            if not weight:
                 continue
+            term = components[name] * weight
+            transition_scores = term if transition_scores is None else transition_scores + term
+        if transition_scores is None:
+            transition_scores = np.zeros(components["metadata"].shape, dtype=np.float64)
+        transition_scores = transition_scores.astype(np.float64, copy=True)
+        np.fill_diagonal(transition_scores, 0.0)
+    return transition_scores
+
+
+def _pair_metadata_similarity(a, b):
+    intersection = sum(min(weight, b[token]) for token, weight in a.items() if token in b)
+    union = sum(a.values()) + sum(b.values()) - intersection
+    return intersection / union if union > 0 else 0.0
 
-            metadata = _metadata_similarity_from_weights(
-                features[i]["metadata"],
-                features[j]["metadata"],
-            )
-            embedding = _dot_similarity(features[i]["embedding"], features[j]["embedding"])
-            embedding = (embedding + 1.0) / 2.0 if embedding else 0.0
-            energy = 1.0 - abs(features[i]["energy"] - features[j]["energy"])
-            bpm = bpm_compatibility(features[i]["bpm"], features[j]["bpm"])
-            key = key_compatibility(features[i]["key"], features[j]["key"])
-
-            score = (
-                metadata * 0.36
-                + embedding * 0.24
-                + energy * 0.20
-                + bpm * 0.08
-                + key * 0.05
-            )
-            if _same_feature_text(features, i, j, "artist"):
-                score -= 0.20
-            if _same_feature_text(features, i, j, "album"):
-                score -= 0.12
 
-            metadata_scores[i][j] = metadata
-            transition_scores[i][j] = score
+def pair_transition_scores(features, a, b, weights=None):
+    """
+    Transition scores for the index pairs (a[k], b[k]) only.
+
+    Matches the corresponding build_transition_matrix entries without
+    building the n x n matrix, so scoring one order costs O(n) pairs.
+    """
+    weights = resolve_transition_weights(weights)
+    a = np.asarray(a, dtype=np.intp)
+    b = np.asarray(b, dtype=np.intp)
+    scores = np.zeros(len(a))
+    if not len(a):
+        return scores
+
+    if weights["metadata"]:
+        metadata = [_pair_metadata_similarity(features[i]["metadata"], features[j]["metadata"]) for i, j in zip(a, b)]
+        scores += np.array(metadata) * weights["metadata"]
+    if weights["embedding"]:
+        vectors = features.embeddings.astype(np.float64, copy=False)
+        similarity = np.einsum("ij,ij->i", vectors[a], vectors[b])
+        scores += np.where(similarity != 0, (similarity + 1.0) / 2.0, 0.0) * weights["embedding"]
+    if weights["energy"]:
+        scores += (1.0 - np.abs(features.energies[a] - features.energies[b])) * weights["energy"]
+    if weights["bpm"]:
+        bpm_a, bpm_b = features.bpms[a], features.bpms[b]
+        best_diff = np.minimum(
+            np.minimum(np.abs(bpm_a - bpm_b * 0.5), np.abs(bpm_a - bpm_b)),
+            np.abs(bpm_a - bpm_b * 2.0),
+        )
+        bpm = np.where((bpm_a > 0) & (bpm_b > 0), np.clip(1.0 - best_diff / 24.0, 0.0, 1.0), 0.5)
+        scores += bpm * weights["bpm"]
+    if weights["key"]:
+        codes = _derived(features, "key_codes", _key_codes)
+        scores += _KEY_COMPATIBILITY_TABLE[codes[a], codes[b]] * weights["key"]
+    for field in ("artist", "album"):
+        if weights[f"same_{field}"]:
+            codes = _derived(features, f"{field}_codes", _text_codes(field))
+            same = (codes[a] == codes[b]) & (codes[a] >= 0)
+            scores += same * weights[f"same_{field}"]
+    scores[a == b] = 0.0
+    return scores
+
 
-    return metadata_scores, transition_scores
+def _build_score_matrices(features):
+    components = build_component_matrices(features)
+    transition_scores = combine_transition_components(components)
+    return components["metadata"], transition_scores
 
 
 def _score_index_order(order, features, transition_scores):
-    if not order:
+    if not len(order):
         return 0.0
 
-    transition_total = sum(
-        transition_scores[order[i]][order[i + 1]]
-        for i in range(len(order) - 1)
-    )
-    position_total = sum(
-        _position_score_from_energy(features[track_idx]["energy"], index, len(order)) * 0.18
-        for index, track_idx in enumerate(order)
-    )
-    repeat_penalty = 0.0
-    for i, track_idx in enumerate(order):
-        for j in range(i + 1, min(len(order), i + 4)):
-            other_idx = order[j]
-            distance_factor = (4 - (j - i)) / 3
-            if _same_feature_text(features, track_idx, other_idx, "artist"):
-                repeat_penalty += 0.35 * distance_factor
-            if _same_feature_text(features, track_idx, other_idx, "album"):
-                repeat_penalty += 0.20 * distance_factor
-    return transition_total + position_total - repeat_penalty
+    tracks = np.asarray(order, dtype=np.intp)
+    transition_total = float(transition_scores[tracks[:-1], tracks[1:]].sum())
+    return transition_total + _position_and_repeat_score(tracks, features)
 
 
-def _cluster_track_indices(track_indices, metadata_scores):
-    clusters = []
-    for track_idx in track_indices:
-        best_cluster_idx = None
-        best_score = 0.0
-        for cluster_idx, cluster in enumerate(clusters):
-            score = sum(
-                metadata_scores[track_idx][other_idx]
-                for other_idx in cluster
-            ) / len(cluster)
-            if score > best_score:
-                best_cluster_idx = cluster_idx
-                best_score = score
-        if best_cluster_idx is not None and best_score >= 0.22:
-            clusters[best_cluster_idx].append(track_idx)
-        else:
-            clusters.append([track_idx])
-    return clusters
+def score_order(tracks, order):
+    """
+    Playlist score of tracks played in the given index order.
 
+    Only the order's own transitions are scored, from the track features,
+    which are reused when built earlier in a sharing_features block.
+    """
+    if not len(order):
+        return 0.0
+    features = _prepare_track_features(tracks)
+    order = [int(index) for index in order]
+    transitions = pair_transition_scores(features, order[:-1], order[1:])
+    return float(transitions.sum()) + _position_and_repeat_score(order, features)
 
-def _order_index_block(track_indices, features, transition_scores):
-    if len(track_indices) < 2:
-        return track_indices[:]
 
-    best_order = None
-    best_score = None
-    for start_idx in track_indices:
-        remaining = set(track_indices)
-        order = [start_idx]
-        remaining.remove(start_idx)
-        while remaining:
-            current = order[-1]
-            next_idx = max(
-                remaining,
-                key=lambda candidate: transition_scores[current][candidate],
-            )
-            order.append(next_idx)
-            remaining.remove(next_idx)
+# Penalties for the same artist / album recurring 1, 2 or 3 tracks later.
+_REPEAT_PENALTIES = (("artist", 0.35), ("album", 0.20))
+_REPEAT_WINDOW = 3
 
-        score = _score_index_order(order, features, transition_scores)
-        if best_score is None or score > best_score:
-            best_order = order
-            best_score = score
-    return best_order
 
+def _position_and_repeat_score(order, features):
+    order = np.asarray(order, dtype=np.intp)
+    position_total = float(_position_scores(features.energies[order]).sum()) * 0.18
+    repeat_penalty = 0.0
+    for field, penalty in _REPEAT_PENALTIES:
+        codes = _derived(features, f"{field}_codes", _text_codes(field))[order]
+        for distance in range(1, _REPEAT_WINDOW + 1):
+            same = (codes[:-distance] == codes[distance:]) & (codes[distance:] >= 0)
+            repeat_penalty += penalty * (_REPEAT_WINDOW + 1 - distance) / _REPEAT_WINDOW * int(same.sum())
+    return position_total - repeat_penalty
 
-def _index_block_similarity(block_a, block_b, transition_scores):
-    scores = [
-        transition_scores[track_a][track_b]
-        for track_a in block_a
-        for track_b in block_b
-    ]
-    return sum(scores) / len(scores) if scores else 0.0
 
+def _cluster_track_indices(track_indices, metadata_scores):
+    tracks = np.asarray(track_indices, dtype=np.intp)
+    labels = np.empty(len(tracks), dtype=np.intp)
+    sizes = []
+    for position, track_idx in enumerate(tracks):
+        if sizes:
+            # Mean similarity to each cluster so far, from the earlier tracks' labels.
+            means = np.bincount(
+                labels[:position],
+                weights=metadata_scores[track_idx, tracks[:position]],
+                minlength=len(sizes),
+            ) / sizes
+            best = int(np.argmax(means))
+            if means[best] >= 0.22:
+                labels[position] = best
+                sizes[best] += 1
+                continue
+        labels[position] = len(sizes)
+        sizes.append(1)
+    return [tracks[labels == cluster].tolist() for cluster in range(len(sizes))]
+
+
+def _order_index_block(track_indices, features, transition_scores, start_idx=None, harmonic=None):
+    """
+    Greedy order of one block, run from every candidate start at once.
+
+    Each start follows its best remaining transition (a harmonic one when
+    harmonic is given and one remains), and the best scoring order wins.
+    """
+    if len(track_indices) < 2:
+        return track_indices[:]
 
-def _order_index_blocks(blocks, features, transition_scores):
+    tracks = np.asarray(track_indices, dtype=np.intp)
+    k = len(tracks)
+    scores = transition_scores[np.ix_(tracks, tracks)]
+    compatible = harmonic.compatible(tracks[:, None], tracks[None, :]) if harmonic is not None else None
+    starts = np.flatnonzero(tracks == start_idx) if start_idx in track_indices else np.arange(k)
+    rows = np.arange(len(starts))
+    orders = np.empty((len(starts), k), dtype=np.intp)
+    orders[:, 0] = starts
+    available = np.ones((len(starts), k), dtype=bool)
+    available[rows, starts] = False
+    for step in range(1, k):
+        current = orders[:, step - 1]
+        candidates = available
+        if compatible is not None:
+            harmonic_open = available & compatible[current]
+            candidates = np.where(harmonic_open.any(axis=1)[:, None], harmonic_open, available)
+        following = np.argmax(np.where(candidates, scores[current], -np.inf), axis=1)
+        orders[:, step] = following
+        available[rows, following] = False
+
+    orders = tracks[orders]
+    totals = [_score_index_order(order, features, transition_scores) for order in orders]
+    return orders[int(np.argmax(totals))].tolist()
+
+
+def _order_index_blocks(blocks, features, transition_scores, start_idx=None):
     if len(blocks) < 2:
         return blocks[:]
 
+    # Mean transition score from each block to each other block.
+    similarity = np.array(
+        [[transition_scores[np.ix_(block_a, block_b)].mean() for block_b in blocks] for block_a in blocks]
+    )
+    starts = [
+        block_idx
+        for block_idx, block in enumerate(blocks)
+        if start_idx is not None and block and block[0] == start_idx
+    ] or range(len(blocks))
     best_order = None
     best_score = None
-    for start_idx in range(len(blocks)):
+    for start_idx in starts:
         remaining = set(range(len(blocks)))
         order = [start_idx]
         remaining.remove(start_idx)
         while remaining:
             current = order[-1]
-            next_idx = max(
-                remaining,
-                key=lambda candidate: _index_block_similarity(
-                    blocks[current],
-                    blocks[candidate],
-                    transition_scores,
-                ),
-            )
+            next_idx = max(remaining, key=lambda candidate: similarity[current, candidate])
             order.append(next_idx)
             remaining.remove(next_idx)
 
@@ -669,76 +915,941 @@ def _order_index_blocks(blocks, features, transition_scores):
     return best_order
 
 
-def _local_search_indices(order, features, transition_scores, passes=3, max_distance=3):
+def _local_search_indices(
+    order,
+    features,
+    transition_scores,
+    passes=3,
+    max_distance=3,
+    fixed_prefix=0,
+    constraints=None,
+    harmonic=None,
+):
+    """
+    Hill-climbs order by swapping tracks at most max_distance apart.
+
+    A swap only changes the transitions, position scores and repeat pairs
+    within _REPEAT_WINDOW of the two slots, so each candidate is scored from
+    that window of at most 2 * (max_distance + _REPEAT_WINDOW) slots instead
+    of the whole order.
+    """
     best_order = order[:]
-    best_score = _score_index_order(best_order, features, transition_scores)
-    for _ in range(passes):
+    n = len(best_order)
+    if n < 2:
+        return best_order
+    positions = _position_score_matrix(features.energies, n) * 0.18
+    codes = [
+        (_derived(features, f"{field}_codes", _text_codes(field)).tolist(), penalty)
+        for field, penalty in _REPEAT_PENALTIES
+    ]
+
+    def window_score(lo, hi):
+        score = 0.0
+        for p in range(lo, hi + 1):
+            track = best_order[p]
+            score += positions[p, track]
+            if p < hi:
+                score += transition_scores[track, best_order[p + 1]]
+            for q in range(p + 1, min(hi, p + _REPEAT_WINDOW) + 1):
+                other = best_order[q]
+                for field_codes, penalty in codes:
+                    if field_codes[track] >= 0 and field_codes[track] == field_codes[other]:
+                        score -= penalty * (_REPEAT_WINDOW + 1 - (q - p)) / _REPEAT_WINDOW
+        return score
+
+    with stage("local_search", count=0) as span:
+        for _ in range(passes):
+            improved = False
+            for i in range(fixed_prefix, n):
+                for j in range(i + 1, min(n, i + max_distance + 1)):
+                    if constraints is not None and not constraints.swap_allowed(best_order, i, j):
+                        continue
+                    if harmonic is not None and _swap_adds_clash(best_order, i, j, harmonic):
+                        continue
+                    lo, hi = max(0, i - _REPEAT_WINDOW), min(n - 1, j + _REPEAT_WINDOW)
+                    before = window_score(lo, hi)
+                    best_order[i], best_order[j] = best_order[j], best_order[i]
+                    span.count += 1
+                    # Tolerate rounding so swaps that change nothing don't count as gains.
+                    if window_score(lo, hi) > before + 1e-12:
+                        improved = True
+                    else:
+                        best_order[i], best_order[j] = best_order[j], best_order[i]
+            if not improved:
+                break
+    return best_order
+
+
+def _clashes(order, positions, harmonic):
+    positions = [position for position in positions if 0 <= position < len(order) - 1]
+    if not positions:
+        return 0
+    a = [order[position] for position in positions]
+    b = [order[position + 1] for position in positions]
+    return int((~harmonic.compatible(a, b)).sum())
+
+
+def _swap_adds_clash(order, i, j, harmonic):
+    """True when swapping positions i and j adds a non-harmonic transition."""
+    positions = {i - 1, i, j - 1, j}
+    before = _clashes(order, positions, harmonic)
+    order[i], order[j] = order[j], order[i]
+    after = _clashes(order, positions, harmonic)
+    order[i], order[j] = order[j], order[i]
+    return after > before
+
+
+def _cohesive_blocks_order(
+    features,
+    metadata_scores,
+    transition_scores,
+    start_idx=None,
+    constraints=None,
+    harmonic=None,
+):
+    if constraints is not None and start_idx is None:
+        start_idx = constraints.pinned.get(0)
+    with stage("clustering") as span:
+        clusters = _cluster_track_indices(list(range(len(features))), metadata_scores)
+        span.count = len(clusters)
+
+    with stage("block_ordering", count=len(clusters)):
+        ordered_clusters = [
+            _order_index_block(cluster, features, transition_scores, start_idx=start_idx, harmonic=harmonic)
+            for cluster in clusters
+        ]
+        ordered_blocks = _order_index_blocks(
+            ordered_clusters,
+            features,
+            transition_scores,
+            start_idx=start_idx,
+        )
+        ordered = [track_idx for block in ordered_blocks for track_idx in block]
+        if constraints is not None:
+            ordered = repair_order(constraints, ordered)
+
+    return _local_search_indices(
+        ordered,
+        features,
+        transition_scores,
+        fixed_prefix=0 if start_idx is None else 1,
+        constraints=constraints,
+        harmonic=harmonic,
+    )
+
+
+def run_cohesive_blocks_optimizer(tracks, constraints=None, strict_harmonic=False):
+    if len(tracks) < 2:
+        return tracks[:]
+
+    features = _prepare_track_features(tracks)
+    metadata_scores, transition_scores = _build_score_matrices(features)
+    searched = _cohesive_blocks_order(
+        features,
+        metadata_scores,
+        transition_scores,
+        constraints=constraints,
+        harmonic=_harmonic_index(features) if strict_harmonic else None,
+    )
+    return [tracks[i] for i in searched]
+
+
+def _greedy_index_order(transition_scores, start_idx=0, harmonic=None):
+    n = transition_scores.shape[0]
+    available = np.ones(n, dtype=bool)
+    order = [start_idx]
+    available[start_idx] = False
+    for _ in range(n - 1):
+        row = transition_scores[order[-1]]
+        if harmonic is not None:
+            successors = harmonic.successors(order[-1])
+            successors = successors[available[successors]]
+            if len(successors):
+                next_idx = int(successors[np.argmax(row[successors])])
+                order.append(next_idx)
+                available[next_idx] = False
+                continue
+        candidates = np.where(available, row, -np.inf)
+        next_idx = int(np.argmax(candidates))
+        order.append(next_idx)
+        available[next_idx] = False
+    return order
+
+
+SESSION_MODES = ("greedy", "cohesive_blocks")
+
+
+def order_from_components(
+    features,
+    components,
+    mode="greedy",
+    weights=None,
+    start_idx=None,
+    constraints=None,
+    strict_harmonic=False,
+):
+    """
+    Orders a crate from precomputed component matrices.
+
+    Only the weighted combination is recomputed, which keeps re-weighting and
+    re-seeding a cached crate cheap: a greedy solve takes milliseconds.
+    cohesive_blocks runs a greedy pass from every track of each metadata
+    cluster, which is cubic in the largest cluster's size, so it still takes
+    seconds on crates of a few thousand tracks.
+
+    Args:
+        features (TrackFeatures): Output of _prepare_track_features.
+        components (dict[str, numpy.ndarray]): Output of build_component_matrices.
+        mode (str): One of SESSION_MODES.
+        weights (dict, optional): Overrides for TRANSITION_WEIGHTS.
+        start_idx (int, optional): Index of track to pin as first in playlist.
+        constraints (SequenceConstraints, optional): Hard sequencing constraints.
+        strict_harmonic (bool): Follow each track with a Camelot-compatible
+            one whenever one remains.
+
+    Returns:
+        tuple[list[int], float]: Track index order and its playlist score.
+    """
+    n = len(features)
+    if start_idx is not None and not 0 <= start_idx < n:
+        raise ValueError(f"start_idx {start_idx} out of range for {n} tracks")
+    if mode not in SESSION_MODES:
+        raise ValueError(f"Unsupported session mode: {mode}")
+    if constraints is not None and start_idx is not None:
+        if constraints.pinned.get(0, start_idx) != start_idx:
+            raise ConstraintError(f"start_idx {start_idx} conflicts with the track pinned first")
+
+    transition_matrix = combine_transition_components(components, weights)
+    harmonic = _harmonic_index(features) if strict_harmonic and n >= 2 else None
+    if n < 2:
+        order = list(range(n))
+    elif mode == "greedy" and constraints is not None:
+        order = _constrained_greedy_order(
+            transition_matrix,
+            constraints,
+            0 if start_idx is None else start_idx,
+            harmonic=harmonic,
+        )
+    elif mode == "greedy":
+        order = _greedy_index_order(transition_matrix, 0 if start_idx is None else start_idx, harmonic=harmonic)
+    else:
+        order = _cohesive_blocks_order(
+            features,
+            components["metadata"],
+            transition_matrix,
+            start_idx=start_idx,
+            constraints=constraints,
+            harmonic=harmonic,
+        )
+    return order, _score_index_order(order, features, transition_matrix)
+
+
+DEFAULT_DURATION_TOLERANCE_SECONDS = 120.0
+_FORBIDDEN_SCORE = -1e6
+
+
+def _insertion_gains(path, candidates, transition_scores, prizes, open_start, open_end):
+    """Gain of inserting each candidate into each slot of path, shape (slots, candidates)."""
+    path = np.asarray(path, dtype=np.intp)
+    m = len(path)
+    gains = np.full((m + 1, len(candidates)), -np.inf)
+    inner = transition_scores[path[:-1]][:, candidates] + transition_scores[candidates][:, path[1:]].T
+    gains[1:m] = inner - transition_scores[path[:-1], path[1:]][:, None]
+    if open_start:
+        gains[0] = transition_scores[candidates, path[0]]
+    if open_end:
+        gains[m] = transition_scores[path[-1], candidates]
+    return gains + prizes[candidates][None, :]
+
+
+def _select_duration_path(
+    transition_scores,
+    durations,
+    prizes,
+    target,
+    tolerance,
+    first=None,
+    last=None,
+    max_rounds=50,
+):
+    n = len(durations)
+    eligible = durations > 0
+    budget = target + tolerance
+    if first is not None:
+        path = [first]
+    else:
+        k = min(8, n - 1)
+        hub = np.partition(transition_scores, n - k, axis=1)[:, n - k:].mean(axis=1) + prizes
+        path = [int(np.argmax(np.where(eligible, hub, -np.inf)))]
+    if last is not None and last != path[0]:
+        path.append(last)
+    used = np.zeros(n, dtype=bool)
+    used[path] = True
+    total = float(durations[path].sum())
+
+    # Prize-collecting insertion: best gain per second until the budget is spent.
+    while True:
+        candidates = np.flatnonzero(eligible & ~used & (durations <= budget - total))
+        if not len(candidates):
+            break
+        gains = _insertion_gains(path, candidates, transition_scores, prizes, first is None, last is None)
+        ratio = gains / durations[candidates][None, :]
+        if total >= target - tolerance:
+            ratio = np.where(gains > 0, ratio, -np.inf)
+        slot, column = np.unravel_index(int(np.argmax(ratio)), ratio.shape)
+        if not np.isfinite(ratio[slot, column]):
+            break
+        track = int(candidates[column])
+        path.insert(int(slot), track)
+        used[track] = True
+        total += durations[track]
+
+    # Orienteering local search: swap a path track for an unused one, or drop it.
+    locked = {0} if first is not None else set()
+    for _ in range(max_rounds):
         improved = False
-        for i in range(len(best_order)):
-            for j in range(i + 1, min(len(best_order), i + max_distance + 1)):
-                candidate = best_order[:]
-                candidate[i], candidate[j] = candidate[j], candidate[i]
-                score = _score_index_order(candidate, features, transition_scores)
-                if score > best_score:
-                    best_order = candidate
-                    best_score = score
+        for position in range(len(path)):
+            if position in locked or (last is not None and position == len(path) - 1):
+                continue
+            track = path[position]
+            previous = path[position - 1] if position > 0 else None
+            following = path[position + 1] if position < len(path) - 1 else None
+            current = prizes[track]
+            if previous is not None:
+                current += transition_scores[previous, track]
+            if following is not None:
+                current += transition_scores[track, following]
+
+            slack = budget - total + durations[track]
+            candidates = np.flatnonzero(eligible & ~used & (durations <= slack))
+            if len(candidates):
+                swapped = prizes[candidates].astype(np.float64)
+                if previous is not None:
+                    swapped += transition_scores[previous, candidates]
+                if following is not None:
+                    swapped += transition_scores[candidates, following]
+                best = int(np.argmax(swapped))
+                if swapped[best] > current + 1e-9:
+                    replacement = int(candidates[best])
+                    used[track] = False
+                    used[replacement] = True
+                    total += durations[replacement] - durations[track]
+                    path[position] = replacement
+                    improved = True
+                    continue
+
+            if len(path) > 2 and total - durations[track] >= target - tolerance:
+                bridged = (
+                    transition_scores[previous, following]
+                    if previous is not None and following is not None
+                    else 0.0
+                )
+                if bridged > current + 1e-9:
+                    del path[position]
+                    used[track] = False
+                    total -= durations[track]
                     improved = True
+                    break
         if not improved:
             break
-    return best_order
+    return path
 
 
-def run_cohesive_blocks_optimizer(tracks):
-    if len(tracks) < 2:
-        return tracks[:]
+def run_target_duration_optimizer(
+    tracks,
+    target_duration_seconds,
+    tolerance_seconds=DEFAULT_DURATION_TOLERANCE_SECONDS,
+    constraints=None,
+):
+    """
+    Picks and orders the subset of a crate that fills a target set length.
 
-    started_at = time.perf_counter()
-    print(
-        f"[cohesive_blocks] start tracks={len(tracks)}",
-        flush=True,
+    A prize-collecting path is grown by inserting the track with the best
+    transition gain per second, then improved with orienteering-style swap and
+    drop moves over the transition matrix, and finally reordered with the
+    regular local search. Tracks without a positive duration_seconds are never
+    selected, and star_rating adds a small per-track prize.
+
+    Args:
+        tracks (list[dict]): Track dicts with duration_seconds.
+        target_duration_seconds (float): Desired set length.
+        tolerance_seconds (float): Allowed distance from the target length.
+        constraints (SequenceConstraints, optional): Only opener/closer pins and
+            forbidden transitions are supported in this mode.
+
+    Returns:
+        list[dict]: Ordered subset of track dicts.
+    """
+    target = _as_float(target_duration_seconds)
+    if target is None or target <= 0:
+        raise ValueError("target_duration_seconds must be a positive number")
+    tolerance = max(0.0, _as_float(tolerance_seconds, 0.0))
+    n = len(tracks)
+    durations = np.array(
+        [max(0.0, _as_float(track.get("duration_seconds"), 0.0) or 0.0) for track in tracks],
+        dtype=np.float64,
     )
+    if not (durations > 0).any():
+        raise ValueError("target_duration mode needs tracks with duration_seconds")
+    if n < 2:
+        return tracks[:]
+
+    first = last = None
+    if constraints is not None:
+        if constraints.successor or set(constraints.pinned) - {0, n - 1}:
+            raise ConstraintError("target_duration mode only supports pinned openers/closers and forbidden transitions")
+        first = constraints.pinned.get(0)
+        last = constraints.pinned.get(n - 1)
 
     features = _prepare_track_features(tracks)
-    embedding_count = sum(1 for feature in features if feature["embedding"])
-    print(
-        f"[cohesive_blocks] prepared features embeddings={embedding_count}/{len(tracks)} "
-        f"elapsed={time.perf_counter() - started_at:.3f}s",
-        flush=True,
+    transition_scores = build_transition_matrix(features, dtype=np.float32)
+    if constraints is not None:
+        transition_scores[~constraints.allowed] = _FORBIDDEN_SCORE
+    prizes = np.array(
+        [0.1 * _clamp((_as_float(track.get("star_rating"), 0.0) or 0.0) / 5.0) for track in tracks],
+        dtype=np.float32,
     )
 
-    metadata_scores, transition_scores = _build_score_matrices(features)
-    print(
-        f"[cohesive_blocks] built score matrices elapsed={time.perf_counter() - started_at:.3f}s",
-        flush=True,
+    with stage("selection", count=n) as span:
+        path = _select_duration_path(transition_scores, durations, prizes, target, tolerance, first, last)
+        span.count = len(path)
+
+    # Polish the chosen subset against the full playlist score.
+    sub_features = features.subset(path)
+    sub_scores = transition_scores[np.ix_(path, path)].astype(np.float64)
+    sub_constraints = None
+    if constraints is not None and len(path) > 1:
+        local = {track: position for position, track in enumerate(path)}
+        sub_constraints = SequenceConstraints(
+            len(path),
+            pinned=[(0, 0)] * (first is not None) + [(len(path) - 1, -1)] * (last is not None),
+            forbidden=[
+                (local[a], local[b])
+                for a in path
+                for b in path
+                if a != b and not constraints.allowed[a, b]
+            ],
+        )
+    ordered = _local_search_indices(
+        list(range(len(path))),
+        sub_features,
+        sub_scores,
+        fixed_prefix=0,
+        constraints=sub_constraints,
     )
+    return [tracks[path[i]] for i in ordered]
 
-    clusters = _cluster_track_indices(list(range(len(tracks))), metadata_scores)
-    print(
-        f"[cohesive_blocks] clustered blocks={len(clusters)} "
-        f"sizes={[len(cluster) for cluster in clusters]} "
-        f"elapsed={time.perf_counter() - started_at:.3f}s",
-        flush=True,
-    )
 
-    ordered_clusters = [
-        _order_index_block(cluster, features, transition_scores)
-        for cluster in clusters
-    ]
-    ordered_blocks = _order_index_blocks(ordered_clusters, features, transition_scores)
-    ordered = [track_idx for block in ordered_blocks for track_idx in block]
-    print(
-        f"[cohesive_blocks] ordered blocks elapsed={time.perf_counter() - started_at:.3f}s",
-        flush=True,
-    )
+def _beam_search(n, step_scores, beam_width, preferred=None, constraints=None, deadline=None):
+    """
+    Vectorized beam search over full track orders.
+
+    step_scores(slot, sequences) returns the score gained by appending each
+    track to each partial sequence (beams x n, or n for the first slot).
+    preferred(slot), when given, limits each beam to a boolean track mask
+    unless that leaves it without candidates. After deadline (a
+    time.perf_counter value) the beam narrows to a single greedy sequence.
+
+    Returns:
+        list[int] | None: The best complete order, or None when constraints
+        left every beam without a feasible candidate.
+    """
+    sequences = np.zeros((1, 0), dtype=np.intp)
+    used = np.zeros((1, n), dtype=bool)
+    scores = np.zeros(1)
+    with stage("beam_search", count=0) as span:
+        for slot in range(n):
+            candidates = ~used
+            if preferred is not None:
+                limited = candidates & preferred(slot)[None, :]
+                starved = ~limited.any(axis=1)
+                limited[starved] = candidates[starved]
+                candidates = limited
+            if constraints is not None:
+                for beam, sequence in enumerate(sequences):
+                    previous = int(sequence[-1]) if slot else None
+                    candidates[beam] &= constraints.candidate_mask(slot, previous, ~used[beam])
+
+            flat = np.where(candidates, scores[:, None] + step_scores(slot, sequences), -np.inf).ravel()
+            finite = int(np.isfinite(flat).sum())
+            if not finite:
+                return None
+            if deadline is not None and time.perf_counter() > deadline:
+                beam_width = 1
+            keep = min(beam_width, finite)
+            best = np.argpartition(-flat, keep - 1)[:keep]
+            best = best[np.argsort(-flat[best], kind="stable")]
+            parents, chosen = np.divmod(best, n)
+            sequences = np.column_stack([sequences[parents], chosen])
+            used = used[parents]
+            used[np.arange(keep), chosen] = True
+            scores = flat[best]
+            span.count += keep
+    return sequences[0].tolist()
+
+
+DEFAULT_ENERGY_CURVE_WEIGHT = 1.0
+DEFAULT_CURVE_BEAM_WIDTH = 8
+
+
+def _parse_energy_curve(points):
+    if not points:
+        raise ValueError("energy_curve needs at least one [position, energy] point")
+    parsed = []
+    for point in points:
+        try:
+            position, energy = (float(value) for value in point)
+        except (TypeError, ValueError):
+            raise ValueError(f"energy_curve point {point!r} must be a [position, energy] pair")
+        if not (0.0 <= position <= 1.0 and 0.0 <= energy <= 1.0):
+            raise ValueError(f"energy_curve point {point!r} must lie within [0, 1]")
+        parsed.append((position, energy))
+    parsed.sort()
+    return np.array([p for p, _ in parsed]), np.array([e for _, e in parsed])
+
+
+def _energy_bins(energies, bpms, bin_count):
+    """Bins tracks into equal-size energy bands, breaking energy ties by BPM."""
+    rank = np.empty(len(energies), dtype=np.intp)
+    rank[np.lexsort((bpms, energies))] = np.arange(len(energies))
+    return rank * bin_count // len(energies), rank
+
+
+def run_energy_curve_optimizer(
+    tracks,
+    energy_curve,
+    curve_weight=DEFAULT_ENERGY_CURVE_WEIGHT,
+    beam_width=DEFAULT_CURVE_BEAM_WIDTH,
+    constraints=None,
+):
+    """
+    Orders tracks so their energy follows a target curve.
+
+    energy_curve is a list of [position, energy] points with position 0 at the
+    opener and 1 at the closer; targets between points are interpolated.
+    Tracks are ranked by _energy (ties broken by BPM) and split into bands.
+    Matching slots to bands in sorted order is the optimal assignment for the
+    curve alone, so each slot only considers tracks from its band and the
+    neighbouring ones. A vectorized beam search then fills the slots,
+    maximising transition score plus curve_weight times the curve fit.
+
+    Args:
+        tracks (list[dict]): Track dicts.
+        energy_curve (list[list[float]]): Target [position, energy] points.
+        curve_weight (float): Weight of the curve fit against transitions.
+        beam_width (int): Partial sequences kept per slot.
+        constraints (SequenceConstraints, optional): Hard sequencing constraints.
+
+    Returns:
+        list[dict]: Ordered list of track dicts.
+    """
+    positions, levels = _parse_energy_curve(energy_curve)
+    n = len(tracks)
+    if n < 2:
+        return tracks[:]
+    beam_width = max(1, int(beam_width))
+
+    features = _prepare_track_features(tracks)
+    transition_scores = build_transition_matrix(features)
+    energies = features.energies
+    bpms = features.bpms
+
+    targets = np.interp(np.arange(n) / (n - 1), positions, levels)
+    fit = curve_weight * (1.0 - np.abs(targets[:, None] - energies[None, :]))
+
+    bin_count = max(1, int(round(math.sqrt(n))))
+    track_bins, track_rank = _energy_bins(energies, bpms, bin_count)
+    slot_rank = np.empty(n, dtype=np.intp)
+    slot_rank[np.argsort(targets, kind="stable")] = np.arange(n)
+    slot_bins = slot_rank * bin_count // n
+
+    def near_band(slot):
+        return np.abs(track_bins - slot_bins[slot]) <= 1
+
+    def step_scores(slot, sequences):
+        if not slot:
+            return fit[slot]
+        return transition_scores[sequences[:, -1]] + fit[slot]
+
+    order = _beam_search(n, step_scores, beam_width, preferred=near_band, constraints=constraints)
+    if order is None:
+        # Every beam hit a constraint dead end; fall back to the curve order.
+        order = repair_order(constraints, np.argsort(track_rank)[slot_rank].tolist())
+    return [tracks[i] for i in order]
+
+
+DEFAULT_BEAM_WIDTH = 16
+# Each slot holds beam_width x n candidate scores.
+MAX_BEAM_WIDTH = 1024
 
-    searched = _local_search_indices(ordered, features, transition_scores)
-    print(
-        f"[cohesive_blocks] complete elapsed={time.perf_counter() - started_at:.3f}s",
-        flush=True,
+
+def _position_targets(total):
+    """Target energy of each of total (at least two) slots: a ramp up, a plateau and a cool-down."""
+    progress = np.arange(total) / (total - 1)
+    return np.where(
+        progress < 0.25,
+        0.35 + progress * 1.2,
+        np.where(progress < 0.75, 0.65 + (progress - 0.25) * 0.4, 0.85 - (progress - 0.75) * 1.2),
     )
-    return [tracks[i] for i in searched]
 
 
+def _position_scores(energies):
+    """Position score of each track when energies are played in order."""
+    if len(energies) <= 1:
+        return np.ones(len(energies))
+    return np.clip(1.0 - np.abs(energies - _position_targets(len(energies))), 0.0, 1.0)
+
+
+def _position_score_matrix(energies, total):
+    """Position score for every (slot, track) pair, shape (total, tracks)."""
+    if total <= 1:
+        return np.ones((total, len(energies)))
+    return np.clip(1.0 - np.abs(energies[None, :] - _position_targets(total)[:, None]), 0.0, 1.0)
+
+
+def run_beam_search_optimizer(
+    tracks,
+    beam_width=DEFAULT_BEAM_WIDTH,
+    time_budget_ms=None,
+    constraints=None,
+):
+    """
+    Orders tracks with beam search over the full playlist score.
+
+    The beam_width best partial sequences are extended one slot at a time.
+    Each extension adds the transition score, the position term and the
+    artist/album repeat penalties over the last three tracks, which is
+    exactly _score_index_order computed incrementally. A width of 1 is plain
+    greedy, and wider beams trade latency for quality. Once time_budget_ms
+    elapses the beam narrows to one sequence and finishes greedily. If every
+    beam dead-ends on a constraint, backtracking constrained greedy takes over.
+
+    Args:
+        tracks (list[dict]): Track dicts.
+        beam_width (int): Partial sequences kept per slot.
+        time_budget_ms (float, optional): Soft wall-clock budget.
+        constraints (SequenceConstraints, optional): Hard sequencing constraints.
+
+    Returns:
+        list[dict]: Ordered list of track dicts.
+    """
+    n = len(tracks)
+    if n < 2:
+        return tracks[:]
+    beam_width = max(1, int(beam_width))
+    deadline = time.perf_counter() + time_budget_ms / 1000.0 if time_budget_ms else None
+
+    features = _prepare_track_features(tracks)
+    transition_scores = build_transition_matrix(features)
+    energies = features.energies
+    position_scores = _position_score_matrix(energies, n) * 0.18
+    same_artist = _same_text_matrix(features, "artist")
+    same_album = _same_text_matrix(features, "album")
+
+    # Charge each track its best possible incoming transition and position
+    # score. Every complete order pays the same total, so final ranking is
+    # unchanged, but beams no longer look better by spending the crate's
+    # easiest transitions first.
+    masked = np.where(np.eye(n, dtype=bool), -np.inf, transition_scores)
+    optimistic = masked.max(axis=0) + position_scores.max(axis=0)
+
+    def step_scores(slot, sequences):
+        if not slot:
+            return position_scores[slot] - optimistic
+        scores = transition_scores[sequences[:, -1]] + position_scores[slot] - optimistic
+        for distance in range(1, min(slot, 3) + 1):
+            earlier = sequences[:, -distance]
+            distance_factor = (4 - distance) / 3
+            scores = scores - same_artist[earlier] * (0.35 * distance_factor)
+            scores = scores - same_album[earlier] * (0.20 * distance_factor)
+        return scores
+
+    order = _beam_search(n, step_scores, beam_width, constraints=constraints, deadline=deadline)
+    if order is None:
+        # Every beam hit a constraint dead end; the constraints were already
+        # checked satisfiable, so finish with backtracking constrained greedy.
+        def priority(previous, position):
+            if previous is None:
+                return position_scores[position]
+            return transition_scores[previous] + position_scores[position]
+
+        with stage("greedy_search", count=n):
+            order = constrained_order(constraints, priority)
+    return [tracks[i] for i in order]
+
+
+DEFAULT_ANNEALING_ITERATIONS_PER_TRACK = 200
+MAX_ANNEALING_ITERATIONS = 2_000_000
+ANNEALING_COOLING = ("geometric", "linear")
+_ANNEALING_MOVES = ("swap", "reverse", "move")
+_ANNEALING_MAX_SEGMENT = 3
+_ANNEALING_TRAJECTORY_POINTS = 50
+_ANNEALING_BATCH = 4096
+
+
+class _AnnealingPath:
+    """
+    A track order with incremental score deltas for swap, reverse and segment moves.
+
+    The score is the sum of transition scores plus an opening and closing
+    cost per track, used to keep constrained tracks off the ends. Swaps and
+    segment moves change at most six edges, so their deltas are O(1). The
+    transition matrix is not symmetric (bpm halving/doubling), so reversing
+    i..j also flips every edge inside it: its delta sums the forward and
+    backward edges over the segment, O(j - i). Accepted swaps and reversals
+    update those edges only where they changed; segment moves, which shift
+    everything between the segment and its new place, rebuild them.
+    """
+
+    def __init__(self, order, transition_scores, start_cost, end_cost):
+        self.order = np.array(order, dtype=np.intp)
+        self.scores = transition_scores
+        self.start_cost = start_cost
+        self.end_cost = end_cost
+        self._edges()
+        self.score = self._total()
+
+    def _total(self):
+        order = self.order
+        edges = self.scores[order[:-1], order[1:]].sum()
+        return float(edges + self.start_cost[order[0]] + self.end_cost[order[-1]])
+
+    def _edge(self, a, b):
+        if a < 0:
+            return self.start_cost[b]
+        if b < 0:
+            return self.end_cost[a]
+        return self.scores[a, b]
+
+    def _at(self, position):
+        return self.order[position] if 0 <= position < len(self.order) else -1
+
+    def _edges(self):
+        # forward[p] scores order[p] -> order[p + 1]; backward[p] the same pair the other way round.
+        order = self.order
+        self.forward = self.scores[order[:-1], order[1:]]
+        self.backward = self.scores[order[1:], order[:-1]]
+
+    def _refresh_edges(self, positions):
+        order, last = self.order, len(self.order) - 2
+        for p in positions:
+            if 0 <= p <= last:
+                self.forward[p] = self.scores[order[p], order[p + 1]]
+                self.backward[p] = self.scores[order[p + 1], order[p]]
+
+    def delta(self, move, i, j, k=None):
+        at, edge = self._at, self._edge
+        if move == "swap":
+            before, a, b, after = at(i - 1), at(i), at(j), at(j + 1)
+            if j == i + 1:
+                return edge(before, b) + edge(b, a) + edge(a, after) - edge(before, a) - edge(a, b) - edge(b, after)
+            a_next, b_prev = at(i + 1), at(j - 1)
+            return (
+                edge(before, b) + edge(b, a_next) + edge(b_prev, a) + edge(a, after)
+                - edge(before, a) - edge(a, a_next) - edge(b_prev, b) - edge(b, after)
+            )
+        if move == "reverse":
+            before, first, last, after = at(i - 1), at(i), at(j), at(j + 1)
+            inner = self.backward[i:j].sum() - self.forward[i:j].sum()
+            return inner + edge(before, last) + edge(first, after) - edge(before, first) - edge(last, after)
+        # move: segment i..j goes between positions k and k + 1.
+        before, first, last, after = at(i - 1), at(i), at(j), at(j + 1)
+        left, right = at(k), at(k + 1)
+        return (
+            edge(before, after) + edge(left, first) + edge(last, right)
+            - edge(before, first) - edge(last, after) - edge(left, right)
+        )
+
+    def apply(self, move, i, j, k=None):
+        order = self.order
+        if move == "swap":
+            order[i], order[j] = order[j], order[i]
+            self._refresh_edges((i - 1, i, j - 1, j))
+        elif move == "reverse":
+            order[i:j + 1] = order[i:j + 1][::-1].copy()
+            self.forward[i:j], self.backward[i:j] = self.backward[i:j][::-1].copy(), self.forward[i:j][::-1].copy()
+            self._refresh_edges((i - 1, j))
+        else:
+            segment = order[i:j + 1].copy()
+            rest = np.concatenate([order[:i], order[j + 1:]])
+            insert_at = k + 1 if k < i else k - len(segment) + 1
+            self.order = np.concatenate([rest[:insert_at], segment, rest[insert_at:]])
+            self._edges()
+
+
+def _temperature(initial, final, progress, cooling):
+    if cooling == "linear":
+        return initial + (final - initial) * progress
+    return initial * (final / initial) ** progress
+
+
+def _propose(rng_values, n, locked_prefix):
+    """Draws one move from a batch row of uniforms; None when it would disturb a pinned position."""
+    kind, u1, u2, u3 = rng_values
+    move = _ANNEALING_MOVES[min(int(kind * 3), 2)]
+    if move == "move":
+        length = 1 + min(int(u3 * _ANNEALING_MAX_SEGMENT), n - 2)
+        i = int(u1 * (n - length + 1))
+        j = i + length - 1
+        # Insertion points -1..n-1 excluding the segment's own boundaries.
+        k = int(u2 * (n - length))
+        k = k - 1 if k < i else k + length
+        lo, hi = (k + 1, j) if k < i else (i, k)
+        if locked_prefix is not None and locked_prefix[hi + 1] - locked_prefix[lo]:
+            return None
+        return move, i, j, k
+    i = int(u1 * n)
+    j = int(u2 * (n - 1))
+    if j >= i:
+        j += 1  # j is drawn from the n - 1 positions other than i.
+    i, j = min(i, j), max(i, j)
+    if locked_prefix is not None:
+        if move == "swap":
+            disturbed = locked_prefix[i + 1] - locked_prefix[i] + locked_prefix[j + 1] - locked_prefix[j]
+        else:
+            disturbed = locked_prefix[j + 1] - locked_prefix[i]
+        if disturbed:
+            return None
+    return move, i, j, None
+
+
+def run_simulated_annealing_optimizer(
+    tracks,
+    iterations=None,
+    time_budget_ms=None,
+    initial_temperature=None,
+    final_temperature=None,
+    cooling="geometric",
+    seed=None,
+    constraints=None,
+    stats=None,
+):
+    """
+    Orders tracks by simulated annealing over the transition score matrix.
+
+    Starts from the greedy order and proposes swaps, segment reversals and
+    moves of 1-3 track segments, each scored incrementally against the
+    current order. Worse moves are accepted with probability exp(delta / T) while T
+    cools from initial_temperature to final_temperature over the run (by
+    iterations or time_budget_ms, whichever runs out first). The best order
+    seen is returned. Constraints are enforced by never disturbing pinned
+    positions and by rejecting moves that create a disallowed transition.
+
+    Args:
+        tracks (list[dict]): Track dicts.
+        iterations (int, optional): Proposed moves; defaults to 200 per track.
+        time_budget_ms (float, optional): Wall-clock budget.
+        initial_temperature (float, optional): Start temperature; by default
+            derived from sampled worsening moves around the greedy start.
+        final_temperature (float, optional): End temperature; defaults to
+            initial_temperature / 1000.
+        cooling (str): "geometric" or "linear" schedule.
+        seed (int, optional): Seed for the run's PCG64 generator.
+        constraints (SequenceConstraints, optional): Hard sequencing constraints.
+        stats (dict, optional): Filled with acceptance counts per move type
+            and a sampled (iteration, temperature, current, best) trajectory.
+
+    Returns:
+        list[dict]: Ordered list of track dicts.
+    """
+    if cooling not in ANNEALING_COOLING:
+        raise ValueError(f"cooling must be one of {', '.join(ANNEALING_COOLING)}")
+    n = len(tracks)
+    if n < 3:
+        return tracks[:]
+    iterations = min(iterations or DEFAULT_ANNEALING_ITERATIONS_PER_TRACK * n, MAX_ANNEALING_ITERATIONS)
+    if iterations < 1:
+        raise ValueError("iterations must be at least 1")
+    rng = np.random.default_rng(seed)
+    started_at = time.perf_counter()
+
+    features = _prepare_track_features(tracks)
+    transition_scores = build_transition_matrix(features)
+    start_cost = np.zeros(n)
+    end_cost = np.zeros(n)
+    locked_prefix = None
+    if constraints is not None:
+        transition_scores[~constraints.allowed] = _FORBIDDEN_SCORE
+        start_cost[constraints.has_predecessor] = _FORBIDDEN_SCORE
+        end_cost[constraints.has_successor] = _FORBIDDEN_SCORE
+        locked = np.zeros(n, dtype=bool)
+        locked[list(constraints.pinned)] = True
+        locked_prefix = np.concatenate([[0], np.cumsum(locked)])
+        start = _constrained_greedy_order(transition_scores, constraints)
+    else:
+        start = _greedy_index_order(transition_scores)
+    path = _AnnealingPath(start, transition_scores, start_cost, end_cost)
+
+    if initial_temperature is None:
+        samples = [_propose(values, n, locked_prefix) for values in rng.random((200, 4))]
+        worse = [-path.delta(*move) for move in samples if move is not None]
+        worse = [value for value in worse if 0 < value < -_FORBIDDEN_SCORE / 2]
+        # The greedy start is already good, so start cool: scaled from the
+        # small end of sampled worsening moves rather than their mean.
+        initial_temperature = float(np.percentile(worse, 5)) / 20 if worse else 0.01
+    if final_temperature is None:
+        final_temperature = initial_temperature / 1000
+    if initial_temperature <= 0 or final_temperature <= 0:
+        raise ValueError("temperatures must be positive")
+
+    deadline = started_at + time_budget_ms / 1000.0 if time_budget_ms else None
+    counts = {move: {"proposed": 0, "accepted": 0} for move in _ANNEALING_MOVES}
+    best_score, best_order = path.score, path.order.copy()
+    initial_score = path.score
+    trajectory = []
+    sample_every = max(1, iterations // _ANNEALING_TRAJECTORY_POINTS)
+    # At least ~100 temperature steps per run, re-checking the deadline as often.
+    batch_size = max(1, min(_ANNEALING_BATCH, iterations // 100))
+    temperature = initial_temperature
+    iteration = 0
+    with stage("annealing", count=0) as span:
+        while iteration < iterations:
+            progress = iteration / iterations
+            if deadline is not None:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                progress = max(progress, (now - started_at) / (deadline - started_at))
+            temperature = _temperature(initial_temperature, final_temperature, progress, cooling)
+            for values in rng.random((min(batch_size, iterations - iteration), 5)):
+                iteration += 1
+                if iteration % sample_every == 0:
+                    trajectory.append([iteration, float(temperature), float(path.score), float(best_score)])
+                move = _propose(values[:4], n, locked_prefix)
+                if move is None:
+                    continue
+                counts[move[0]]["proposed"] += 1
+                delta = path.delta(*move)
+                if delta < _FORBIDDEN_SCORE / 2:
+                    continue
+                if delta >= 0 or values[4] < math.exp(delta / temperature):
+                    path.apply(*move)
+                    path.score += delta
+                    counts[move[0]]["accepted"] += 1
+                    if path.score > best_score:
+                        best_score, best_order = path.score, path.order.copy()
+        span.count = iteration
+
+    if stats is not None:
+        proposed = sum(count["proposed"] for count in counts.values())
+        accepted = sum(count["accepted"] for count in counts.values())
+        stats.update(
+            {
+                "iterations": iteration,
+                "seconds": time.perf_counter() - started_at,
+                "initial_temperature": float(initial_temperature),
+                "final_temperature": float(temperature),
+                "initial_score": float(initial_score),
+                "best_score": float(best_score),
+                "proposed": proposed,
+                "accepted": accepted,
+                "acceptance_rate": accepted / proposed if proposed else 0.0,
+                "moves": counts,
+                "trajectory": trajectory,
+            }
+        )
+    return [tracks[i] for i in best_order.tolist()]
+
 # Example usage:
 if __name__ == '__main__':
     # Example track list (replace with real embeddings/BPMs)
@@ -0,0 +1,112 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from metrics import STAGE_ITEMS, STAGE_SECONDS
+
+_active_profile = contextvars.ContextVar("optimizer_profile", default=None)
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class StageSpan:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = None
+
+
+class Profile:
+    """
+    Stage timings for one optimizer run.
+
+    Repeated stages (GA generations, local search passes) are aggregated into
+    one entry with the number of calls, keeping the order stages first ran in.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started_at = time.perf_counter()
+        self._stages = {}
+
+    def record(self, stage, seconds, count, rss_delta):
+        entry = self._stages.setdefault(
+            stage,
+            {"stage": stage, "seconds": 0.0, "calls": 0, "count": None, "rss_delta_bytes": None},
+        )
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+        if count is not None:
+            entry["count"] = (entry["count"] or 0) + count
+        if rss_delta is not None:
+            entry["rss_delta_bytes"] = (entry["rss_delta_bytes"] or 0) + rss_delta
+
+    def to_dict(self):
+        return {
+            "total_seconds": time.perf_counter() - self.started_at,
+            "stages": list(self._stages.values()),
+        }
+
+    def summary(self):
+        return " ".join(
+            f"{entry['stage']}={entry['seconds']:.3f}s"
+            for entry in self._stages.values()
+        )
+
+
+@contextmanager
+def profiling(mode, profile=None):
+    """
+    Collects stage spans recorded in this context into a Profile.
+
+    Pass an existing profile to keep recording into it, e.g. from the worker
+    thread an optimizer is offloaded to.
+    """
+    profile = profile if profile is not None else Profile(mode)
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
+
+
+def record_stage(name, seconds, count=None, rss_delta=None):
+    """Records a stage timed by the caller, e.g. work done before the profile was active."""
+    profile = _active_profile.get()
+    mode = profile.mode if profile is not None else "none"
+    STAGE_SECONDS.labels(mode=mode, stage=name).observe(seconds)
+    if count is not None:
+        STAGE_ITEMS.labels(mode=mode, stage=name).inc(count)
+    if profile is not None:
+        profile.record(name, seconds, count, rss_delta)
+
+
+@contextmanager
+def stage(name, count=None):
+    """
+    Times an optimizer stage.
+
+    The duration is always observed in the stage histogram. When a Profile is
+    active the span, its item count and RSS delta are also added to it. Set
+    span.count inside the block when the count is only known afterwards.
+    """
+    profile = _active_profile.get()
+    span = StageSpan()
+    span.count = count
+    rss_before = _rss_bytes() if profile is not None else None
+    started_at = time.perf_counter()
+    try:
+        yield span
+    finally:
+        seconds = time.perf_counter() - started_at
+        rss_after = _rss_bytes() if rss_before is not None else None
+        rss_delta = rss_after - rss_before if rss_after is not None else None
+        record_stage(name, seconds, span.count, rss_delta)
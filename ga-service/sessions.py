@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from metrics import SESSION_EVICTIONS, SESSION_LOOKUPS
+from optimizer import _prepare_track_features, build_component_matrices
+
+SESSION_TTL_SECONDS = float(os.getenv("GA_SESSION_TTL_SECONDS", "900"))
+SESSION_MAX_BYTES = int(os.getenv("GA_SESSION_MAX_BYTES", str(512 * 1024 * 1024)))
+# build_component_matrices holds five float64 components and two bool
+# same_artist / same_album indicators per track pair.
+COMPONENT_BYTES_PER_PAIR = 5 * 8 + 2
+
+
+class SessionTooLargeError(ValueError):
+    pass
+
+
+class OptimizerSession:
+    """A crate's tracks plus the component matrices needed to re-solve it."""
+
+    def __init__(self, tracks, features, components, session_id=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.tracks = tracks
+        self.features = features
+        self.components = components
+        self.nbytes = sum(matrix.nbytes for matrix in components.values()) + features.nbytes
+        self.last_used = time.monotonic()
+
+    @staticmethod
+    def estimated_nbytes(track_count):
+        """Lower bound on nbytes for a crate of track_count tracks, known before any matrix is built."""
+        return track_count * track_count * COMPONENT_BYTES_PER_PAIR
+
+    @classmethod
+    def from_tracks(cls, tracks):
+        features = _prepare_track_features(tracks)
+        return cls(tracks, features, build_component_matrices(features))
+
+
+class SessionStore:
+    """
+    Thread-safe LRU of optimizer sessions bounded by idle TTL and total bytes.
+
+    Sessions are evicted when they have been idle longer than ttl_seconds, or
+    least recently used first once the summed matrix bytes exceed max_bytes.
+    """
+
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS, max_bytes=SESSION_MAX_BYTES, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def check_size(self, nbytes):
+        if nbytes > self.max_bytes:
+            raise SessionTooLargeError(f"Session needs {nbytes} bytes, above the {self.max_bytes} byte cache limit")
+
+    def add(self, session):
+        self.check_size(session.nbytes)
+        with self._lock:
+            session.last_used = self._clock()
+            self._sessions[session.session_id] = session
+            self._bytes += session.nbytes
+            self._evict_locked()
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            self._evict_locked()
+            session = self._sessions.get(session_id)
+            if session is None:
+                SESSION_LOOKUPS.labels(result="miss").inc()
+                return None
+            SESSION_LOOKUPS.labels(result="hit").inc()
+            session.last_used = self._clock()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._bytes -= session.nbytes
+            return session is not None
+
+    def stats(self):
+        with self._lock:
+            self._evict_locked()
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def _evict_locked(self):
+        now = self._clock()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_used > self.ttl_seconds:
+                del self._sessions[session_id]
+                self._bytes -= session.nbytes
+                SESSION_EVICTIONS.labels(reason="ttl").inc()
+        while self._bytes > self.max_bytes and self._sessions:
+            _, session = self._sessions.popitem(last=False)
+            self._bytes -= session.nbytes
+            SESSION_EVICTIONS.labels(reason="size").inc()
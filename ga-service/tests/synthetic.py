@@ -0,0 +1,23 @@
+import json
+
+
+def synthetic_tracks(n):
+    """
+    n distinct tracks on a rising BPM and danceability ramp.
+
+    Styles alternate, three artists repeat and the 2-d embeddings drift with
+    the ramp, so the unconstrained optimizers walk the tracks in index order.
+    """
+    return [
+        {
+            "id": f"t{i}",
+            "title": f"track {i}",
+            "artist": f"artist {i % 3}",
+            "genres": ["Electronic"],
+            "styles": ["House" if i % 2 else "Techno"],
+            "bpm": 118 + i,
+            "danceability": i / n,
+            "embedding": json.dumps([1.0, i / n]),
+        }
+        for i in range(n)
+    ]
@@ -0,0 +1,36 @@
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.run import compare, run_case
+from benchmarks.synthetic import generate_crate
+
+
+def test_generate_crate_is_seeded_and_realistic():
+    crate = generate_crate(200, dim=64, seed=7)
+
+    assert crate == generate_crate(200, dim=64, seed=7)
+    assert crate != generate_crate(200, dim=64, seed=8)
+    assert {len(json.loads(track["embedding"])) for track in crate} == {64}
+    assert Counter(track["artist"] for track in crate).most_common(1)[0][1] > 5
+    assert any(track["key"] and track["key"][-1] in "AB" for track in crate)
+    assert any(track["key"] and " " in track["key"] for track in crate)
+    assert all(120 <= track["duration_seconds"] <= 720 for track in crate)
+
+
+def test_run_case_reports_time_memory_and_score():
+    row = run_case("greedy", 8, dim=16, timeout=60)
+
+    assert row["status"] == "ok"
+    assert row["result_tracks"] == 8
+    assert row["seconds"] > 0
+    assert row["peak_rss_mb"] > 0
+    assert isinstance(row["score"], float)
+
+    lines = []
+    report = {"meta": {"commit": "abc"}, "results": [row]}
+    compare(report, report, log=lines.append)
+    assert "time x  1.00" in lines[1]
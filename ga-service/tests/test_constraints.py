@@ -0,0 +1,137 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import constraints as constraints_module
+from constraints import ConstraintError, SequenceConstraints, constrained_order, repair_order
+from ga_service import OptimizeRequest, optimize
+from synthetic import synthetic_tracks
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"pinned": [(0, 0), (1, 0)]},
+        {"pinned": [(0, 0), (0, 3)]},
+        {"pinned": [(0, 9)]},
+        {"must_follow": [(0, 1), (1, 2), (2, 0)]},
+        {"must_follow": [(0, 1), (0, 2)]},
+        {"must_follow": [(0, 1)], "forbidden": [(0, 1)]},
+        {"must_follow": [(0, 1)], "pinned": [(0, -1)]},
+        {"must_follow": [(0, 1)], "pinned": [(0, 2), (1, 4)]},
+        {"pinned": [(0, 1), (1, 2)], "forbidden": [(0, 1)]},
+        {"forbidden": [(0, b) for b in range(1, 5)] + [(1, b) for b in (0, 2, 3, 4)]},
+    ],
+)
+def test_infeasible_constraints_are_rejected_up_front(kwargs):
+    with pytest.raises(ConstraintError):
+        SequenceConstraints(5, **kwargs)
+
+
+def test_chain_pins_propagate_and_orders_stay_feasible():
+    constraints = SequenceConstraints(
+        6,
+        pinned=[(4, -1)],
+        must_follow=[(1, 2), (2, 3)],
+        forbidden=[(0, 5)],
+    )
+    assert constraints.pinned == {5: 4}
+
+    order = constrained_order(constraints, lambda previous, position: [0, 5, 4, 3, 2, 1])
+    assert constraints.is_feasible(order)
+    assert order[-1] == 4
+    assert order[order.index(1) + 1: order.index(1) + 3] == [2, 3]
+
+    repaired = repair_order(constraints, [4, 3, 2, 1, 0, 5])
+    assert constraints.is_feasible(repaired)
+    assert not constraints.swap_allowed(repaired, repaired.index(2), repaired.index(0))
+
+
+def test_repair_glues_chains_around_pins_without_searching(monkeypatch):
+    def search(*args):
+        raise AssertionError("repair fell back to the backtracking search")
+
+    monkeypatch.setattr(constraints_module, "_search", search)
+    constraints = SequenceConstraints(8, pinned=[(7, 2)], must_follow=[(0, 1), (1, 2)], forbidden=[(5, 3)])
+
+    repaired = repair_order(constraints, [5, 0, 1, 2, 3, 4, 6, 7])
+
+    assert constraints.is_feasible(repaired)
+    # The chain can't fit before the pinned slot, so it opens the next gap.
+    assert repaired[2:6] == [7, 0, 1, 2]
+    assert sorted(repaired[:2] + repaired[6:]) == [3, 4, 5, 6]
+
+
+@pytest.mark.parametrize("mode", ["genetic", "greedy", "cohesive_blocks"])
+def test_optimize_honours_constraints_in_every_mode(mode):
+    request = OptimizeRequest(
+        tracks=synthetic_tracks(8),
+        mode=mode,
+        constraints={
+            "pinned": [{"track": 5, "position": 0}, {"track": 2, "position": -1}, {"track": 7, "position": 3}],
+            "must_follow": [[0, 1]],
+            "forbidden": [[5, 6], [3, 4]],
+        },
+    )
+
+    result = asyncio.run(optimize(request))
+    titles = [track["title"] for track in result["result"]]
+
+    assert titles[0] == "track 5"
+    assert titles[3] == "track 7"
+    assert titles[-1] == "track 2"
+    assert titles[titles.index("track 0") + 1] == "track 1"
+    assert titles[1] != "track 6"
+    assert titles[titles.index("track 3") + 1:][:1] != ["track 4"]
+
+
+def test_must_follow_pairs_cannot_straddle_the_ends_of_the_set():
+    constraints = SequenceConstraints(3, must_follow=[(0, 1)])
+    assert not constraints.is_feasible([1, 2, 0])
+    assert not constraints.is_feasible([2, 1, 0])
+    assert constraints.is_feasible([2, 0, 1])
+    repaired = repair_order(constraints, [1, 2, 0])
+    assert constraints.is_feasible(repaired)
+    assert repaired[repaired.index(0) + 1] == 1
+
+
+@pytest.mark.parametrize("mode", ["genetic", "greedy", "cohesive_blocks", "annealing", "beam"])
+@pytest.mark.parametrize("seed", range(3))
+def test_optimize_honours_must_follow_between_the_unconstrained_ends(mode, seed):
+    # The unconstrained order runs up the BPM ramp, so 7 -> 0 joins its two ends.
+    request = OptimizeRequest(tracks=synthetic_tracks(8), mode=mode, seed=seed, constraints={"must_follow": [[7, 0]]})
+
+    result = asyncio.run(optimize(request))
+    titles = [track["title"] for track in result["result"]]
+
+    assert titles[-1] != "track 7"
+    assert titles[titles.index("track 7") + 1] == "track 0"
+
+
+def test_beam_search_dead_ends_fall_back_instead_of_rejecting_satisfiable_constraints():
+    # Track 3 can only be followed by track 2, which a width-1 beam spends early.
+    forbidden = [[3, 0], [3, 1], [0, 2], [2, 0], [3, 4], [1, 3]]
+    constraints = SequenceConstraints(5, forbidden=forbidden)
+    request = OptimizeRequest(tracks=synthetic_tracks(5), mode="beam", beam_width=1, constraints={"forbidden": forbidden})
+
+    result = asyncio.run(optimize(request))
+    order = [int(track["title"].split()[1]) for track in result["result"]]
+
+    assert constraints.is_feasible(order)
+
+
+def test_optimize_rejects_infeasible_constraints():
+    request = OptimizeRequest(
+        tracks=synthetic_tracks(3),
+        mode="greedy",
+        constraints={"must_follow": [[0, 1], [1, 0]]},
+    )
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(optimize(request))
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,125 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ga_service import OptimizeRequest, optimize
+from harmonic import HarmonicIndex, camelot_code
+import optimizer
+from optimizer import (
+    _greedy_index_order,
+    _parse_key,
+    _prepare_track_features,
+    build_transition_matrix,
+    run_cohesive_blocks_optimizer,
+    run_greedy_algorithm,
+)
+
+
+def _code(key):
+    return camelot_code(_parse_key(key))
+
+
+def test_pitch_class_keys_share_buckets_with_camelot_codes():
+    assert _code("C major") == _code("8B")
+    assert _code("Am") == _code("8A")
+    assert _code("F#m") == _code("11A")
+    assert _code("not a key") == -1
+
+
+def test_compatible_neighbours_are_same_relative_and_adjacent():
+    index = HarmonicIndex([_parse_key(key) for key in ["8A", "8B", "9A", "7A", "12A", "1A", "3B", None]])
+    tracks = np.arange(8)
+    compatible = index.compatible(tracks[:, None], tracks[None, :])
+    assert compatible[0, 1] and compatible[0, 2] and compatible[0, 3]
+    assert not compatible[0, 4] and not compatible[0, 6]
+    # The wheel wraps from 12 back to 1.
+    assert compatible[4, 5] and compatible[5, 4]
+    # Unknown keys match anything.
+    assert compatible[7].sum() == 7 and compatible[:, 7].sum() == 7
+    assert sorted(index.successors(0).tolist()) == [1, 2, 3, 7]
+    assert index.candidate_pairs() < 8 * 8
+
+
+def _keyed_crate():
+    keys = ["1A", "7B", "2A", "8B", "3A", "9B", "4A", "10B", "5A", "11B", "6A", "12B"]
+    return [
+        {"title": f"T{index}", "key": key, "bpm": 120 + index, "genres": ["House"]}
+        for index, key in enumerate(keys)
+    ]
+
+
+def _clashes(ordered):
+    index = HarmonicIndex([_parse_key(track["key"]) for track in ordered])
+    positions = np.arange(len(ordered) - 1)
+    return int((~index.compatible(positions, positions + 1)).sum())
+
+
+def test_strict_harmonic_greedy_prefers_compatible_successors_over_closer_bpm():
+    tracks = [
+        {"title": "start", "key": "8A", "bpm": 120, "genres": ["House"], "styles": ["Deep House"], "embedding": "[1, 0]"},
+        {"title": "clash", "key": "3B", "bpm": 120, "genres": ["House"], "styles": ["Deep House"], "embedding": "[1, 0]"},
+        {"title": "up", "key": "9A", "bpm": 128, "genres": ["Techno"], "embedding": "[0, 1]"},
+        {"title": "upper", "key": "10A", "bpm": 129, "genres": ["Techno"], "embedding": "[0, 1]"},
+    ]
+    loose = run_greedy_algorithm(tracks)
+    strict = run_greedy_algorithm(tracks, strict_harmonic=True)
+    assert [track["title"] for track in loose][:2] == ["start", "clash"]
+    assert [track["title"] for track in strict] == ["start", "up", "upper", "clash"]
+    assert _clashes(strict) < _clashes(loose)
+
+
+def test_strict_harmonic_cohesive_blocks_does_not_add_clashes():
+    tracks = _keyed_crate()
+    loose = run_cohesive_blocks_optimizer(tracks)
+    strict = run_cohesive_blocks_optimizer(tracks, strict_harmonic=True)
+    assert len(strict) == len(tracks)
+    assert _clashes(strict) <= _clashes(loose)
+
+
+def test_strict_harmonic_greedy_only_scores_harmonic_pairs():
+    tracks = _keyed_crate() * 4
+    features = _prepare_track_features(tracks)
+    index = HarmonicIndex([_parse_key(track["key"]) for track in tracks])
+    expected = _greedy_index_order(build_transition_matrix(features), harmonic=index)
+
+    timed = asyncio.run(
+        optimize(OptimizeRequest(tracks=tracks, mode="greedy", strict_harmonic=True, debug_timings=True, **{"return": "indices"}))
+    )
+    stages = {entry["stage"]: entry for entry in timed["timings"]["stages"]}
+
+    assert timed["order"] == expected
+    assert stages["matrix_build"]["count"] == index.candidate_pairs() < len(tracks) ** 2
+
+
+def test_strict_harmonic_greedy_derives_crate_lookups_once(monkeypatch):
+    tracks = _keyed_crate() * 4
+    calls = {"key_code": 0, "postings": 0}
+    key_code, build_postings = optimizer._key_code, optimizer._build_metadata_postings
+
+    def counted_key_code(value):
+        calls["key_code"] += 1
+        return key_code(value)
+
+    def counted_postings(features):
+        calls["postings"] += 1
+        return build_postings(features)
+
+    monkeypatch.setattr(optimizer, "_key_code", counted_key_code)
+    monkeypatch.setattr(optimizer, "_build_metadata_postings", counted_postings)
+    run_greedy_algorithm(tracks, strict_harmonic=True)
+
+    # One pass over the crate, however many key buckets are scored.
+    assert calls == {"key_code": len(tracks), "postings": 1}
+
+
+@pytest.mark.parametrize("mode", ["genetic", "beam", "annealing", "energy_curve", "target_duration"])
+def test_strict_harmonic_is_rejected_by_modes_that_ignore_it(mode):
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(optimize(OptimizeRequest(tracks=_keyed_crate(), mode=mode, strict_harmonic=True)))
+    assert excinfo.value.status_code == 400
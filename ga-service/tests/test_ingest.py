@@ -0,0 +1,112 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ga_service import app
+from ingest import IngestError, decode_tracks
+from islands import MAX_ISLANDS
+from optimizer import MAX_BEAM_WIDTH, total_playlist_score
+from synthetic import synthetic_tracks
+
+client = TestClient(app)
+
+
+def test_decode_passes_extra_fields_through_and_coerces_numbers():
+    tracks = synthetic_tracks(2)
+    tracks[0]["bpm"] = "124.5"
+    decoded, options = decode_tracks(json.dumps({"tracks": tracks, "mode": "greedy"}))
+
+    assert decoded[0]["id"] == "t0"
+    assert decoded[0]["bpm"] == 124.5
+    assert options == {"mode": "greedy"}
+
+
+@pytest.mark.parametrize(
+    "body, loc",
+    [
+        (b"{not json", ["body"]),
+        (b"{}", ["body", "tracks"]),
+        (json.dumps({"tracks": [{"bpm": "fast"}]}).encode(), ["body", "tracks", 0, "bpm"]),
+        (json.dumps({"tracks": [{"bpm": True}]}).encode(), ["body", "tracks", 0, "bpm"]),
+        (json.dumps({"tracks": [{"styles": ["House", 3]}]}).encode(), ["body", "tracks", 0, "styles"]),
+        (json.dumps({"tracks": [{"embedding": [0.1, 0.2]}]}).encode(), ["body", "tracks", 0, "embedding"]),
+    ],
+)
+def test_decode_rejects_malformed_tracks(body, loc):
+    with pytest.raises(IngestError) as excinfo:
+        decode_tracks(body)
+    assert excinfo.value.errors[0]["loc"] == loc
+
+
+def test_optimize_endpoint_uses_fast_path():
+    response = client.post("/optimize", json={"tracks": synthetic_tracks(5), "mode": "greedy"})
+
+    assert response.status_code == 200
+    assert sorted(track["id"] for track in response.json()["result"]) == [f"t{i}" for i in range(5)]
+
+
+def test_optimize_endpoint_returns_422_for_bad_tracks_and_options():
+    bad_track = client.post("/optimize", json={"tracks": [{"bpm": "fast"}]})
+    assert bad_track.status_code == 422
+    assert bad_track.json()["detail"][0]["loc"] == ["body", "tracks", 0, "bpm"]
+
+    bad_mode = client.post("/optimize", json={"tracks": synthetic_tracks(2), "mode": "random"})
+    assert bad_mode.status_code == 422
+    assert bad_mode.json()["detail"][0]["loc"] == ["body", "mode"]
+
+
+@pytest.mark.parametrize(
+    "options, field",
+    [
+        ({"mode": "beam", "beam_width": 0}, "beam_width"),
+        ({"mode": "beam", "beam_width": MAX_BEAM_WIDTH + 1}, "beam_width"),
+        ({"mode": "energy_curve", "beam_width": -3}, "beam_width"),
+        ({"mode": "genetic", "islands": 0}, "islands"),
+        ({"mode": "genetic", "islands": MAX_ISLANDS + 1}, "islands"),
+    ],
+)
+def test_optimize_endpoint_returns_422_for_out_of_range_search_sizes(options, field):
+    response = client.post("/optimize", json={"tracks": synthetic_tracks(3), **options})
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", field]
+
+
+def test_optimize_endpoint_returns_permutation_or_ids_without_tracks():
+    tracks = [{**track, "track_id": track.pop("id")} for track in synthetic_tracks(6)]
+
+    indices = client.post("/optimize", json={"tracks": tracks, "mode": "greedy", "return": "indices"}).json()
+    assert "result" not in indices
+    assert sorted(indices["order"]) == list(range(6))
+    assert isinstance(indices["score"], float)
+
+    ids = client.post("/optimize", json={"tracks": tracks, "mode": "greedy", "return": "ids"}).json()
+    assert ids["ids"] == [tracks[i]["track_id"] for i in indices["order"]]
+    assert ids["score"] == indices["score"]
+    assert indices["score"] == pytest.approx(total_playlist_score([tracks[i] for i in indices["order"]]))
+
+    timed = client.post(
+        "/optimize",
+        json={"tracks": tracks, "mode": "greedy", "return": "indices", "debug_timings": True},
+    ).json()
+    stages = {entry["stage"]: entry for entry in timed["timings"]["stages"]}
+    # The score reuses the optimizer's features instead of preparing them again.
+    assert stages["feature_prep"]["calls"] == 1
+
+    missing = client.post("/optimize", json={"tracks": synthetic_tracks(3), "mode": "greedy", "return": "ids"})
+    assert missing.status_code == 400
+
+
+def test_optimize_endpoint_can_strip_embeddings():
+    response = client.post(
+        "/optimize",
+        json={"tracks": synthetic_tracks(4), "mode": "greedy", "strip_embeddings": True},
+    ).json()
+
+    assert len(response["result"]) == 4
+    assert all("embedding" not in track and "id" in track for track in response["result"])
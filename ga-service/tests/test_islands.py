@@ -0,0 +1,88 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from constraints import SequenceConstraints
+from islands import fitness_matrix, population_fitness, run_islands
+from optimizer import _prepare_track_features, run_genetic_algorithm
+from synthetic import synthetic_tracks
+
+
+def _matrix(tracks):
+    features = _prepare_track_features(tracks)
+    return features, fitness_matrix(features.embeddings, features.bpms.astype(np.float32))
+
+
+def test_fitness_matrix_matches_cosine_minus_bpm_distance():
+    tracks = synthetic_tracks(12)
+    _, matrix = _matrix(tracks)
+    order = np.random.default_rng(0).permutation(12)
+    vectors = [np.array(json.loads(track["embedding"])) for track in tracks]
+
+    expected = sum(
+        vectors[a] @ vectors[b] / (np.linalg.norm(vectors[a]) * np.linalg.norm(vectors[b]))
+        - abs(tracks[a]["bpm"] - tracks[b]["bpm"]) / 10
+        for a, b in zip(order[:-1], order[1:])
+    )
+    assert population_fitness(order[None, :], matrix)[0] == pytest.approx(expected, rel=1e-5)
+
+
+def test_islands_are_deterministic_across_workers_and_beat_random_orders():
+    _, matrix = _matrix(synthetic_tracks(30))
+    kwargs = dict(pop_size=20, generations=12, islands=3, seed=11, migration_interval=4)
+
+    in_process = run_islands(matrix, parallel=False, **kwargs)
+    parallel = run_islands(matrix, parallel=True, **kwargs)
+
+    assert in_process == parallel
+    assert sorted(in_process) == list(range(30))
+    random_orders = np.stack([np.random.default_rng(i).permutation(30) for i in range(20)])
+    assert population_fitness(np.array([in_process]), matrix)[0] > population_fitness(random_orders, matrix).max()
+
+
+def test_island_genetic_algorithm_honours_constraints_and_seed_idx():
+    tracks = synthetic_tracks(10)
+    constraints = SequenceConstraints(10, pinned=[(4, -1)], must_follow=[(1, 2)])
+
+    ordered = run_genetic_algorithm(tracks, generations=6, pop_size=12, seed=2, islands=2, constraints=constraints)
+    titles = [track["title"] for track in ordered]
+    assert titles[-1] == "track 4"
+    assert titles[titles.index("track 1") + 1] == "track 2"
+
+    seeded = run_genetic_algorithm(tracks, generations=6, pop_size=12, seed=2, islands=2, seed_idx=7)
+    assert seeded[0]["title"] == "track 7"
+
+
+def test_seeded_runs_reproduce_across_concurrent_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    tracks = synthetic_tracks(20)
+
+    def solve(seed):
+        return [track["title"] for track in run_genetic_algorithm(tracks, generations=8, pop_size=16, seed=seed)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(solve, [5, 6, 5, 6, 5, 6]))
+
+    assert results[0] == results[2] == results[4]
+    assert results[1] == results[3] == results[5]
+
+
+def test_optimize_echoes_the_seed_it_used():
+    import asyncio
+
+    from ga_service import OptimizeRequest, optimize
+
+    tracks = synthetic_tracks(8)
+    drawn = asyncio.run(optimize(OptimizeRequest(tracks=tracks)))
+    replayed = asyncio.run(optimize(OptimizeRequest(tracks=tracks, seed=drawn["seed"])))
+
+    assert isinstance(drawn["seed"], int)
+    assert replayed["seed"] == drawn["seed"]
+    assert [t["title"] for t in replayed["result"]] == [t["title"] for t in drawn["result"]]
+    assert "seed" not in asyncio.run(optimize(OptimizeRequest(tracks=tracks, mode="greedy")))
@@ -0,0 +1,65 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import ga_service
+from ga_service import OptimizeRequest, SessionSolveRequest, metrics, optimize, solve_session
+from sessions import SessionStore
+from synthetic import synthetic_tracks
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_optimize_counts_requests_latency_and_track_sizes():
+    ok_before = _sample("ga_requests_total", endpoint="optimize", mode="greedy", status="200")
+    bad_before = _sample("ga_requests_total", endpoint="optimize", mode="greedy", status="400")
+    latency_before = _sample("ga_request_seconds_count", endpoint="optimize", mode="greedy")
+    small_before = _sample("ga_request_tracks_bucket", endpoint="optimize", le="10.0")
+
+    asyncio.run(optimize(OptimizeRequest(tracks=synthetic_tracks(5), mode="greedy")))
+    with pytest.raises(HTTPException):
+        asyncio.run(
+            optimize(OptimizeRequest(tracks=synthetic_tracks(3), mode="greedy", constraints={"must_follow": [[0, 0]]}))
+        )
+
+    assert _sample("ga_requests_total", endpoint="optimize", mode="greedy", status="200") == ok_before + 1
+    assert _sample("ga_requests_total", endpoint="optimize", mode="greedy", status="400") == bad_before + 1
+    assert _sample("ga_request_seconds_count", endpoint="optimize", mode="greedy") == latency_before + 2
+    assert _sample("ga_request_tracks_bucket", endpoint="optimize", le="10.0") == small_before + 2
+    assert _sample("ga_requests_in_flight", endpoint="optimize") == 0
+    assert _sample("ga_optimizer_jobs_queued") == 0
+    assert _sample("ga_optimizer_jobs_running") == 0
+
+
+def test_validation_errors_share_the_endpoint_label():
+    client = TestClient(ga_service.app)
+    before = _sample("ga_requests_total", endpoint="optimize", mode="unknown", status="422")
+
+    assert client.post("/optimize", json={"tracks": synthetic_tracks(2), "mode": "random"}).status_code == 422
+    assert client.post("/optimize/sessions/abc/solve", json={"mode": "random"}).status_code == 422
+
+    assert _sample("ga_requests_total", endpoint="optimize", mode="unknown", status="422") == before + 1
+    assert _sample("ga_requests_total", endpoint="session_solve", mode="unknown", status="422") >= 1
+    assert _sample("ga_requests_total", endpoint="/optimize", mode="unknown", status="422") == 0
+
+
+def test_session_cache_lookups_are_exported(monkeypatch):
+    monkeypatch.setattr(ga_service, "session_store", SessionStore())
+    misses_before = _sample("ga_session_cache_lookups_total", result="miss")
+
+    with pytest.raises(HTTPException):
+        asyncio.run(solve_session("missing", SessionSolveRequest()))
+
+    assert _sample("ga_session_cache_lookups_total", result="miss") == misses_before + 1
+    body = asyncio.run(metrics()).body.decode()
+    assert 'ga_requests_total{endpoint="session_solve",mode="greedy",status="404"}' in body
+    assert "ga_session_cache_sessions 0.0" in body
@@ -3,15 +3,26 @@ import json
 import sys
 from pathlib import Path
 
+import pytest
+from fastapi import HTTPException
+
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
 from ga_service import OptimizeRequest, optimize
 from optimizer import (
+    _build_score_matrices,
+    _local_search_indices,
+    _prepare_track_features,
+    _score_index_order,
     bpm_compatibility,
     metadata_similarity,
+    run_beam_search_optimizer,
     run_cohesive_blocks_optimizer,
+    run_genetic_algorithm,
+    total_playlist_score,
     transition_score,
 )
+from synthetic import synthetic_tracks
 
 
 def test_metadata_similarity_uses_genres_styles_and_local_tags():
@@ -82,7 +93,7 @@ def test_optimize_endpoint_selects_supported_modes():
         },
     ]
 
-    for mode in ("genetic", "greedy", "cohesive_blocks"):
+    for mode in ("genetic", "greedy", "cohesive_blocks", "beam"):
         result = asyncio.run(optimize(OptimizeRequest(tracks=tracks, mode=mode)))
         assert result["mode"] == mode
         assert len(result["result"]) == 2
@@ -141,3 +152,239 @@ def test_cohesive_blocks_keep_related_styles_near_each_other():
 
     assert abs(positions["house 1"] - positions["house 2"]) == 1
     assert abs(positions["jazz 1"] - positions["jazz 2"]) == 1
+
+
+def _duration_crate():
+    tracks = []
+    for i in range(12):
+        house = i % 2 == 0
+        tracks.append(
+            {
+                "title": f"{'house' if house else 'jazz'} {i}",
+                "artist": f"artist {i}",
+                "genres": ["Electronic"] if house else ["Jazz"],
+                "styles": ["Deep House"] if house else ["Hard Bop"],
+                "bpm": 120 + i if house else 90 + i,
+                "danceability": 0.7 if house else 0.3,
+                "duration_seconds": 300,
+                "embedding": json.dumps([1.0, 0.1 * i] if house else [0.1 * i, 1.0]),
+            }
+        )
+    tracks.append({"title": "no duration", "genres": ["Electronic"], "styles": ["Deep House"]})
+    return tracks
+
+
+def test_target_duration_selects_a_subset_within_budget():
+    tracks = _duration_crate()
+
+    result = asyncio.run(
+        optimize(
+            OptimizeRequest(
+                tracks=tracks,
+                mode="target_duration",
+                target_duration_seconds=1500,
+                duration_tolerance_seconds=0,
+            )
+        )
+    )
+    titles = [track["title"] for track in result["result"]]
+
+    assert len(titles) == 5
+    assert "no duration" not in titles
+    assert len({title.split()[0] for title in titles}) == 1
+
+
+def test_target_duration_pins_opener_and_closer_and_requires_target():
+    tracks = _duration_crate()
+
+    result = asyncio.run(
+        optimize(
+            OptimizeRequest(
+                tracks=tracks,
+                mode="target_duration",
+                target_duration_seconds=1200,
+                duration_tolerance_seconds=0,
+                constraints={"pinned": [{"track": 3, "position": 0}, {"track": 4, "position": -1}]},
+            )
+        )
+    )
+    titles = [track["title"] for track in result["result"]]
+    assert titles[0] == "jazz 3"
+    assert titles[-1] == "house 4"
+    assert len(titles) == 4
+
+    with pytest.raises(HTTPException):
+        asyncio.run(optimize(OptimizeRequest(tracks=tracks, mode="target_duration")))
+
+
+def test_energy_curve_follows_a_peak_shaped_target():
+    tracks = [
+        {
+            "title": f"track {i}",
+            "artist": f"artist {i}",
+            "genres": ["Electronic"],
+            "danceability": energy,
+            "bpm": 110 + 20 * energy,
+        }
+        for i, energy in enumerate([0.9, 0.1, 0.5, 0.7, 0.3, 0.8, 0.2])
+    ]
+
+    result = asyncio.run(
+        optimize(
+            OptimizeRequest(
+                tracks=tracks,
+                mode="energy_curve",
+                energy_curve=[[0.0, 0.1], [0.5, 0.9], [1.0, 0.2]],
+                constraints={"pinned": [{"track": 2, "position": -1}]},
+            )
+        )
+    )
+    energies = [track["danceability"] for track in result["result"]]
+
+    assert energies[-1] == 0.5
+    assert energies[0] <= 0.3
+    assert max(energies) == energies[3]
+
+
+def test_energy_curve_rejects_points_outside_unit_range():
+    with pytest.raises(HTTPException):
+        asyncio.run(
+            optimize(
+                OptimizeRequest(
+                    tracks=_duration_crate(),
+                    mode="energy_curve",
+                    energy_curve=[[0.0, 1.5]],
+                )
+            )
+        )
+
+
+def test_beam_search_matches_exhaustive_search_on_small_crates():
+    import itertools
+
+    tracks = _duration_crate()[:6]
+    features = _prepare_track_features(tracks)
+    _, transition_scores = _build_score_matrices(features)
+    best = max(
+        _score_index_order(list(order), features, transition_scores)
+        for order in itertools.permutations(range(len(tracks)))
+    )
+
+    greedy = total_playlist_score(run_beam_search_optimizer(tracks, beam_width=1))
+    wide = total_playlist_score(run_beam_search_optimizer(tracks, beam_width=720))
+
+    assert greedy <= wide
+    assert wide == pytest.approx(best)
+
+
+def test_local_search_window_scores_match_full_rescoring():
+    features = _prepare_track_features(synthetic_tracks(24))
+    _, transition_scores = _build_score_matrices(features)
+    order = list(range(23, -1, -1))
+
+    expected = order[:]
+    best_score = _score_index_order(expected, features, transition_scores)
+    for _ in range(3):
+        improved = False
+        for i in range(len(expected)):
+            for j in range(i + 1, min(len(expected), i + 4)):
+                candidate = expected[:]
+                candidate[i], candidate[j] = candidate[j], candidate[i]
+                score = _score_index_order(candidate, features, transition_scores)
+                if score > best_score + 1e-12:
+                    expected, best_score, improved = candidate, score, True
+        if not improved:
+            break
+
+    searched = _local_search_indices(order, features, transition_scores)
+
+    assert searched == expected
+    assert _score_index_order(searched, features, transition_scores) == pytest.approx(best_score)
+
+
+def test_track_features_normalize_once_and_drop_mismatched_dimensions():
+    tracks = [
+        {"embedding": json.dumps([3.0, 4.0])},
+        {"embedding": [0.0, 2.0]},
+        {"embedding": json.dumps([1.0, 0.0, 0.0])},
+        {"embedding": json.dumps([0.0, 0.0])},
+        {"embedding": json.dumps(["x", 1.0])},
+        {"embedding": None},
+    ]
+    features = _prepare_track_features(tracks)
+
+    assert features.embeddings.dtype == "float32"
+    assert features.embeddings.shape == (6, 2)
+    assert features.embedding_mask.tolist() == [True, True, False, False, False, False]
+    assert features.mismatched == [2]
+    assert features.embeddings[0].tolist() == pytest.approx([0.6, 0.8])
+
+
+def test_genetic_algorithm_tolerates_missing_embeddings():
+    tracks = [
+        {"title": str(i), "bpm": 120 + i, "embedding": json.dumps([1.0, i]) if i % 2 else None}
+        for i in range(6)
+    ]
+
+    ordered = run_genetic_algorithm(tracks, generations=3, pop_size=12, seed=1)
+
+    assert sorted(track["title"] for track in ordered) == [str(i) for i in range(6)]
+
+
+def test_annealing_improves_on_greedy_and_reports_statistics():
+    from benchmarks.synthetic import generate_crate
+
+    tracks = generate_crate(60, dim=16, seed=4)
+    response = asyncio.run(
+        optimize(OptimizeRequest(tracks=tracks, mode="annealing", iterations=5000, seed=9))
+    )
+    stats = response["annealing"]
+
+    assert response["seed"] == 9
+    assert len(response["result"]) == 60
+    assert stats["iterations"] == 5000
+    assert stats["best_score"] > stats["initial_score"]
+    assert 0 < stats["acceptance_rate"] < 1
+    assert set(stats["moves"]) == {"swap", "reverse", "move"}
+    assert stats["trajectory"][-1][3] == pytest.approx(stats["best_score"])
+
+    replay = asyncio.run(
+        optimize(OptimizeRequest(tracks=tracks, mode="annealing", iterations=5000, seed=9))
+    )
+    assert replay["result"] == response["result"]
+
+
+def test_annealing_honours_constraints():
+    from constraints import SequenceConstraints
+    from optimizer import run_simulated_annealing_optimizer
+
+    tracks = _duration_crate()
+    n = len(tracks)
+    constraints = SequenceConstraints(n, pinned=[(2, 0), (5, -1)], must_follow=[(1, 3)], forbidden=[(0, 4)])
+
+    ordered = run_simulated_annealing_optimizer(tracks, iterations=3000, seed=1, constraints=constraints)
+    order = [tracks.index(track) for track in ordered]
+
+    assert constraints.is_feasible(order)
+
+
+def test_annealing_move_deltas_match_full_rescoring():
+    import numpy as np
+
+    from optimizer import _AnnealingPath, _propose
+
+    rng = np.random.default_rng(5)
+    n = 30
+    scores = rng.random((n, n))
+    path = _AnnealingPath(rng.permutation(n), scores, rng.random(n), rng.random(n))
+
+    for values in rng.random((500, 4)):
+        move = _propose(values, n, None)
+        delta = path.delta(*move)
+        path.apply(*move)
+        path.score += delta
+
+        assert path.score == pytest.approx(path._total())
+        order = path.order
+        assert np.allclose(path.forward, scores[order[:-1], order[1:]])
+        assert np.allclose(path.backward, scores[order[1:], order[:-1]])
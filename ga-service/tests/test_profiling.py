@@ -0,0 +1,50 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ga_service import OptimizeRequest, metrics, optimize
+from profiling import profiling, stage
+from synthetic import synthetic_tracks
+
+
+def test_stages_aggregate_calls_counts_and_memory():
+    with profiling("test") as profile:
+        for _ in range(3):
+            with stage("generation", count=10):
+                pass
+        with stage("search") as span:
+            span.count = 7
+
+    stages = {entry["stage"]: entry for entry in profile.to_dict()["stages"]}
+    assert list(stages) == ["generation", "search"]
+    assert stages["generation"]["calls"] == 3
+    assert stages["generation"]["count"] == 30
+    assert stages["search"]["count"] == 7
+    assert "rss_delta_bytes" in stages["search"]
+
+
+def test_optimize_returns_timings_only_when_requested():
+    plain = asyncio.run(optimize(OptimizeRequest(tracks=synthetic_tracks(6), mode="cohesive_blocks")))
+    assert "timings" not in plain
+
+    timed = asyncio.run(
+        optimize(OptimizeRequest(tracks=synthetic_tracks(6), mode="cohesive_blocks", debug_timings=True))
+    )
+    stages = [entry["stage"] for entry in timed["timings"]["stages"]]
+    for expected in ("parse", "feature_prep", "matrix_build", "clustering", "block_ordering", "local_search"):
+        assert expected in stages
+    assert timed["timings"]["total_seconds"] >= 0
+
+    genetic = asyncio.run(optimize(OptimizeRequest(tracks=synthetic_tracks(6), debug_timings=True)))
+    generations = {entry["stage"]: entry for entry in genetic["timings"]["stages"]}["ga_generation"]
+    assert generations["calls"] > 1
+
+
+def test_metrics_exposes_stage_histogram():
+    asyncio.run(optimize(OptimizeRequest(tracks=synthetic_tracks(4), mode="greedy")))
+
+    response = asyncio.run(metrics())
+    body = response.body.decode()
+    assert 'ga_optimizer_stage_seconds_bucket{le="0.0005",mode="greedy",stage="parse"}' in body
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import ga_service
+from ga_service import SessionCreateRequest, SessionSolveRequest, create_session, solve_session
+from optimizer import (
+    _prepare_track_features,
+    build_component_matrices,
+    combine_transition_components,
+    transition_score,
+)
+from sessions import OptimizerSession, SessionStore, SessionTooLargeError
+
+
+def _crate():
+    return [
+        {
+            "title": "opener",
+            "artist": "A",
+            "genres": ["Electronic"],
+            "styles": ["Deep House"],
+            "bpm": 118,
+            "key": "8A",
+            "danceability": 0.4,
+            "embedding": json.dumps([1.0, 0.0]),
+        },
+        {
+            "title": "groove",
+            "artist": "B",
+            "album": "Night",
+            "genres": ["Electronic"],
+            "styles": ["Deep House"],
+            "bpm": 122,
+            "key": "9A",
+            "danceability": 0.6,
+            "embedding": json.dumps([0.9, 0.1]),
+        },
+        {
+            "title": "jazz",
+            "artist": "C",
+            "genres": ["Jazz"],
+            "styles": ["Soul Jazz"],
+            "bpm": 95,
+            "key": "C major",
+            "danceability": 0.3,
+            "embedding": json.dumps([0.0, 1.0]),
+        },
+        {
+            "title": "peak",
+            "artist": "B",
+            "album": "Night",
+            "genres": ["Electronic"],
+            "styles": ["Techno"],
+            "bpm": 128,
+            "key": "F#m",
+            "danceability": 0.9,
+        },
+    ]
+
+
+def test_component_matrices_reproduce_transition_score():
+    tracks = _crate()
+    components = build_component_matrices(_prepare_track_features(tracks))
+    combined = combine_transition_components(components)
+
+    for i, track_a in enumerate(tracks):
+        for j, track_b in enumerate(tracks):
+            if i != j:
+                assert combined[i, j] == pytest.approx(transition_score(track_a, track_b))
+
+
+def test_combine_rejects_unknown_weights():
+    components = build_component_matrices(_prepare_track_features(_crate()))
+
+    with pytest.raises(ValueError):
+        combine_transition_components(components, {"tempo": 1.0})
+
+
+def test_session_solve_reweights_and_pins_start(monkeypatch):
+    monkeypatch.setattr(ga_service, "session_store", SessionStore())
+    created = asyncio.run(create_session(SessionCreateRequest(tracks=_crate())))
+    session_id = created["session_id"]
+
+    embedding_only = {
+        "metadata": 0.0,
+        "energy": 0.0,
+        "bpm": 0.0,
+        "key": 0.0,
+        "same_artist": 0.0,
+        "same_album": 0.0,
+    }
+    for mode in ("greedy", "cohesive_blocks"):
+        solved = asyncio.run(
+            solve_session(
+                session_id,
+                SessionSolveRequest(mode=mode, weights=embedding_only, start_idx=2),
+            )
+        )
+        assert solved["order"][0] == 2
+        assert sorted(solved["order"]) == [0, 1, 2, 3]
+        assert solved["result"][0]["title"] == "jazz"
+
+
+def test_session_solve_honours_strict_harmonic(monkeypatch):
+    monkeypatch.setattr(ga_service, "session_store", SessionStore())
+    session_id = asyncio.run(create_session(SessionCreateRequest(tracks=_crate())))["session_id"]
+    embedding_only = {"metadata": 0.0, "energy": 0.0, "bpm": 0.0, "key": 0.0, "same_artist": 0.0, "same_album": 0.0}
+
+    def solve(strict_harmonic):
+        request = SessionSolveRequest(weights=embedding_only, start_idx=2, strict_harmonic=strict_harmonic)
+        return asyncio.run(solve_session(session_id, request))["order"]
+
+    # jazz (8B) sounds closest to groove (9A), a clash; opener (8A) is its relative.
+    assert solve(False)[:2] == [2, 1]
+    assert solve(True)[:2] == [2, 0]
+
+
+def test_session_solve_unknown_session_is_404(monkeypatch):
+    monkeypatch.setattr(ga_service, "session_store", SessionStore())
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(solve_session("missing", SessionSolveRequest()))
+    assert excinfo.value.status_code == 404
+
+
+def test_session_store_expires_idle_sessions_and_caps_bytes():
+    now = [0.0]
+    session = OptimizerSession.from_tracks(_crate())
+    store = SessionStore(ttl_seconds=10, max_bytes=session.nbytes * 2, clock=lambda: now[0])
+
+    first = store.add(session)
+    second = store.add(OptimizerSession.from_tracks(_crate()))
+    now[0] = 5.0
+    assert store.get(first.session_id) is first
+
+    third = store.add(OptimizerSession.from_tracks(_crate()))
+    assert store.get(second.session_id) is None
+    assert store.get(third.session_id) is third
+
+    now[0] = 20.0
+    assert store.get(first.session_id) is None
+    assert store.stats()["bytes"] == 0
+
+    with pytest.raises(SessionTooLargeError):
+        SessionStore(max_bytes=1).add(OptimizerSession.from_tracks(_crate()))
+
+
+def test_oversized_crates_are_rejected_before_building_matrices(monkeypatch):
+    session = OptimizerSession.from_tracks(_crate())
+    assert OptimizerSession.estimated_nbytes(len(_crate())) <= session.nbytes
+
+    def build(*args, **kwargs):
+        raise AssertionError("component matrices were built for a rejected crate")
+
+    monkeypatch.setattr(ga_service, "session_store", SessionStore(max_bytes=session.nbytes // 2))
+    monkeypatch.setattr(OptimizerSession, "from_tracks", build)
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(create_session(SessionCreateRequest(tracks=_crate())))
+    assert excinfo.value.status_code == 400
+    assert "byte cache limit" in excinfo.value.detail
@@ -4,6 +4,7 @@ POSTGRES_DB=djplaylist
 DISCOGS_FOLDER_ID=0
 APP_AUDIO_MOUNT=/Volumes/music:/app/audio
 WORKER_AUDIO_MOUNT=/Volumes/music:/app/audio
+ESSENTIA_AUDIO_MOUNT=/Volumes/music:/app/audio
 APP_ALBUM_COVERS_SRC=/Users/saegey/groovenet-covers
 WORKER_ALBUM_COVERS_SRC=/Users/saegey/groovenet-covers
 NEXT_PUBLIC_POSTHOG_HOST=https://us.i.posthog.com